@@ -62,6 +62,7 @@ CREATE TABLE `document` (
   `version` int(11) NOT NULL DEFAULT 1,
   `type` varchar(124) DEFAULT NULL,
   `content` longtext NOT NULL,
+  `structure_index` mediumtext DEFAULT NULL,
   `document_token_length` int(11) NOT NULL DEFAULT 0,
   `full_text_available` tinyint(1) NOT NULL DEFAULT 0,
   `source` varchar(24) DEFAULT NULL,
@@ -144,6 +145,9 @@ CREATE TABLE `rag_index` (
   `content_sha256` char(64) DEFAULT NULL,
   `version` int(11) NOT NULL DEFAULT 1,
   `embedding_model` varchar(64) NOT NULL,
+  `embedding_dim` int(11) DEFAULT NULL,
+  `chunk_tokens` int(11) DEFAULT NULL,
+  `chunk_overlap` int(11) DEFAULT NULL,
   `vector_backend` varchar(32) NOT NULL,
   `collection` varchar(64) NOT NULL DEFAULT 'nhlbi',
   `chunk_count` int(11) NOT NULL DEFAULT 0,
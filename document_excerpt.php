@@ -2,6 +2,7 @@
 declare(strict_types=1);
 
 require_once __DIR__ . '/bootstrap.php';
+require_once __DIR__ . '/inc/document_structure.php';
 
 header('Content-Type: application/json');
 
@@ -26,6 +27,7 @@ if (!$docId || $docId < 1) {
     exit;
 }
 
+$pageLabel = trim((string)(filter_input(INPUT_GET, 'page') ?? ''));
 $userId = $_SESSION['user_data']['userid'];
 
 try {
@@ -105,6 +107,9 @@ try {
     $excerpt = '';
     $truncated = false;
 
+    // A single page/slide/sheet is read by byte range from the parser's structure index
+    $section = (!$isImage && $pageLabel !== '') ? document_structure_section($pdo, (int)$docId, $pageLabel) : null;
+
     if ($isImage) {
         if ($rawContent !== '') {
             $excerpt = 'Image preview available.';
@@ -114,7 +119,7 @@ try {
             $hasPreview = false;
         }
     } elseif ($hasPreview) {
-        $excerpt = $rawContent;
+        $excerpt = $section !== null ? $section['text'] : $rawContent;
         if (function_exists('mb_strlen')) {
             if (mb_strlen($excerpt, 'UTF-8') > $maxPreviewChars) {
                 $excerpt = mb_substr($excerpt, 0, $maxPreviewChars, 'UTF-8');
@@ -144,6 +149,9 @@ try {
         'generated_at'         => date('c'),
         'image_src'            => ($isImage && $rawContent !== '') ? $rawContent : null,
         'document_content'     => (!$isImage && $hasPreview) ? $rawContent : null,
+        'page'                 => $section['label'] ?? null,
+        'page_unit'            => $section['unit'] ?? null,
+        'pages'                => $section['labels'] ?? null,
     ];
 
     echo json_encode([
@@ -3,6 +3,20 @@
 # RAG TOOLS
 
 require_once __DIR__ . '/rag_paths.php';
+require_once __DIR__ . '/local_service.php';
+
+// Location of the retrieval service socket ([rag] service_socket in the INI)
+function rag_service_socket_path() {
+    global $config;
+    if (!empty($config['rag']['service_socket'])) {
+        return (string)$config['rag']['service_socket'];
+    }
+    $env = getenv('RAG_SERVICE_SOCKET');
+    if ($env !== false && $env !== '') {
+        return $env;
+    }
+    return sys_get_temp_dir() . '/nhlbi_rag_service.sock';
+}
 
 /**
  * Helper function to call the Python RAG script.
@@ -74,6 +88,10 @@ function run_rag($question, $chat_id, $user, $config_path, $timeoutSec = 20, arr
         'max_context_tokens' => 50000,
         'config_path' => $config_path,
     ];
+    // Snippet budgets are counted with the chat deployment's encoding (see encoding_registry.py)
+    if (!empty($options['deployment'])) {
+        $payload['deployment'] = (string)$options['deployment'];
+    }
     if (!empty($documentIds)) {
         $payload['document_ids'] = array_values(array_unique(array_map('intval', $documentIds)));
     }
@@ -86,6 +104,35 @@ function run_rag($question, $chat_id, $user, $config_path, $timeoutSec = 20, arr
             $payload['max_context_tokens'] = (int)$options['max_context_tokens'];
         }
     }
+
+    // Warm service first (rag_service.py); the per-turn CLI below is the fallback
+    $socket = rag_service_socket_path();
+    $started = microtime(true);
+    $failure = null;
+    $reply = local_service_call($socket, ['op' => 'retrieve'] + $payload, (float)$timeoutSec, $failure);
+    if ($failure === 'timeout') {
+        // The service is up but slow; a CLI run would only double the wait for the same answer
+        return [
+            'rc'      => 124,
+            'cmd'     => 'service:' . $socket,
+            'stdout'  => '',
+            'stderr'  => 'RAG service did not answer within ' . $timeoutSec . 's',
+            'json'    => null,
+            'payload' => $payload,
+        ];
+    }
+    if (is_array($reply)) {
+        $failed = isset($reply['error']) || (isset($reply['ok']) && !$reply['ok']);
+        return [
+            'rc'      => $failed ? 1 : 0,
+            'cmd'     => 'service:' . $socket,
+            'stdout'  => json_encode($reply),
+            'stderr'  => $failed ? (string)($reply['error'] ?? '') : '',
+            'json'    => $reply,
+            'payload' => $payload,
+        ];
+    }
+
     $tmp = tempnam(sys_get_temp_dir(), 'ragq_').'.json';
     file_put_contents($tmp, json_encode($payload));
 
@@ -107,7 +154,21 @@ function run_rag($question, $chat_id, $user, $config_path, $timeoutSec = 20, arr
         ];
     }
 
-    $cmd = escapeshellarg($timeout).' '.((int)$timeoutSec).' '
+    // The CLI only gets what is left of the turn's budget after the service attempt
+    $remaining = (int)floor((float)$timeoutSec - (microtime(true) - $started));
+    if ($remaining < 1) {
+        @unlink($tmp);
+        return [
+            'rc'      => 124,
+            'cmd'     => '',
+            'stdout'  => '',
+            'stderr'  => 'RAG timeout spent before the CLI fallback could start',
+            'json'    => null,
+            'payload' => $payload,
+        ];
+    }
+
+    $cmd = escapeshellarg($timeout).' '.$remaining.' '
          . escapeshellarg($python).' '.escapeshellarg($script)
          .' --json '.escapeshellarg($tmp)
          .' 2>'.escapeshellarg($errFile);
@@ -255,10 +255,11 @@ function stream_emit_event(?array &$streamOptions, string $type, array $payload
  * @param string   $content          The document body.
  * @param int      $tokenBudget      Maximum tokens allowed for the snippet.
  * @param int|null $knownTokenLength Optional precomputed token length for the full content.
+ * @param array|null $budgetFit      Optional token_counter_fit() entry for this budget.
  *
  * @return array{text:string,tokens:int,truncated:bool}
  */
-function truncate_document_for_budget(string $content, int $tokenBudget, ?int $knownTokenLength = null): array {
+function truncate_document_for_budget(string $content, int $tokenBudget, ?int $knownTokenLength = null, ?array $budgetFit = null): array {
     $tokenBudget = max(0, (int)$tokenBudget);
     $totalTokens = $knownTokenLength ?? estimate_tokens($content);
 
@@ -274,27 +275,44 @@ function truncate_document_for_budget(string $content, int $tokenBudget, ?int $k
         return ['text' => '', 'tokens' => 0, 'truncated' => false];
     }
 
-    $low = 0;
-    $high = $length;
+    // One encode via the token counter service gives the exact cut; without it,
+    // fall back to searching on the local estimate.
+    if ($budgetFit === null && function_exists('token_counter_fit')) {
+        $fits = token_counter_fit($content, [$tokenBudget], null, false);
+        $budgetFit = $fits[0] ?? null;
+    }
+
     $best = '';
     $bestTokens = 0;
 
-    while ($low <= $high) {
-        $mid = (int)floor(($low + $high) / 2);
-        if ($mid <= 0) {
-            $candidate = '';
-            $tokens = 0;
-        } else {
-            $candidate = mb_substr($content, 0, $mid, 'UTF-8');
-            $tokens = estimate_tokens($candidate);
+    if ($budgetFit !== null && isset($budgetFit['prefix_chars'])) {
+        $prefixChars = (int)$budgetFit['prefix_chars'];
+        if ($prefixChars >= $length) {
+            return ['text' => $content, 'tokens' => (int)$budgetFit['prefix_tokens'], 'truncated' => false];
         }
+        $best = mb_substr($content, 0, $prefixChars, 'UTF-8');
+        $bestTokens = (int)$budgetFit['prefix_tokens'];
+    } else {
+        $low = 0;
+        $high = $length;
+
+        while ($low <= $high) {
+            $mid = (int)floor(($low + $high) / 2);
+            if ($mid <= 0) {
+                $candidate = '';
+                $tokens = 0;
+            } else {
+                $candidate = mb_substr($content, 0, $mid, 'UTF-8');
+                $tokens = estimate_tokens($candidate);
+            }
 
-        if ($tokens <= $tokenBudget) {
-            $best = $candidate;
-            $bestTokens = $tokens;
-            $low = $mid + 1;
-        } else {
-            $high = $mid - 1;
+            if ($tokens <= $tokenBudget) {
+                $best = $candidate;
+                $bestTokens = $tokens;
+                $low = $mid + 1;
+            } else {
+                $high = $mid - 1;
+            }
         }
     }
 
@@ -359,14 +377,23 @@ function build_oversize_excerpt(string $content, int $tokenBudget, ?int $tokenCo
     $headBudget = (int)max(120, floor($tokenBudget * 0.65));
     $tailBudget = max(0, $tokenBudget - $headBudget);
 
-    $head = truncate_document_for_budget($content, $headBudget, ($tokenCount <= $headBudget) ? $tokenCount : null);
+    // Head and tail cuts from a single encode of the submission.
+    $fits = function_exists('token_counter_fit')
+        ? token_counter_fit($content, [$headBudget, max(1, $tailBudget)])
+        : null;
+
+    $head = truncate_document_for_budget($content, $headBudget, ($tokenCount <= $headBudget) ? $tokenCount : null, $fits[0] ?? null);
     $excerpt = rtrim($head['text']);
 
     if ($tokenCount > $tokenBudget && $tailBudget > 0) {
-        $charBudget = max(240, (int)round($tailBudget * 3));
         $length = mb_strlen($content, 'UTF-8');
+        if (isset($fits[1]['suffix_start'])) {
+            $tailStart = (int)$fits[1]['suffix_start'];
+        } else {
+            $tailStart = max(0, $length - max(240, (int)round($tailBudget * 3)));
+        }
         if ($length > 0) {
-            $tail = mb_substr($content, max(0, $length - $charBudget), null, 'UTF-8');
+            $tail = mb_substr($content, $tailStart, null, 'UTF-8');
             $tail = trim($tail);
             if ($tail !== '') {
                 $excerpt = rtrim($excerpt)
@@ -423,7 +450,7 @@ function maybe_promote_oversize_prompt(string $message, string $chat_id, string
     }
 
     try {
-        $tokenCount = get_token_count($message, 'cl100k_base');
+        $tokenCount = get_token_count($message, $active_config['deployment'] ?? null);
     } catch (Throwable $e) {
         error_log('Failed to count tokens for oversize detection: ' . $e->getMessage());
         $tokenCount = $approxTokens;
@@ -1469,7 +1496,7 @@ function handle_chat_request($message, $chat_id, $user, $active_config, array $c
 
     if ($shouldRunRag) {
         $userForIndex = $_SESSION['user_data']['userid'] ?? $user;
-        $ragOptions = [];
+        $ragOptions = ['deployment' => $active_config['deployment'] ?? null];
         if ($ragFullDocMode) {
             $ragOptions['mode'] = 'full_document_chunks';
             $ragOptions['max_chunks'] = 99999;
@@ -1,15 +1,32 @@
 #!/usr/bin/env python3
 # build_index.py
 
-import os, sys, json, hashlib, time, math, random, signal
-from typing import List, Dict, Any
+import os, sys, json, uuid, base64, hashlib, time, math, random, signal, threading, tempfile
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+from typing import List, Dict, Any, Optional
+import numpy as np  # installed with qdrant-client
 import pymysql
 import requests
-import tiktoken
 import configparser
 
+try:
+    from encoding_registry import get_encoding, register_deployments, DEFAULT_EMBEDDING_ENCODING
+    from index_pipeline import run_pipeline, PipelineCancelled
+    from embedding_cache import EmbeddingCache
+    from text_chunker import TokenChunker, iter_file_chunks, load_structure
+except ImportError:
+    from inc.encoding_registry import get_encoding, register_deployments, DEFAULT_EMBEDDING_ENCODING
+    from inc.index_pipeline import run_pipeline, PipelineCancelled
+    from inc.embedding_cache import EmbeddingCache
+    from inc.text_chunker import TokenChunker, iter_file_chunks, load_structure
+
 from qdrant_client import QdrantClient
-from qdrant_client.http.models import PointStruct, Distance, VectorParams
+from qdrant_client.http import models as qmodels
+from qdrant_client.http.models import (
+    Distance, VectorParams, Filter, FieldCondition, MatchValue,
+    FilterSelector, SetPayload, SetPayloadOperation,
+)
 
 # ---------------- Defaults (override via INI) ----------------
 DB = {
@@ -26,6 +43,49 @@ DB = {
 QDRANT_URL        = "http://127.0.0.1:6333"
 QDRANT_API_KEY    = ""
 QDRANT_COLLECTION = "nhlbi"
+# Alias the live collection is reached through ([qdrant] alias); migrate_collection.py
+# builds a new collection and swaps the alias to it. Empty: use QDRANT_COLLECTION as is.
+QDRANT_ALIAS      = ""
+
+# Collection storage profile ([qdrant] quantization = none|int8|binary,
+# on_disk_vectors, hnsw_m, ef_construct), applied by ensure_collection() to new
+# and existing collections. Quantized vectors stay in RAM; with on_disk_vectors
+# the float32 originals move to disk and are only read to rescore.
+COLLECTION_PROFILE = {
+    "quantization": "none",
+    "on_disk_vectors": False,
+    "hnsw_m": None,
+    "ef_construct": None,
+}
+QUANTIZATION_KINDS = ("none", "int8", "binary")
+
+# Qdrant transport and upload settings ([qdrant] prefer_grpc, grpc_port,
+# upload_parallel, upload_batch, upload_retries, upload_wait). Uploads go out with
+# wait=False from `upload_parallel` threads; one wait=True write before ready=1 is
+# the barrier. That relies on Qdrant applying a shard's updates in order, which only
+# holds per shard on a single node: on a cluster (several shards or replicas) set
+# upload_wait = 1 so every upsert is applied before it is acknowledged.
+QDRANT_UPLOAD = {
+    "prefer_grpc": False,
+    "grpc_port": 6334,
+    "parallel": 2,
+    "batch": 64,
+    "retries": 4,
+    "wait": False,
+}
+
+# Payload indexes ensure_collection() keeps on the collection: every retrieval
+# filters on user_id/chat_id/deleted (often document_id), reuse and incremental
+# re-index filter on document_id/version/embedding_model, cleanup deletes by
+# document_id. user_id is the tenant key, so Qdrant co-locates each user's points.
+PAYLOAD_INDEXES = (
+    ("user_id", "keyword", True),
+    ("chat_id", "keyword", False),
+    ("document_id", "integer", False),
+    ("deleted", "bool", False),
+    ("embedding_model", "keyword", False),
+    ("version", "integer", False),
+)
 
 AZURE = {
     "key": "",
@@ -41,6 +101,24 @@ OPENAI = {
 
 # 1536 for text-embedding-3-small, 3072 for -large
 EMBED_DIM = 1536
+# Requested vector size (`dimensions` in [azure-embedding] / [openai-embedding]);
+# text-embedding-3 models shorten their vectors to it. None keeps the model's own size.
+EMBED_DIMENSIONS: Optional[int] = None
+
+# Embedding requests kept in flight at once ([azure-embedding] / [openai-embedding] concurrency)
+EMBED_CONCURRENCY = 4
+
+# Chunk-embedding cache keyed by (model, dimensions, sha256 of the chunk text);
+# [rag] chunk_cache_* in the INI, an empty path disables it. It lives in /var/tmp
+# (disk-backed on most hosts, unlike a tmpfs /tmp) and is capped by vector bytes:
+# 1 GiB holds ~87k 3072-dim or ~175k 1536-dim vectors.
+CHUNK_CACHE = {
+    "path": os.path.join("/var/tmp" if os.path.isdir("/var/tmp") else tempfile.gettempdir(),
+                         "nhlbi_chunk_embeddings.sqlite3"),
+    "ttl_seconds": 90 * 86400,
+    "max_entries": 500000,
+    "max_mb": 1024,
+}
 
 # ---------------- Config helpers ----------------
 def _guess_config_path_from_dir() -> str:
@@ -63,10 +141,11 @@ def _unquote(v: str) -> str:
     return v
 
 def load_ini(path: str):
-    global DB, QDRANT_URL, QDRANT_API_KEY, QDRANT_COLLECTION, AZURE, OPENAI, EMBED_DIM
+    global DB, QDRANT_URL, QDRANT_API_KEY, QDRANT_COLLECTION, QDRANT_ALIAS, AZURE, OPENAI, EMBED_DIM, EMBED_DIMENSIONS, EMBED_CONCURRENCY
     cfg = configparser.ConfigParser(interpolation=None)
     if not path or not cfg.read(path):
         raise RuntimeError(f"Config file not readable: {path}")
+    register_deployments(cfg)
 
     # database
     if "database" in cfg:
@@ -80,6 +159,15 @@ def load_ini(path: str):
         QDRANT_URL        = _unquote(cfg["qdrant"].get("url", QDRANT_URL))
         QDRANT_API_KEY    = _unquote(cfg["qdrant"].get("api_key", QDRANT_API_KEY))
         QDRANT_COLLECTION = _unquote(cfg["qdrant"].get("collection", QDRANT_COLLECTION))
+        QDRANT_ALIAS      = _unquote(cfg["qdrant"].get("alias", QDRANT_ALIAS))
+        load_collection_profile(cfg["qdrant"])
+        q = cfg["qdrant"]
+        QDRANT_UPLOAD["prefer_grpc"] = _unquote(q.get("prefer_grpc", "0")).lower() in ("1", "true", "yes", "on")
+        QDRANT_UPLOAD["grpc_port"] = int(_unquote(q.get("grpc_port", str(QDRANT_UPLOAD["grpc_port"]))))
+        QDRANT_UPLOAD["parallel"] = max(1, int(_unquote(q.get("upload_parallel", str(QDRANT_UPLOAD["parallel"])))))
+        QDRANT_UPLOAD["batch"] = max(1, int(_unquote(q.get("upload_batch", str(QDRANT_UPLOAD["batch"])))))
+        QDRANT_UPLOAD["retries"] = max(0, int(_unquote(q.get("upload_retries", str(QDRANT_UPLOAD["retries"])))))
+        QDRANT_UPLOAD["wait"] = _unquote(q.get("upload_wait", "0")).lower() in ("1", "true", "yes", "on")
 
     # embeddings (azure)
     if "azure-embedding" in cfg:
@@ -87,14 +175,43 @@ def load_ini(path: str):
         AZURE["endpoint"]   = _unquote(cfg["azure-embedding"].get("url", AZURE["endpoint"]))
         AZURE["deployment"] = _unquote(cfg["azure-embedding"].get("deployment_name", AZURE["deployment"]))
         AZURE["api_version"]= _unquote(cfg["azure-embedding"].get("api_version", AZURE["api_version"]))
-        EMBED_DIM = 3072 if "large" in AZURE["deployment"] else 1536
+        EMBED_DIMENSIONS = _dimensions(cfg["azure-embedding"])
+        EMBED_DIM = EMBED_DIMENSIONS or (3072 if "large" in AZURE["deployment"] else 1536)
+        EMBED_CONCURRENCY = int(_unquote(cfg["azure-embedding"].get("concurrency", str(EMBED_CONCURRENCY))))
 
     # or OpenAI-compatible backend
     if "openai-embedding" in cfg:
         OPENAI["key"]   = _unquote(cfg["openai-embedding"].get("api_key", OPENAI["key"]))
         OPENAI["base"]  = _unquote(cfg["openai-embedding"].get("base", OPENAI["base"]))
         OPENAI["model"] = _unquote(cfg["openai-embedding"].get("model", OPENAI["model"]))
-        EMBED_DIM = 3072 if "large" in OPENAI["model"] else 1536
+        EMBED_DIMENSIONS = _dimensions(cfg["openai-embedding"])
+        EMBED_DIM = EMBED_DIMENSIONS or (3072 if "large" in OPENAI["model"] else 1536)
+        EMBED_CONCURRENCY = int(_unquote(cfg["openai-embedding"].get("concurrency", str(EMBED_CONCURRENCY))))
+
+    if "rag" in cfg:
+        CHUNK_CACHE["path"] = _unquote(cfg["rag"].get("chunk_cache_path", CHUNK_CACHE["path"]))
+        CHUNK_CACHE["ttl_seconds"] = int(_unquote(cfg["rag"].get("chunk_cache_ttl", str(CHUNK_CACHE["ttl_seconds"]))))
+        CHUNK_CACHE["max_entries"] = int(_unquote(cfg["rag"].get("chunk_cache_max_entries", str(CHUNK_CACHE["max_entries"]))))
+        CHUNK_CACHE["max_mb"] = int(_unquote(cfg["rag"].get("chunk_cache_max_mb", str(CHUNK_CACHE["max_mb"]))))
+
+def _dimensions(section) -> Optional[int]:
+    raw = _unquote(section.get("dimensions", ""))
+    if not raw:
+        return None
+    dims = int(raw)
+    if dims < 1:
+        raise RuntimeError(f"embedding dimensions must be positive, got {dims}")
+    return dims
+
+def load_collection_profile(section):
+    kind = _unquote(section.get("quantization", COLLECTION_PROFILE["quantization"])).lower() or "none"
+    if kind not in QUANTIZATION_KINDS:
+        raise RuntimeError(f"[qdrant] quantization must be one of {', '.join(QUANTIZATION_KINDS)}, got '{kind}'")
+    COLLECTION_PROFILE["quantization"] = kind
+    COLLECTION_PROFILE["on_disk_vectors"] = _unquote(section.get("on_disk_vectors", "0")).lower() in ("1", "true", "yes", "on")
+    for key in ("hnsw_m", "ef_construct"):
+        raw = _unquote(section.get(key, ""))
+        COLLECTION_PROFILE[key] = int(raw) if raw else None
 
 # ---------------- Utilities ----------------
 def read_input() -> Dict[str, Any]:
@@ -112,24 +229,16 @@ def db_conn():
     return pymysql.connect(**DB)
 
 def token_encoder():
-    try:
-        return tiktoken.get_encoding("cl100k_base")
-    except Exception:
-        return tiktoken.encoding_for_model("gpt-4o-mini")  # fallback
+    # Chunks are sized for the embedding model, not the chat deployment
+    model = AZURE["deployment"] if AZURE["key"] and AZURE["endpoint"] else OPENAI["model"]
+    return get_encoding(model, DEFAULT_EMBEDDING_ENCODING)
 
 def chunk_text(text: str, max_tokens=450, overlap=50) -> List[str]:
-    enc = token_encoder()
-    toks = enc.encode(text)
-    out = []
-    start = 0
-    while start < len(toks):
-        end = min(start + max_tokens, len(toks))
-        chunk = enc.decode(toks[start:end])
-        out.append(chunk)
-        if end == len(toks):
-            break
-        start = max(0, end - overlap)
-    return out
+    chunker = TokenChunker(token_encoder(), max_tokens, overlap)
+    return list(chunker.feed(text)) + list(chunker.finish())
+
+def sha256_text(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
 
 def sha256_file(path: str) -> str:
     h = hashlib.sha256()
@@ -139,43 +248,182 @@ def sha256_file(path: str) -> str:
     return h.hexdigest()
 
 # ---------------- Robust HTTP with retry ----------------
-def _post_json_with_retry(url: str, headers: Dict[str, str], payload: Dict[str, Any], timeout: int = 60):
+_SESSION = None
+_SESSION_LOCK = threading.Lock()
+_LIMITER = None
+
+def http_session() -> requests.Session:
+    """Keep-alive session shared by the embedding threads."""
+    global _SESSION
+    with _SESSION_LOCK:
+        if _SESSION is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=max(8, EMBED_CONCURRENCY * 2))
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _SESSION = session
+        return _SESSION
+
+def _retry_after_seconds(headers) -> float:
+    """Delay asked for by Retry-After / retry-after-ms / x-ratelimit-reset-*, or 0."""
+    if not headers:
+        return 0.0
+    ms = headers.get("retry-after-ms")
+    if ms:
+        try:
+            return max(0.0, float(ms) / 1000.0)
+        except ValueError:
+            pass
+    value = headers.get("Retry-After") or headers.get("x-ratelimit-reset-requests") or headers.get("x-ratelimit-reset-tokens")
+    if not value:
+        return 0.0
+    value = value.strip()
+    try:
+        return max(0.0, float(value.rstrip("s")))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return 0.0
+
+class AdaptiveLimiter:
+    """
+    Caps requests in flight. A 429 halves the cap and pauses new requests for the
+    server's Retry-After; low x-ratelimit-remaining-* headers shrink it as well;
+    each run of clean responses lets it grow back by one up to the configured max.
+    """
+
+    def __init__(self, max_concurrency: int):
+        self.max = max(1, int(max_concurrency))
+        self.limit = self.max
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self._clean = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while True:
+                wait = self.paused_until - time.time()
+                if wait <= 0 and self.in_flight < self.limit:
+                    self.in_flight += 1
+                    return
+                self._cond.wait(timeout=wait if wait > 0 else None)
+
+    def release(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    def throttled(self, delay: float):
+        with self._cond:
+            self.limit = max(1, self.limit // 2)
+            self._clean = 0
+            self.paused_until = max(self.paused_until, time.time() + delay)
+            self._cond.notify_all()
+
+    def succeeded(self, headers):
+        remaining = None
+        for name in ("x-ratelimit-remaining-requests", "x-ratelimit-remaining-tokens"):
+            value = (headers or {}).get(name)
+            if value is not None:
+                try:
+                    remaining = min(int(float(value)), remaining) if remaining is not None else int(float(value))
+                except ValueError:
+                    pass
+        with self._cond:
+            if remaining is not None and remaining < self.limit:
+                self.limit = max(1, remaining)
+                self._clean = 0
+            else:
+                self._clean += 1
+                if self._clean >= 2 * self.limit and self.limit < self.max:
+                    self.limit += 1
+                    self._clean = 0
+            self._cond.notify_all()
+
+def embed_limiter() -> AdaptiveLimiter:
+    """One limiter per process, so every caller shares the deployment's rate limit."""
+    global _LIMITER
+    with _SESSION_LOCK:
+        if _LIMITER is None or _LIMITER.max != max(1, EMBED_CONCURRENCY):
+            _LIMITER = AdaptiveLimiter(EMBED_CONCURRENCY)
+        return _LIMITER
+
+def _post_json_with_retry(url: str, headers: Dict[str, str], payload: Dict[str, Any], timeout: int = 60,
+                          limiter: AdaptiveLimiter = None):
     backoff = 1.0
     for attempt in range(8):
+        wait = 0.0
+        if limiter is not None:
+            limiter.acquire()
         try:
-            r = requests.post(url, headers=headers, json=payload, timeout=timeout)
+            r = http_session().post(url, headers=headers, json=payload, timeout=timeout)
             if r.status_code in (429, 500, 502, 503, 504):
+                wait = _retry_after_seconds(r.headers)
+                if r.status_code == 429 and limiter is not None:
+                    limiter.throttled(wait or backoff)
                 raise requests.HTTPError(f"{r.status_code} {r.text[:200]}")
             r.raise_for_status()
+            if limiter is not None:
+                limiter.succeeded(r.headers)
             return r
         except Exception as e:
             if attempt >= 7:
                 raise
-            time.sleep(backoff + random.random() * 0.5)
-            backoff = min(backoff * 2.0, 30.0)
+        finally:
+            if limiter is not None:
+                limiter.release()
+        time.sleep(max(wait, backoff + random.random() * 0.5))
+        backoff = min(backoff * 2.0, 30.0)
 
 # ---------------- Embeddings ----------------
 def embed_azure(batch: List[str]) -> List[List[float]]:
     url = f"{AZURE['endpoint'].rstrip('/')}/openai/deployments/{AZURE['deployment']}/embeddings?api-version={AZURE['api_version']}"
     headers = {"api-key": AZURE["key"], "Content-Type": "application/json"}
-    r = _post_json_with_retry(url, headers, {"input": batch}, timeout=90)
-    data = r.json()
-    vectors = [None] * len(batch)
-    for item in data["data"]:
-        vectors[item["index"]] = item["embedding"]
-    return vectors
+    r = _post_json_with_retry(url, headers, _embedding_body({"input": batch}), timeout=90, limiter=embed_limiter())
+    return _vectors_in_order(r.json(), len(batch))
 
 def embed_openai(batch: List[str]) -> List[List[float]]:
     headers = {"Authorization": f"Bearer {OPENAI['key']}", "Content-Type": "application/json"}
     url = f"{OPENAI['base'].rstrip('/')}/embeddings"
-    r = _post_json_with_retry(url, headers, {"model": OPENAI["model"], "input": batch}, timeout=90)
-    data = r.json()
-    vectors = [None] * len(batch)
-    for item in data["data"]:
-        vectors[item["index"]] = item["embedding"]
-    return vectors
-
-def embed_texts(texts: List[str], batch_size=64) -> List[List[float]]:
+    r = _post_json_with_retry(url, headers, _embedding_body({"model": OPENAI["model"], "input": batch}),
+                              timeout=90, limiter=embed_limiter())
+    return _vectors_in_order(r.json(), len(batch))
+
+def _embedding_body(body: Dict[str, Any]) -> Dict[str, Any]:
+    # Raw little-endian float32 in base64: ~4x smaller than decimal JSON and no float objects to parse
+    body["encoding_format"] = "base64"
+    if EMBED_DIMENSIONS:
+        body["dimensions"] = EMBED_DIMENSIONS
+    return body
+
+def _decode_vector(embedding) -> np.ndarray:
+    if isinstance(embedding, str):
+        return np.frombuffer(base64.b64decode(embedding), dtype="<f4")  # a view, no copy
+    return np.asarray(embedding, dtype=np.float32)  # servers that ignore encoding_format
+
+def _vectors_in_order(data: Dict[str, Any], count: int) -> np.ndarray:
+    """The response's vectors as one (count, dim) float32 matrix in input order."""
+    items = data.get("data") or []
+    if sorted(item["index"] for item in items) != list(range(count)):
+        raise RuntimeError("Embedding response missing vectors")
+    out = None
+    for item in items:
+        vec = _decode_vector(item["embedding"])
+        if EMBED_DIMENSIONS and len(vec) != EMBED_DIMENSIONS:
+            # Older models (ada-002) ignore the field instead of rejecting it
+            raise RuntimeError(f"Embedding endpoint returned {len(vec)}-dim vectors, "
+                               f"but dimensions = {EMBED_DIMENSIONS} is configured")
+        if out is None:
+            out = np.empty((count, len(vec)), dtype=np.float32)
+        out[item["index"]] = vec
+    if out is None:
+        out = np.empty((0, EMBED_DIMENSIONS or EMBED_DIM), dtype=np.float32)
+    return out
+
+def embed_texts(texts: List[str], batch_size=64) -> np.ndarray:
     if AZURE["key"] and AZURE["endpoint"]:
         fn = embed_azure
     elif OPENAI["key"]:
@@ -183,73 +431,461 @@ def embed_texts(texts: List[str], batch_size=64) -> List[List[float]]:
     else:
         raise RuntimeError("No embedding backend configured (set Azure or OpenAI env).")
 
-    vectors: List[List[float]] = []
-    for i in range(0, len(texts), batch_size):
-        batch = texts[i:i+batch_size]
-        vecs = fn(batch)
-        if any(v is None for v in vecs):
-            raise RuntimeError("Embedding response missing vectors")
-        vectors.extend(vecs)
-    return vectors
+    batches = [texts[i:i+batch_size] for i in range(0, len(texts), batch_size)]
+    workers = min(len(batches), max(1, EMBED_CONCURRENCY))
+    if workers <= 1:
+        results = [fn(batch) for batch in batches]
+    else:
+        # The limiter inside _post_json_with_retry decides how many are really in flight;
+        # map() hands results back in batch order
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="embed") as pool:
+            results = list(pool.map(fn, batches))
+
+    if not results:
+        return np.empty((0, EMBED_DIM), dtype=np.float32)
+    if len(results) == 1:
+        return np.asarray(results[0], dtype=np.float32)
+    return np.concatenate([np.asarray(v, dtype=np.float32) for v in results])
+
+def chunk_cache() -> EmbeddingCache:
+    return EmbeddingCache(CHUNK_CACHE["path"] or None, table="chunk_embedding", memory_entries=1024,
+                          max_entries=CHUNK_CACHE["max_entries"], ttl_seconds=CHUNK_CACHE["ttl_seconds"],
+                          max_bytes=CHUNK_CACHE["max_mb"] << 20)
+
+def embed_texts_cached(texts: List[str], cache: EmbeddingCache, model: str, batch_size=64):
+    """
+    embed_texts() for chunks, answering unchanged chunk text from the cache.
+    Returns (float32 matrix, hits); only the misses go to the embedding API.
+    """
+    keys = [f"{model}|{EMBED_DIM}|{sha256_text(t)}" for t in texts]
+    cached: List[Any] = [cache.get_key(k, raw=True) for k in keys]
+    missing = [i for i, v in enumerate(cached) if v is None]
+    if not missing:
+        return np.asarray(cached, dtype=np.float32), len(texts)
+    fresh = np.asarray(embed_texts([texts[i] for i in missing], batch_size=batch_size), dtype=np.float32)
+    cache.put_many((keys[i], vec) for i, vec in zip(missing, fresh))
+    if len(missing) == len(texts):
+        return fresh, 0
+    vectors = np.empty((len(texts), fresh.shape[1]), dtype=np.float32)
+    vectors[missing] = fresh
+    for i, vec in enumerate(cached):
+        if vec is not None:
+            vectors[i] = np.frombuffer(vec, dtype=np.float32)
+    return vectors, len(texts) - len(missing)
 
 # ---------------- Qdrant ----------------
 def qdrant_client() -> QdrantClient:
     # bump timeout so large upserts don't choke
+    if QDRANT_UPLOAD["prefer_grpc"]:
+        return QdrantClient(url=QDRANT_URL, api_key=QDRANT_API_KEY, timeout=600,
+                            prefer_grpc=True, grpc_port=QDRANT_UPLOAD["grpc_port"])
     return QdrantClient(url=QDRANT_URL, api_key=QDRANT_API_KEY, timeout=600.0)
 
+def live_collection(client: QdrantClient) -> str:
+    """The collection [qdrant] alias points at, or QDRANT_COLLECTION without one."""
+    if QDRANT_ALIAS:
+        for a in getattr(client.get_aliases(), "aliases", None) or []:
+            if a.alias_name == QDRANT_ALIAS:
+                return a.collection_name
+    return QDRANT_COLLECTION
+
+def _vector_params(info):
+    cfg = getattr(info, "config", None)
+    vc = getattr(getattr(cfg, "params", None), "vectors", None)
+    return vc or getattr(cfg, "vectors", None) or getattr(cfg, "vectors_config", None)
+
 def ensure_collection(client: QdrantClient, collection: str, dim: int):
     try:
+        vector_kw = {"on_disk": True} if COLLECTION_PROFILE["on_disk_vectors"] else {}
         client.create_collection(
             collection_name=collection,
-            vectors_config=VectorParams(size=dim, distance=Distance.COSINE),
+            vectors_config=VectorParams(size=dim, distance=Distance.COSINE, **vector_kw),
+            **collection_profile_kwargs(),
         )
-        return
+        existing = {}
     except Exception:
         info = client.get_collection(collection)
-        vc = getattr(info, "config", None)
-        vc = getattr(vc, "vectors", None) or getattr(vc, "vectors_config", None)
+        vc = _vector_params(info)
         size = getattr(vc, "size", None)
         if isinstance(vc, dict):
             size = vc.get("size")
         if size and int(size) != int(dim):
             raise RuntimeError(
-                f"Collection '{collection}' exists with vector size {size}, need {dim}. Drop & recreate."
+                f"Collection '{collection}' stores {size}-dim vectors but the embedding config produces {dim} "
+                f"(check `dimensions`). Use a collection per dimension, or drop & recreate."
             )
+        apply_collection_profile(client, collection, info)
+        existing = getattr(info, "payload_schema", None) or {}
+    ensure_payload_indexes(client, collection, existing)
+
+def _quantization_config(kind: str):
+    if kind == "int8":
+        return qmodels.ScalarQuantization(scalar=qmodels.ScalarQuantizationConfig(
+            type=qmodels.ScalarType.INT8, quantile=0.99, always_ram=True))
+    if kind == "binary":
+        return qmodels.BinaryQuantization(binary=qmodels.BinaryQuantizationConfig(always_ram=True))
+    return None
+
+def _hnsw_diff():
+    hnsw = {k: COLLECTION_PROFILE[name] for k, name in (("m", "hnsw_m"), ("ef_construct", "ef_construct"))
+            if COLLECTION_PROFILE[name] is not None}
+    return qmodels.HnswConfigDiff(**hnsw) if hnsw else None
+
+def collection_profile_kwargs() -> Dict[str, Any]:
+    """create_collection() arguments for COLLECTION_PROFILE beyond the vector size."""
+    kw = {}
+    hnsw = _hnsw_diff()
+    if hnsw is not None:
+        kw["hnsw_config"] = hnsw
+    quant = _quantization_config(COLLECTION_PROFILE["quantization"])
+    if quant is not None:
+        kw["quantization_config"] = quant
+    return kw
+
+def _current_quantization(info) -> str:
+    qc = getattr(getattr(info, "config", None), "quantization_config", None)
+    if getattr(qc, "scalar", None) is not None:
+        return "int8"
+    if getattr(qc, "binary", None) is not None:
+        return "binary"
+    return "none"
+
+def apply_collection_profile(client: QdrantClient, collection: str, info) -> List[str]:
+    """
+    Brings an existing collection in line with COLLECTION_PROFILE through one
+    update_collection() call; Qdrant rebuilds quantized data and the HNSW graph
+    in the background. Returns the settings that changed.
+    """
+    cfg = getattr(info, "config", None)
+    kw: Dict[str, Any] = {}
+    changed = []
+
+    kind = COLLECTION_PROFILE["quantization"]
+    if _current_quantization(info) != kind:
+        kw["quantization_config"] = _quantization_config(kind) or qmodels.Disabled.DISABLED
+        changed.append("quantization")
+
+    hnsw_cfg = getattr(cfg, "hnsw_config", None)
+    if any(COLLECTION_PROFILE[name] is not None and getattr(hnsw_cfg, attr, None) != COLLECTION_PROFILE[name]
+           for attr, name in (("m", "hnsw_m"), ("ef_construct", "ef_construct"))):
+        kw["hnsw_config"] = _hnsw_diff()
+        changed.append("hnsw")
+
+    on_disk = bool(getattr(_vector_params(info), "on_disk", False))
+    if on_disk != COLLECTION_PROFILE["on_disk_vectors"]:
+        kw["vectors_config"] = {"": qmodels.VectorParamsDiff(on_disk=COLLECTION_PROFILE["on_disk_vectors"])}
+        changed.append("on_disk_vectors")
+
+    if kw:
+        client.update_collection(collection_name=collection, **kw)
+    return changed
+
+def _payload_index_schema(kind: str, tenant: bool):
+    # is_tenant needs a client (and server) with KeywordIndexParams, Qdrant >= 1.11
+    if tenant and hasattr(qmodels, "KeywordIndexParams"):
+        return qmodels.KeywordIndexParams(type="keyword", is_tenant=True)
+    return kind
+
+def _is_tenant_index(info) -> bool:
+    params = getattr(info, "params", None)
+    return bool(getattr(params, "is_tenant", False))
+
+def ensure_payload_indexes(client: QdrantClient, collection: str, existing: Dict[str, Any]) -> List[str]:
+    """
+    Creates the PAYLOAD_INDEXES missing from `existing` (the collection's
+    payload_schema), so new and old collections converge on the same set.
+    Returns the fields indexed now.
+    """
+    created = []
+    for field, kind, tenant in PAYLOAD_INDEXES:
+        info = existing.get(field)
+        if info is not None and (not tenant or _is_tenant_index(info) or not hasattr(qmodels, "KeywordIndexParams")):
+            continue
+        client.create_payload_index(
+            collection_name=collection,
+            field_name=field,
+            field_schema=_payload_index_schema(kind, tenant),
+            wait=True,
+        )
+        created.append(field)
+    return created
 
 def _point_id_from_payload(p: Dict[str, Any]) -> str:
-    import uuid
-    key = f"{p['document_id']}|{p['version']}|{p['embedding_model']}|{p['chunk_index']}"
+    if p.get("chunk_sha256"):
+        # Content-addressed, so an unchanged chunk keeps its ID when text around it moves;
+        # the ordinal tells repeated chunks of the same document apart
+        key = f"{p['document_id']}|{p['embedding_model']}|{p['chunk_sha256']}|{p.get('chunk_ordinal', 0)}"
+    else:
+        key = f"{p['document_id']}|{p['version']}|{p['embedding_model']}|{p['chunk_index']}"
     return str(uuid.uuid5(uuid.NAMESPACE_URL, key))
 
-def upsert_points(client: QdrantClient, collection: str,
-                  vectors: List[List[float]],
-                  payloads: List[Dict[str, Any]]):
-    pts = [PointStruct(id=_point_id_from_payload(p), vector=v, payload=p) for v, p in zip(vectors, payloads)]
-    client.upsert(collection_name=collection, points=pts, wait=True)
+def upsert_points(client: QdrantClient, collection: str, vectors, payloads: List[Dict[str, Any]],
+                  wait: bool = True):
+    """Upserts one batch; `vectors` is a float32 matrix (or rows) and stays an array up to the upload."""
+    ids = [_point_id_from_payload(p) for p in payloads]
+    if not ids:
+        return
+    matrix = np.asarray(vectors, dtype=np.float32)
+    with_retry(lambda: client.upload_collection(collection_name=collection, vectors=matrix, payload=payloads,
+                                                ids=ids, batch_size=QDRANT_UPLOAD["batch"], max_retries=1,
+                                                wait=wait),
+               what=f"upsert of {len(ids)} points")
+
+_TRANSIENT_GRPC = {"UNAVAILABLE", "DEADLINE_EXCEEDED", "RESOURCE_EXHAUSTED", "ABORTED", "INTERNAL"}
+
+def _is_transient(exc: BaseException) -> bool:
+    """Connection drops, timeouts, 429/5xx (REST) and UNAVAILABLE-style gRPC codes."""
+    if isinstance(exc, (ConnectionError, TimeoutError)):
+        return True
+    status = getattr(exc, "status_code", None)
+    if status is not None:
+        return int(status) in (408, 429, 500, 502, 503, 504)
+    code = getattr(exc, "code", None)
+    if callable(code):
+        try:
+            return getattr(code(), "name", "") in _TRANSIENT_GRPC
+        except Exception:
+            return False
+    # httpx transport errors and qdrant's ResponseHandlingException wrap the socket error
+    return type(exc).__name__ in ("ResponseHandlingException", "ConnectError", "ReadTimeout",
+                                  "WriteTimeout", "RemoteProtocolError", "ReadError")
+
+def with_retry(fn, what: str = "qdrant call"):
+    backoff = 0.5
+    for attempt in range(QDRANT_UPLOAD["retries"] + 1):
+        try:
+            return fn()
+        except Exception as e:
+            if attempt >= QDRANT_UPLOAD["retries"] or not _is_transient(e):
+                raise
+            DBG(f"{what} failed ({type(e).__name__}: {e}); retry {attempt + 1} in {backoff:.1f}s")
+            time.sleep(backoff + random.random() * 0.25)
+            backoff = min(backoff * 2.0, 10.0)
+
+class PointUploader:
+    """
+    Sends upserts with wait=False (wait=True with [qdrant] upload_wait) from up
+    to `parallel` threads so the indexer does not wait for Qdrant to apply each
+    batch. submit() blocks once 2x `parallel` batches are pending; barrier()
+    waits for every acknowledgement and re-raises the first failure. Times are
+    reported by stats().
+    """
+
+    def __init__(self, client: QdrantClient, collection: str, parallel: int = 1):
+        self.client = client
+        self.collection = collection
+        self.parallel = max(1, int(parallel))
+        self._pool = ThreadPoolExecutor(max_workers=self.parallel, thread_name_prefix="upsert")
+        self._slots = threading.BoundedSemaphore(2 * self.parallel)
+        self._futures = []
+        self._lock = threading.Lock()
+        self.points = 0
+        self.batches = 0
+        self.busy_sec = 0.0
+        self.barrier_sec = 0.0
+        self._started = None
+
+    def _send(self, fn):
+        t = time.perf_counter()
+        try:
+            fn()
+        finally:
+            with self._lock:
+                self.busy_sec += time.perf_counter() - t
+            self._slots.release()
+
+    def _raise_failed(self):
+        for f in self._futures:
+            if f.done() and f.exception() is not None:
+                raise f.exception()
+
+    def submit(self, vectors, payloads: List[Dict[str, Any]]):
+        if not payloads:
+            return
+        self._raise_failed()
+        if self._started is None:
+            self._started = time.perf_counter()
+        self._slots.acquire()
+        fn = lambda: upsert_points(self.client, self.collection, vectors, payloads, wait=QDRANT_UPLOAD["wait"])
+        self._futures.append(self._pool.submit(self._send, fn))
+        self.points += len(payloads)
+        self.batches += 1
+
+    def barrier(self):
+        t = time.perf_counter()
+        try:
+            for f in self._futures:
+                f.result()
+        finally:
+            self.barrier_sec += time.perf_counter() - t
+
+    def close(self):
+        self._pool.shutdown(wait=True, cancel_futures=True)
+
+    def stats(self) -> Dict[str, Any]:
+        wall = time.perf_counter() - self._started if self._started is not None else 0.0
+        return {
+            "transport": "grpc" if QDRANT_UPLOAD["prefer_grpc"] else "rest",
+            "parallel": self.parallel,
+            "wait": QDRANT_UPLOAD["wait"],
+            "points": self.points,
+            "batches": self.batches,
+            "busy_sec": round(self.busy_sec, 3),
+            "wall_sec": round(wall, 3),
+            "barrier_sec": round(self.barrier_sec, 3),
+        }
+
+# ---------------- Incremental re-index ----------------
+def _document_filter(document_id: int, embedding_model: str) -> List[FieldCondition]:
+    return [
+        FieldCondition(key="document_id", match=MatchValue(value=int(document_id))),
+        FieldCondition(key="embedding_model", match=MatchValue(value=embedding_model)),
+    ]
+
+def existing_point_ids(client: QdrantClient, collection: str, document_id: int,
+                       embedding_model: str, page_size: int = 1024) -> set:
+    """IDs of the document's stored points; IDs only, no payloads or vectors."""
+    flt = Filter(must=_document_filter(document_id, embedding_model))
+    ids = set()
+    offset = None
+    while True:
+        points, offset = client.scroll(collection_name=collection, scroll_filter=flt, limit=page_size,
+                                       offset=offset, with_payload=False, with_vectors=False)
+        ids.update(str(p.id) for p in points)
+        if offset is None:
+            return ids
+
+def refresh_points(client: QdrantClient, collection: str, payloads: List[Dict[str, Any]], wait: bool = True):
+    """
+    Rewrites the payload of points whose chunk is unchanged (new chunk_index,
+    page_range, owner, build) without touching their vectors; one request per batch.
+    """
+    if not payloads:
+        return
+    ops = [
+        SetPayloadOperation(set_payload=SetPayload(
+            payload={k: v for k, v in p.items() if k != "chunk_text"},
+            points=[_point_id_from_payload(p)],
+        ))
+        for p in payloads
+    ]
+    with_retry(lambda: client.batch_update_points(collection_name=collection, update_operations=ops, wait=wait),
+               what=f"payload refresh of {len(ops)} points")
+
+def delete_stale_points(client: QdrantClient, collection: str, document_id: int,
+                        embedding_model: str, build_id: str):
+    """Drops every point of the document not written or refreshed by this build."""
+    flt = Filter(
+        must=_document_filter(document_id, embedding_model),
+        must_not=[FieldCondition(key="index_build", match=MatchValue(value=build_id))],
+    )
+    with_retry(lambda: client.delete(collection_name=collection, points_selector=FilterSelector(filter=flt),
+                                     wait=True),
+               what="stale point delete")
+
+def delete_build_points(client: QdrantClient, collection: str, document_id: int,
+                        embedding_model: str, build_id: str):
+    """Drops the document's points written by this build (an abandoned reuse copy)."""
+    flt = Filter(must=_document_filter(document_id, embedding_model) + [
+        FieldCondition(key="index_build", match=MatchValue(value=build_id)),
+    ])
+    with_retry(lambda: client.delete(collection_name=collection, points_selector=FilterSelector(filter=flt),
+                                     wait=True),
+               what="reuse copy delete")
+
+# ---------------- Cross-document reuse ----------------
+# Payload fields that identify the owner of a point; everything else (chunk text,
+# page_range, section, ...) is a property of the content and can be shared.
+_OWNER_FIELDS = ("user_id", "chat_id", "document_id", "version", "filename", "index_build")
+
+def find_reusable_index(cur, content_sha: str, embedding_model: str, collection: str, document_id: int,
+                        chunk_tokens: int, chunk_overlap: int):
+    """
+    A ready index of another live document with the same parsed text, model and
+    chunking, or None. Indexes built before chunking was recorded never match.
+    """
+    cur.execute("""SELECT ri.document_id, ri.version, ri.chunk_count FROM rag_index ri
+                   JOIN document d ON d.id = ri.document_id
+                   WHERE ri.content_sha256=%s AND ri.embedding_model=%s AND ri.collection=%s
+                     AND (ri.embedding_dim IS NULL OR ri.embedding_dim=%s)
+                     AND ri.chunk_tokens=%s AND ri.chunk_overlap=%s
+                     AND ri.ready=1 AND ri.chunk_count > 0 AND ri.document_id<>%s AND d.deleted=0
+                   ORDER BY ri.updated_at DESC LIMIT 1""",
+                (content_sha, embedding_model, collection, EMBED_DIM, chunk_tokens, chunk_overlap, document_id))
+    return cur.fetchone()
+
+def copy_document_points(client: QdrantClient, collection: str, source: Dict[str, Any],
+                         embedding_model: str, owner: Dict[str, Any], page_size: int = 256) -> int:
+    """
+    Copies the source document's points (vectors included) under the new owner's
+    payload and point IDs. Qdrant has no server-side copy, so vectors travel
+    scroll -> upsert, but nothing is re-embedded. Returns the number copied.
+    """
+    flt = Filter(must=[
+        FieldCondition(key="document_id", match=MatchValue(value=int(source["document_id"]))),
+        FieldCondition(key="version", match=MatchValue(value=int(source["version"]))),
+        FieldCondition(key="embedding_model", match=MatchValue(value=embedding_model)),
+        FieldCondition(key="deleted", match=MatchValue(value=False)),
+    ])
+    copied = 0
+    offset = None
+    while True:
+        points, offset = client.scroll(collection_name=collection, scroll_filter=flt, limit=page_size,
+                                       offset=offset, with_payload=True, with_vectors=True)
+        if points:
+            payloads = [dict(p.payload or {}, **owner) for p in points]
+            upsert_points(client, collection, [p.vector for p in points], payloads)
+            copied += len(points)
+        if offset is None:
+            return copied
 
 # ---------------- Text streaming ----------------
-def _open_text(path: str):
-    return open(path, "r", encoding="utf-8", errors="ignore")
-
-def stream_text_chunks(file_path: str, max_tokens: int, overlap: int):
-    buf = []
-    chars = 0
-    target_chars = 200_000
-    with _open_text(file_path) as f:
-        for line in f:
-            buf.append(line.rstrip("\n"))
-            chars += len(buf[-1]) + 1
-            if chars >= target_chars:
-                text = " ".join(buf).strip()
-                if text:
-                    for ch in chunk_text(text, max_tokens=max_tokens, overlap=overlap):
-                        yield ch
-                buf, chars = [], 0
-        if buf:
-            text = " ".join(buf).strip()
-            if text:
-                for ch in chunk_text(text, max_tokens=max_tokens, overlap=overlap):
-                    yield ch
+def stream_text_chunks(file_path: str, max_tokens: int, overlap: int, hasher=None, structure=None):
+    """
+    Token chunks of the file, read once in 256 KiB blocks; tokens and overlap carry
+    across blocks (see text_chunker.py). `hasher` sees every byte read. With a
+    parser `structure` sidecar, yields (text, labels) pairs instead of text.
+    """
+    yield from iter_file_chunks(file_path, token_encoder(), max_tokens, overlap, hasher=hasher, structure=structure)
+
+def structure_fields(unit: str, labels: List[str]) -> Dict[str, Any]:
+    """page_range/section payload fields for a chunk spanning `labels` (pages, slides or sheets)."""
+    if not labels:
+        return {"page_range": None, "section": None, "page_unit": unit}
+    span = labels[0] if len(labels) == 1 else f"{labels[0]}-{labels[-1]}"
+    if unit == "sheet":
+        return {"page_range": None, "section": span, "page_unit": unit}
+    return {"page_range": span, "section": None, "page_unit": unit}
+
+def iter_chunk_payloads(chunks, structure: Optional[Dict[str, Any]], base: Dict[str, Any],
+                        content_sha: str, embedding_model: str, build_id: str):
+    """
+    (text, payload) for each chunk from stream_text_chunks() / iter_text_chunks().
+    `base` carries the owner fields (user_id, chat_id, document_id, version, filename).
+    """
+    ordinals: Dict[str, int] = {}
+    for chunk_idx, item in enumerate(chunks):
+        if structure:
+            ch, labels = item
+            where = structure_fields(structure.get("unit"), labels)
+        else:
+            ch = item
+            where = {"page_range": str(chunk_idx + 1), "section": None}
+        chunk_sha = sha256_text(ch)
+        ordinal = ordinals.get(chunk_sha, 0)
+        ordinals[chunk_sha] = ordinal + 1
+        yield ch, {
+            **base,
+            **where,
+            "deleted": False,
+            "content_sha256": content_sha,
+            "embedding_model": embedding_model,
+            "chunk_index": chunk_idx,
+            "chunk_sha256": chunk_sha,
+            "chunk_ordinal": ordinal,
+            "index_build": build_id,
+            "chunk_text": ch
+        }
 
 # ---------------- Graceful shutdown ----------------
 _SHOULD_STOP = False
@@ -288,15 +924,34 @@ def main():
     chunk_tok = int(inp.get("chunk_tokens", 8000))
     chunk_ovl = int(inp.get("chunk_overlap", 50))
     cleanup_tmp = bool(inp.get("cleanup_tmp", False))
+    force_reembed = bool(inp.get("force_reembed", False))
+    incremental = bool(inp.get("incremental", True)) and not force_reembed
+
+    def remove_tmp():
+        if not cleanup_tmp:
+            return
+        try:
+            os.remove(file_path)
+            DBG(f"cleanup tmp removed {file_path}")
+        except Exception as _:
+            DBG(f"cleanup tmp failed {file_path}")
+        if inp.get("structure_path"):
+            try:
+                os.remove(inp["structure_path"])
+            except OSError:
+                pass
 
     DBG(f"start doc_id={document_id} chat_id={chat_id} user={user} file={file_path}")
-    DBG(f"config: collection={QDRANT_COLLECTION} model={embedding_model} dim={EMBED_DIM}")
 
     if not file_path or not os.path.exists(file_path):
         DBG(f"file not found: {file_path}")
         print(json.dumps({"ok": False, "error": f"file_path not found: {file_path}"}))
         return
 
+    qc = qdrant_client()
+    collection = live_collection(qc)
+    DBG(f"config: collection={collection} model={embedding_model} dim={EMBED_DIM}")
+
     with db_conn() as conn, conn.cursor() as cur:
         cur.execute("SELECT id, chat_id, name, type, content, file_sha256, content_sha256, version, deleted FROM document WHERE id=%s", (document_id,))
         doc = cur.fetchone()
@@ -314,50 +969,97 @@ def main():
             cur.execute("UPDATE document SET content_sha256=%s WHERE id=%s", (new_content_sha, document_id))
         DBG(f"content_sha256={new_content_sha[:12]}...")
 
-        cur.execute("""SELECT id, ready, chunk_count FROM rag_index
+        cur.execute("""SELECT id, ready, chunk_count, content_sha256, embedding_dim FROM rag_index
                        WHERE document_id=%s AND embedding_model=%s AND version=%s""",
                     (document_id, embedding_model, doc["version"]))
         ri = cur.fetchone()
         if not ri:
             cur.execute("""INSERT INTO rag_index
-                           (document_id, chat_id, user, file_sha256, content_sha256, version, embedding_model, vector_backend, collection, chunk_count, ready)
-                           VALUES (%s,%s,%s,%s,%s,%s,%s,'qdrant',%s,0,0)""",
-                        (document_id, doc["chat_id"], user or "", doc["file_sha256"], new_content_sha, doc["version"], embedding_model, QDRANT_COLLECTION))
+                           (document_id, chat_id, user, file_sha256, content_sha256, version, embedding_model, embedding_dim, chunk_tokens, chunk_overlap, vector_backend, collection, chunk_count, ready)
+                           VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,'qdrant',%s,0,0)""",
+                        (document_id, doc["chat_id"], user or "", doc["file_sha256"], new_content_sha, doc["version"], embedding_model, EMBED_DIM,
+                         chunk_tok, chunk_ovl, collection))
             rag_index_id = cur.lastrowid
             DBG(f"rag_index created id={rag_index_id}")
+        elif (ri["ready"] and ri.get("content_sha256") == new_content_sha and not force_reembed
+              and (ri.get("embedding_dim") or EMBED_DIM) == EMBED_DIM):
+            DBG(f"rag_index id={ri['id']} already ready for this content; nothing to do")
+            print(json.dumps({
+                "ok": True,
+                "document_id": document_id,
+                "content_sha256": new_content_sha,
+                "chunk_count": int(ri["chunk_count"] or 0),
+                "unchanged": True,
+                "elapsed_sec": round(time.time() - t0, 3),
+            }))
+            remove_tmp()
+            return
         else:
             rag_index_id = ri["id"]
             cur.execute("UPDATE rag_index SET ready=0 WHERE id=%s", (rag_index_id,))
             DBG(f"rag_index reuse id={rag_index_id} (reset ready=0)")
 
-    qc = qdrant_client()
-    ensure_collection(qc, QDRANT_COLLECTION, EMBED_DIM)
+    ensure_collection(qc, collection, EMBED_DIM)
     DBG("qdrant collection ensured")
 
     total_chunks = 0
-    batch_texts: List[str] = []
-    batch_payloads: List[Dict[str, Any]] = []
-    chunk_idx = 0
-    virtual_page = 0
     FLUSH_EVERY = 256
+    emb_cache = chunk_cache()
+    cache_hits = 0
+    pass_hash = hashlib.sha256()
+    structure = load_structure(inp.get("structure_path"))
+    build_id = uuid.uuid4().hex
+    existing_ids: set = set()
+    kept = embedded = 0
+    uploader = PointUploader(qc, collection, QDRANT_UPLOAD["parallel"])
 
-    def flush_batch():
-        nonlocal total_chunks, batch_texts, batch_payloads
-        if not batch_texts:
-            return
-        DBG(f"embedding batch size={len(batch_texts)}")
-        vecs = embed_texts(batch_texts, batch_size=64)
+    def chunk_batches():
+        # Source stage: chunk the file and hand over (texts, payloads) batches
+        base = {"user_id": user, "chat_id": chat_id, "document_id": document_id,
+                "version": doc.get("version", 1), "filename": filename}
+        chunks = stream_text_chunks(file_path, max_tokens=chunk_tok, overlap=chunk_ovl,
+                                    hasher=pass_hash, structure=structure)
+        batch_texts: List[str] = []
+        batch_payloads: List[Dict[str, Any]] = []
+        for ch, payload in iter_chunk_payloads(chunks, structure, base, new_content_sha, embedding_model, build_id):
+            batch_texts.append(ch)
+            batch_payloads.append(payload)
+            if len(batch_texts) >= FLUSH_EVERY:
+                yield batch_texts, batch_payloads
+                batch_texts, batch_payloads = [], []
+        if batch_texts:
+            yield batch_texts, batch_payloads
+
+    def embed_stage(batch):
+        nonlocal cache_hits, kept, embedded
+        texts, payloads = batch
+        # Chunks already stored under the same content-addressed ID skip embedding
+        keep = [_point_id_from_payload(p) in existing_ids for p in payloads]
+        fresh_texts = [t for t, k in zip(texts, keep) if not k]
+        fresh_payloads = [p for p, k in zip(payloads, keep) if not k]
+        kept_payloads = [p for p, k in zip(payloads, keep) if k]
+        vecs, hits = [], 0
+        if fresh_texts:
+            vecs, hits = embed_texts_cached(fresh_texts, emb_cache, embedding_model, batch_size=64)
+        cache_hits += hits
+        kept += len(kept_payloads)
+        embedded += len(fresh_texts)
+        DBG(f"embedding batch size={len(fresh_texts)} kept={len(kept_payloads)} cache_hits={hits}")
+        return vecs, fresh_payloads, kept_payloads
+
+    def upsert_stage(batch):
+        vecs, payloads, kept_payloads = batch
         DBG("upserting to qdrant")
-        upsert_points(qc, QDRANT_COLLECTION, vecs, batch_payloads)
-        total_chunks += len(batch_texts)
+        uploader.submit(vecs, payloads)
+        refresh_points(qc, collection, kept_payloads, wait=False)
+        return len(payloads) + len(kept_payloads)
+
+    def record_stage(count):
+        nonlocal total_chunks
+        total_chunks += count
         DBG(f"progress total_chunks={total_chunks}")
         with db_conn() as conn, conn.cursor() as cur:
             cur.execute("UPDATE rag_index SET chunk_count=%s WHERE id=%s", (total_chunks, rag_index_id))
-        batch_texts, batch_payloads = [], []
-
-    CHECK_CANCEL_INTERVAL = 0.5
-    next_cancel_check = time.time()
-    cancelled = False
 
     def is_document_cancelled() -> bool:
         with db_conn() as conn, conn.cursor() as cur_cancel:
@@ -368,56 +1070,78 @@ def main():
         deleted_flag = row.get("deleted") if isinstance(row, dict) else row[0]
         return bool(deleted_flag)
 
+    def cancel_reason():
+        if _SHOULD_STOP:
+            return "Indexing interrupted"
+        if is_document_cancelled():
+            DBG("document cancellation detected; aborting index build")
+            return "document cancelled during indexing"
+        return None
+
     try:
-        for ch in stream_text_chunks(file_path, max_tokens=chunk_tok, overlap=chunk_ovl):
-            if time.time() >= next_cancel_check:
-                if is_document_cancelled():
-                    DBG("document cancellation detected; aborting index build")
-                    cancelled = True
-                    break
-                next_cancel_check = time.time() + CHECK_CANCEL_INTERVAL
-            if _SHOULD_STOP:
-                raise RuntimeError("Indexing interrupted")
-            virtual_page += 1
-            batch_texts.append(ch)
-            batch_payloads.append({
-                "user_id": user,
-                "chat_id": chat_id,
-                "document_id": document_id,
-                "version": doc.get("version", 1),
-                "filename": filename,
-                "page_range": str(virtual_page),
-                "section": None,
-                "deleted": False,
-                "content_sha256": new_content_sha,
-                "embedding_model": embedding_model,
-                "chunk_index": chunk_idx,
-                "chunk_text": ch
-            })
-            chunk_idx += 1
-            if len(batch_texts) >= FLUSH_EVERY:
-                flush_batch()
-                if time.time() >= next_cancel_check:
-                    if is_document_cancelled():
-                        DBG("document cancellation detected after batch flush")
-                        cancelled = True
-                        break
-                    next_cancel_check = time.time() + CHECK_CANCEL_INTERVAL
-
-        if cancelled:
+        if incremental:
+            existing_ids = existing_point_ids(qc, collection, document_id, embedding_model)
+            DBG(f"incremental: {len(existing_ids)} points already stored")
+
+        # Same parsed text already indexed for someone else: copy its vectors instead.
+        # A non-incremental job re-embeds everything, so it never reuses.
+        reused_from = None
+        if incremental and not existing_ids:
             with db_conn() as conn, conn.cursor() as cur:
-                cur.execute("UPDATE rag_index SET ready=0 WHERE id=%s", (rag_index_id,))
-            raise RuntimeError("document cancelled during indexing")
+                source = find_reusable_index(cur, new_content_sha, embedding_model, collection, document_id,
+                                             chunk_tok, chunk_ovl)
+            if source:
+                owner = {"user_id": user, "chat_id": chat_id, "document_id": document_id,
+                         "version": doc.get("version", 1), "filename": filename, "index_build": build_id}
+                copied = copy_document_points(qc, collection, source, embedding_model, owner)
+                if copied == int(source["chunk_count"]):
+                    reused_from = int(source["document_id"])
+                    total_chunks = copied
+                    DBG(f"reused {copied} points from document {reused_from}")
+                else:
+                    # The partial copy carries this build's ID, so the stale delete would keep it
+                    DBG(f"reuse from document {source['document_id']} incomplete ({copied}/{source['chunk_count']}); re-indexing")
+                    delete_build_points(qc, collection, document_id, embedding_model, build_id)
+
+        if reused_from is not None:
+            stage_times = {}
+        else:
+            try:
+                stage_times = run_pipeline(
+                    chunk_batches(),
+                    [("embed", embed_stage), ("upsert", upsert_stage), ("record", record_stage)],
+                    source_name="chunk",
+                    queue_size=2,
+                    should_cancel=cancel_reason,
+                    poll_interval=0.5,
+                )
+            except PipelineCancelled as e:
+                with db_conn() as conn, conn.cursor() as cur:
+                    cur.execute("UPDATE rag_index SET ready=0 WHERE id=%s", (rag_index_id,))
+                raise RuntimeError(str(e))
+            # Surfaces any failed wait=False upload before ready=1 can be set
+            uploader.barrier()
+            # The chunker hashed the bytes it read; they must be the ones the reuse/no-op checks saw
+            if pass_hash.hexdigest() != new_content_sha:
+                raise RuntimeError("file changed while it was being indexed")
 
-        flush_batch()
         if is_document_cancelled():
             DBG("document cancellation detected before finalization")
             with db_conn() as conn, conn.cursor() as cur:
                 cur.execute("UPDATE rag_index SET ready=0 WHERE id=%s", (rag_index_id,))
             raise RuntimeError("document cancelled during indexing")
+        # Whatever this build did not write or refresh is a removed or changed chunk. This is
+        # also the consistency barrier: it is a wait=True update on the same shards, which a
+        # single-node Qdrant applies after the wait=False upserts acknowledged above (clusters
+        # need upload_wait = 1, see QDRANT_UPLOAD).
+        t_barrier = time.perf_counter()
+        delete_stale_points(qc, collection, document_id, embedding_model, build_id)
+        uploader.barrier_sec += time.perf_counter() - t_barrier
+        stale = len(existing_ids) - kept
         with db_conn() as conn, conn.cursor() as cur:
-            cur.execute("UPDATE rag_index SET chunk_count=%s, ready=1, content_sha256=%s WHERE id=%s",
-                        (total_chunks, new_content_sha, rag_index_id))
+            cur.execute("""UPDATE rag_index SET chunk_count=%s, ready=1, content_sha256=%s, embedding_dim=%s,
+                           chunk_tokens=%s, chunk_overlap=%s WHERE id=%s""",
+                        (total_chunks, new_content_sha, EMBED_DIM, chunk_tok, chunk_ovl, rag_index_id))
         DBG(f"done chunks={total_chunks}, elapsed={round(time.time()-t0,2)}s")
 
         out = {
@@ -425,8 +1149,18 @@ def main():
             "document_id": document_id,
             "content_sha256": new_content_sha,
             "chunk_count": total_chunks,
+            "embedding_dim": EMBED_DIM,
             "elapsed_sec": round(time.time() - t0, 3),
-            "streamed_file": True
+            "streamed_file": True,
+            "stages": stage_times,
+            "upsert": uploader.stats(),
+            "reused_from_document_id": reused_from,
+            "incremental": {"kept": kept, "embedded": embedded, "stale": stale},
+            "embedding_cache": {
+                "hits": cache_hits,
+                "misses": embedded - cache_hits,
+                "hit_rate": round(cache_hits / embedded, 4) if embedded else 0.0,
+            },
         }
         print(json.dumps(out))
 
@@ -439,12 +1173,8 @@ def main():
         print(json.dumps({"ok": False, "error": str(e)}))
         raise
     finally:
-        if cleanup_tmp:
-            try:
-                os.remove(file_path)
-                DBG(f"cleanup tmp removed {file_path}")
-            except Exception as _:
-                DBG(f"cleanup tmp failed {file_path}")
+        uploader.close()
+        remove_tmp()
 if __name__ == "__main__":
     try:
         main()
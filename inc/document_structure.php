@@ -0,0 +1,113 @@
+<?php
+declare(strict_types=1);
+
+/**
+ * Page/slide/sheet lookups against the structure index that parser_multi.py
+ * writes next to its text output (stored in document.structure_index).
+ *
+ * The index maps byte offsets in document.content to structural labels:
+ *   {"v":1,"unit":"page","bytes":N,"marks":[[offset,"1"],[offset,"2"],...]}
+ * so one section can be read with a byte-range SUBSTRING instead of loading
+ * and rescanning the whole text.
+ */
+
+if (!function_exists('document_structure_decode')) {
+    function document_structure_decode(?string $json): ?array
+    {
+        if ($json === null || $json === '') {
+            return null;
+        }
+        $data = json_decode($json, true);
+        if (!is_array($data) || (int)($data['v'] ?? 0) !== 1 || empty($data['marks']) || !is_array($data['marks'])) {
+            return null;
+        }
+        return $data;
+    }
+}
+
+if (!function_exists('document_structure_bounds')) {
+    /**
+     * Byte range [start, end) of the section labelled $label. A range such as
+     * "3-5" covers pages 3 through 5. Returns null when a label is unknown.
+     */
+    function document_structure_bounds(array $structure, string $label): ?array
+    {
+        $parts = explode('-', $label, 2);
+        $first = trim($parts[0]);
+        $last = isset($parts[1]) ? trim($parts[1]) : $first;
+        if (($structure['unit'] ?? null) === 'sheet') {
+            $first = $last = trim($label);  // sheet names may contain dashes
+        }
+
+        $marks = $structure['marks'];
+        $start = null;
+        $end = null;
+        foreach ($marks as $i => $mark) {
+            $markLabel = (string)($mark[1] ?? '');
+            if ($start === null && $markLabel === $first) {
+                $start = (int)$mark[0];
+            }
+            if ($start !== null && $markLabel === $last) {
+                $end = isset($marks[$i + 1]) ? (int)$marks[$i + 1][0] : (int)($structure['bytes'] ?? 0);
+                break;
+            }
+        }
+        if ($start === null || $end === null || $end <= $start) {
+            return null;
+        }
+        return [$start, $end];
+    }
+}
+
+if (!function_exists('document_structure_labels')) {
+    function document_structure_labels(array $structure): array
+    {
+        return array_map(static fn($mark) => (string)($mark[1] ?? ''), $structure['marks']);
+    }
+}
+
+if (!function_exists('document_structure_section')) {
+    /**
+     * Text of one page/slide/sheet (or a "3-5" range) of a document, read as a
+     * byte range from the database. Returns null when the document has no
+     * structure index or the label does not exist.
+     *
+     * @return array{unit: string, label: string, text: string, labels: array}|null
+     */
+    function document_structure_section(PDO $pdo, int $documentId, string $label): ?array
+    {
+        try {
+            $stmt = $pdo->prepare('SELECT structure_index FROM document WHERE id = :id LIMIT 1');
+            $stmt->execute(['id' => $documentId]);
+            $structure = document_structure_decode($stmt->fetchColumn() ?: null);
+        } catch (Throwable $e) {
+            // Schema without the structure_index column
+            return null;
+        }
+        if ($structure === null) {
+            return null;
+        }
+        $bounds = document_structure_bounds($structure, $label);
+        if ($bounds === null) {
+            return null;
+        }
+        [$start, $end] = $bounds;
+
+        $stmt = $pdo->prepare('SELECT SUBSTRING(CAST(content AS BINARY), :start, :len) FROM document WHERE id = :id LIMIT 1');
+        $stmt->bindValue(':start', $start + 1, PDO::PARAM_INT);
+        $stmt->bindValue(':len', $end - $start, PDO::PARAM_INT);
+        $stmt->bindValue(':id', $documentId, PDO::PARAM_INT);
+        $stmt->execute();
+        $text = $stmt->fetchColumn();
+        if ($text === false) {
+            return null;
+        }
+
+        return [
+            'unit'   => (string)($structure['unit'] ?? 'page'),
+            'label'  => $label,
+            'text'   => trim((string)$text),
+            'labels' => document_structure_labels($structure),
+        ];
+    }
+}
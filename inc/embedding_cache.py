@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+# embedding_cache.py
+#
+# Two-tier embedding cache keyed by (embedding model, text):
+#   - an in-process LRU (fast path for the long-running services)
+#   - a shared SQLite file holding float32 vectors, usable from any number of
+#     processes, with a TTL and eviction of the least recently used rows beyond
+#     a row count (max_entries) and a vector byte size (max_bytes)
+#
+# Eviction runs every `evict_every` stored rows or `evict_interval` seconds, not
+# on every write. The deletes walk an index from the old end, so each run costs
+# about as much as the rows it removes, plus one pass over the small `dim`
+# column when max_bytes is set.
+#
+# Keys are sha256(model + NUL + text); callers normalize text first if they want
+# near-identical inputs to share an entry (see normalize_query()).
+
+import os, re, time, sqlite3, hashlib, threading, unicodedata
+from array import array
+from collections import OrderedDict
+from typing import List, Optional
+
+_WS = re.compile(r"\s+")
+
+
+def normalize_query(text: str) -> str:
+    """Unicode NFKC plus collapsed whitespace; case is kept because it changes embeddings."""
+    return _WS.sub(" ", unicodedata.normalize("NFKC", text or "")).strip()
+
+
+def cache_key(model: str, text: str) -> str:
+    return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).hexdigest()
+
+
+def _pack(vector) -> array:
+    packed = array("f")
+    if hasattr(vector, "astype"):  # NumPy row: copy the float32 bytes instead of iterating
+        packed.frombytes(vector.astype("float32").tobytes())
+    else:
+        packed.extend(vector)
+    return packed
+
+
+class EmbeddingCache:
+    def __init__(self, path: Optional[str], table: str = "embedding_cache", memory_entries: int = 256,
+                 max_entries: int = 50000, ttl_seconds: float = 30 * 86400,
+                 evict_every: int = 4096, evict_interval: float = 600.0, max_bytes: int = 0):
+        self.path = path or None
+        self.table = table
+        self.memory_entries = max(0, int(memory_entries))
+        self.max_entries = max(0, int(max_entries))
+        self.max_bytes = max(0, int(max_bytes))  # float32 vector bytes; 0 = no byte limit
+        self.ttl = float(ttl_seconds)
+        self.hits_memory = 0
+        self.hits_disk = 0
+        self.misses = 0
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.evict_every = max(1, int(evict_every))
+        self.evict_interval = float(evict_interval)
+        self._puts_since_evict = 0
+        self._last_evict = time.time()
+
+    # ---- SQLite tier ----
+    def _db(self) -> Optional[sqlite3.Connection]:
+        if not self.path:
+            return None
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            parent = os.path.dirname(self.path)
+            if parent:
+                os.makedirs(parent, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.table} ("
+                " key TEXT PRIMARY KEY, dim INTEGER NOT NULL, vec BLOB NOT NULL,"
+                " created REAL NOT NULL, last_used REAL NOT NULL)"
+            )
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {self.table}_last_used ON {self.table} (last_used)")
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {self.table}_created ON {self.table} (created)")
+            self._local.conn = conn
+        return conn
+
+    def _expired(self, created: float, now: float) -> bool:
+        return self.ttl > 0 and now - created > self.ttl
+
+    # ---- public API ----
+    def get(self, model: str, text: str) -> Optional[List[float]]:
+        return self.get_key(cache_key(model, text))
+
+    def put(self, model: str, text: str, vector: List[float]):
+        self.put_key(cache_key(model, text), vector)
+
+    def get_key(self, key: str, raw: bool = False) -> Optional[List[float]]:
+        """The cached vector, or None. With raw=True it is an array("f") (buffer protocol, e.g. for NumPy)."""
+        return self.lookup_key(key, raw)[0]
+
+    def lookup(self, model: str, text: str):
+        return self.lookup_key(cache_key(model, text))
+
+    def lookup_key(self, key: str, raw: bool = False):
+        """Returns (vector, tier) with tier "memory", "disk" or "miss"."""
+        now = time.time()
+        with self._lock:
+            entry = self._lru.get(key)
+            if entry is not None:
+                created, vector = entry
+                if not self._expired(created, now):
+                    self._lru.move_to_end(key)
+                    self.hits_memory += 1
+                    return (array("f", vector) if raw else list(vector)), "memory"
+                del self._lru[key]
+
+        vector = None
+        created = now
+        try:
+            db = self._db()
+            if db is not None:
+                row = db.execute(f"SELECT vec, created FROM {self.table} WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    if self._expired(row[1], now):
+                        db.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                    else:
+                        vector = array("f")
+                        vector.frombytes(row[0])
+                        created = row[1]
+                        db.execute(f"UPDATE {self.table} SET last_used = ? WHERE key = ?", (now, key))
+        except (sqlite3.Error, OSError):
+            vector = None  # a busy or broken cache file must never fail the caller
+
+        with self._lock:
+            if vector is None:
+                self.misses += 1
+                return None, "miss"
+            self.hits_disk += 1
+            self._remember(key, created, vector)
+        return (array("f", vector) if raw else vector.tolist()), "disk"
+
+    def put_key(self, key: str, vector: List[float]):
+        now = time.time()
+        packed = _pack(vector)
+        with self._lock:
+            self._remember(key, now, packed)
+            evict = self._evict_due(1, now)
+        try:
+            db = self._db()
+            if db is None:
+                return
+            db.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, dim, vec, created, last_used) VALUES (?, ?, ?, ?, ?)",
+                (key, len(packed), packed.tobytes(), now, now),
+            )
+            if evict:
+                self.evict(now)
+        except (sqlite3.Error, OSError):
+            pass
+
+    def put_many(self, items):
+        """Stores (key, vector) pairs in one SQLite transaction."""
+        now = time.time()
+        rows = []
+        with self._lock:
+            for key, vector in items:
+                packed = _pack(vector)
+                self._remember(key, now, packed)
+                rows.append((key, len(packed), packed.tobytes(), now, now))
+            evict = self._evict_due(len(rows), now)
+        if not rows:
+            return
+        try:
+            db = self._db()
+            if db is None:
+                return
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                db.executemany(
+                    f"INSERT OR REPLACE INTO {self.table} (key, dim, vec, created, last_used) VALUES (?, ?, ?, ?, ?)",
+                    rows,
+                )
+                db.execute("COMMIT")
+            except sqlite3.Error:
+                db.execute("ROLLBACK")
+                raise
+            if evict:
+                self.evict(now)
+        except (sqlite3.Error, OSError):
+            pass
+
+    def _evict_due(self, stored: int, now: float) -> bool:
+        """Counts stored rows; True when the next eviction is due (caller holds the lock)."""
+        self._puts_since_evict += stored
+        if self._puts_since_evict < self.evict_every and now - self._last_evict < self.evict_interval:
+            return False
+        self._puts_since_evict = 0
+        self._last_evict = now
+        return True
+
+    def evict(self, now: Optional[float] = None):
+        """Drops expired rows, then the least recently used ones beyond max_entries and max_bytes."""
+        db = self._db()
+        if db is None:
+            return
+        now = now or time.time()
+        if self.ttl > 0:
+            db.execute(f"DELETE FROM {self.table} WHERE created < ?", (now - self.ttl,))  # range on the created index
+        if self.max_entries:
+            excess = db.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0] - self.max_entries
+            if excess > 0:
+                # Oldest first along the last_used index: reads only the rows it deletes
+                db.execute(
+                    f"DELETE FROM {self.table} WHERE key IN ("
+                    f" SELECT key FROM {self.table} ORDER BY last_used ASC LIMIT ?)",
+                    (excess,),
+                )
+        if self.max_bytes:
+            excess = db.execute(f"SELECT COALESCE(SUM(dim), 0) FROM {self.table}").fetchone()[0] * 4 - self.max_bytes
+            if excess > 0:
+                doomed = []
+                cur = db.execute(f"SELECT key, dim FROM {self.table} ORDER BY last_used ASC")
+                try:
+                    for key, dim in cur:
+                        doomed.append((key,))
+                        excess -= dim * 4
+                        if excess <= 0:
+                            break
+                finally:
+                    cur.close()
+                db.executemany(f"DELETE FROM {self.table} WHERE key = ?", doomed)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits_memory": self.hits_memory, "hits_disk": self.hits_disk, "misses": self.misses}
+
+    def _remember(self, key: str, created: float, vector: array):
+        if not self.memory_entries:
+            return
+        self._lru[key] = (created, vector)
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.memory_entries:
+            self._lru.popitem(last=False)
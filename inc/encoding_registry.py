@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# encoding_registry.py
+#
+# One place that decides which tiktoken encoding (and which per-message
+# overheads) belong to a deployment, model or encoding name. Shared by
+# token_counter.py, build_index.py and rag_retrieve.py so budgets computed
+# in PHP and in the Python helpers agree.
+#
+# Resolution order for a name:
+#   1. an encoding name (cl100k_base, o200k_base, ...) is used as-is
+#   2. an [azure-*] section or its deployment_name registered from the INI;
+#      a section may pin its encoding with `tokenizer = o200k_base`
+#   3. the model-family table below
+#   4. tiktoken's own model table
+#   5. DEFAULT_CHAT_ENCODING
+
+import os, re, threading, configparser
+from collections import namedtuple
+from typing import Dict, Optional
+
+import tiktoken
+
+try:
+    from tiktoken_cache import load_encoding
+except ImportError:
+    from inc.tiktoken_cache import load_encoding
+
+EncodingSpec = namedtuple("EncodingSpec", "encoding tokens_per_message tokens_per_name")
+
+KNOWN_ENCODINGS = {"cl100k_base", "o200k_base", "p50k_base", "p50k_edit", "r50k_base", "gpt2"}
+
+DEFAULT_CHAT_ENCODING = "o200k_base"
+DEFAULT_EMBEDDING_ENCODING = "cl100k_base"
+
+# First match wins; the patterns are searched in the lower-cased name.
+_FAMILIES = [
+    (re.compile(r"embedding|ada-?002"),                      EncodingSpec("cl100k_base", 0, 0)),
+    (re.compile(r"gpt-?4o|gpt-?4\.1|gpt-?4-?1\b|gpt-?5"),    EncodingSpec("o200k_base", 3, 1)),
+    (re.compile(r"(^|[^a-z0-9])o[134]([^a-z0-9]|$)|gpto"),   EncodingSpec("o200k_base", 3, 1)),
+    (re.compile(r"gpt-?3|gpt-?4"),                          EncodingSpec("cl100k_base", 4, -1)),
+]
+
+_OVERHEADS = {
+    "cl100k_base": (4, -1),
+    "o200k_base": (3, 1),
+}
+
+_DEPLOYMENTS: Dict[str, EncodingSpec] = {}
+_ENCODINGS = {}
+_LOCK = threading.Lock()
+
+
+def _unquote(v: str) -> str:
+    v = (v or "").strip()
+    for token in (";", "#"):
+        if token in v:
+            v = v.split(token, 1)[0].rstrip()
+    if len(v) >= 2 and v[0] in ("'", '"') and v[-1] == v[0]:
+        v = v[1:-1]
+    return v
+
+
+def _family_spec(name: str) -> Optional[EncodingSpec]:
+    key = (name or "").strip().lower()
+    if not key:
+        return None
+    for pattern, spec in _FAMILIES:
+        if pattern.search(key):
+            return spec
+    return None
+
+
+def _spec_for_encoding(encoding: str) -> EncodingSpec:
+    per_message, per_name = _OVERHEADS.get(encoding, (3, 1))
+    return EncodingSpec(encoding, per_message, per_name)
+
+
+def register_deployments(cfg) -> int:
+    """
+    Registers every [azure-*] section of a parsed INI (ConfigParser or a plain
+    dict of dicts) under both its section name and its deployment_name.
+    Returns the number of sections registered.
+    """
+    count = 0
+    for section in cfg:
+        if not str(section).startswith("azure-"):
+            continue
+        values = cfg[section]
+        pinned = _unquote(values.get("tokenizer", ""))
+        model = _unquote(values.get("model", ""))
+        deployment_name = _unquote(values.get("deployment_name", ""))
+        if pinned:
+            spec = _spec_for_encoding(pinned)
+        else:
+            spec = (_family_spec(model) or _family_spec(deployment_name)
+                    or _family_spec(section) or _spec_for_encoding(DEFAULT_CHAT_ENCODING))
+        with _LOCK:
+            _DEPLOYMENTS[section.lower()] = spec
+            if deployment_name:
+                _DEPLOYMENTS[deployment_name.lower()] = spec
+        count += 1
+    return count
+
+
+def default_config_path(app_dir: str) -> str:
+    """CHAT_CONFIG_PATH if set, else the /etc/apps INI matching the checkout (chat, chatdev, chattest)."""
+    if os.getenv("CHAT_CONFIG_PATH"):
+        return os.getenv("CHAT_CONFIG_PATH")
+    env = ""
+    if "chatdev" in app_dir:
+        env = "dev"
+    elif "chattest" in app_dir:
+        env = "test"
+    return f"/etc/apps/chat{env}_config.ini"
+
+
+def load_ini(path: str) -> int:
+    """Registers the deployments of an INI file; a missing file registers nothing."""
+    cfg = configparser.ConfigParser(interpolation=None)
+    if not path or not cfg.read(path):
+        return 0
+    return register_deployments(cfg)
+
+
+def spec_for(name: Optional[str], default: str = DEFAULT_CHAT_ENCODING) -> EncodingSpec:
+    key = (name or "").strip()
+    if not key:
+        return _spec_for_encoding(default)
+    if key in KNOWN_ENCODINGS:
+        return _spec_for_encoding(key)
+    registered = _DEPLOYMENTS.get(key.lower())
+    if registered is not None:
+        return registered
+    family = _family_spec(key)
+    if family is not None:
+        return family
+    lookup = getattr(getattr(tiktoken, "model", None), "encoding_name_for_model", None)
+    if lookup is not None:
+        try:
+            return _spec_for_encoding(lookup(key))
+        except KeyError:
+            pass
+    return _spec_for_encoding(default)
+
+
+def encoding_name_for(name: Optional[str], default: str = DEFAULT_CHAT_ENCODING) -> str:
+    return spec_for(name, default).encoding
+
+
+def message_overheads(name: Optional[str]):
+    """Returns (tokens_per_message, tokens_per_name) for a deployment or model."""
+    spec = spec_for(name)
+    return spec.tokens_per_message, spec.tokens_per_name
+
+
+def get_encoding(name: Optional[str], default: str = DEFAULT_CHAT_ENCODING):
+    """
+    Returns the tiktoken encoding for an encoding, deployment or model name,
+    loading each encoding at most once per process (from the offline cache when
+    it has been built; see tiktoken_cache.py).
+    """
+    encoding_name = encoding_name_for(name, default)
+    encoding = _ENCODINGS.get(encoding_name)
+    if encoding is None:
+        with _LOCK:
+            encoding = _ENCODINGS.get(encoding_name)
+            if encoding is None:
+                encoding = load_encoding(encoding_name)
+                _ENCODINGS[encoding_name] = encoding
+    return encoding
+
+
+def loaded_encodings():
+    """Names of the encodings this process has loaded so far, sorted."""
+    return sorted(_ENCODINGS)
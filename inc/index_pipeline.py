@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# index_pipeline.py
+#
+# Small staged pipeline used by build_index.py: a source (chunking) feeds a
+# chain of stages (embed -> upsert -> record), each on its own thread with a
+# bounded queue in between. A full queue blocks the stage before it
+# (back-pressure), so at most `queue_size` batches wait at any hand-off. The
+# first error or a cancellation stops every stage; items keep their order
+# because each stage is a single FIFO worker.
+
+import time, queue, threading
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+_DONE = object()
+_POLL = 0.1
+
+
+class PipelineCancelled(RuntimeError):
+    pass
+
+
+class _StageStats:
+    def __init__(self):
+        self.items = 0
+        self.busy = 0.0
+        self.waiting = 0.0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {"items": self.items, "busy_sec": round(self.busy, 3), "wait_sec": round(self.waiting, 3)}
+
+
+def run_pipeline(source: Iterable[Any], stages: List[Tuple[str, Callable[[Any], Any]]],
+                 source_name: str = "chunk", queue_size: int = 2,
+                 should_cancel: Optional[Callable[[], Optional[str]]] = None,
+                 poll_interval: float = 0.5) -> Dict[str, Dict[str, Any]]:
+    """
+    Runs `source` and `stages` concurrently and returns per-stage timings:
+    {name: {"items", "busy_sec", "wait_sec"}}; busy is time spent in the stage's
+    own work, wait is time blocked on its neighbours.
+
+    `should_cancel` is polled from the calling thread every `poll_interval`
+    seconds; a non-empty return value stops the pipeline and is raised as
+    PipelineCancelled. A stage exception stops the pipeline and is re-raised.
+    """
+    if not stages:
+        raise ValueError("run_pipeline needs at least one stage")
+    names = [source_name] + [name for name, _ in stages]
+    stats = {name: _StageStats() for name in names}
+    queues = [queue.Queue(maxsize=max(1, queue_size)) for _ in stages]
+    stop = threading.Event()
+    errors: List[BaseException] = []
+
+    def put(q: queue.Queue, item: Any, st: _StageStats) -> bool:
+        start = time.perf_counter()
+        try:
+            while not stop.is_set():
+                try:
+                    q.put(item, timeout=_POLL)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+        finally:
+            st.waiting += time.perf_counter() - start
+
+    def fail(exc: BaseException):
+        errors.append(exc)
+        stop.set()
+
+    def run_source():
+        st = stats[source_name]
+        it = iter(source)
+        try:
+            while not stop.is_set():
+                start = time.perf_counter()
+                try:
+                    item = next(it)
+                except StopIteration:
+                    break
+                finally:
+                    st.busy += time.perf_counter() - start
+                st.items += 1
+                if not put(queues[0], item, st):
+                    return
+            put(queues[0], _DONE, st)
+        except BaseException as e:
+            fail(e)
+
+    def run_stage(index: int):
+        name, fn = stages[index]
+        st = stats[name]
+        inbox = queues[index]
+        outbox = queues[index + 1] if index + 1 < len(queues) else None
+        try:
+            while not stop.is_set():
+                start = time.perf_counter()
+                try:
+                    item = inbox.get(timeout=_POLL)
+                except queue.Empty:
+                    st.waiting += time.perf_counter() - start
+                    continue
+                st.waiting += time.perf_counter() - start
+                if item is _DONE:
+                    if outbox is not None:
+                        put(outbox, _DONE, st)
+                    return
+                start = time.perf_counter()
+                result = fn(item)
+                st.busy += time.perf_counter() - start
+                st.items += 1
+                if outbox is not None and not put(outbox, result, st):
+                    return
+        except BaseException as e:
+            fail(e)
+
+    threads = [threading.Thread(target=run_source, name=f"pipeline-{source_name}", daemon=True)]
+    threads += [threading.Thread(target=run_stage, args=(i,), name=f"pipeline-{stages[i][0]}", daemon=True)
+                for i in range(len(stages))]
+    for t in threads:
+        t.start()
+
+    reason = None
+    next_check = time.time() + poll_interval
+    try:
+        while any(t.is_alive() for t in threads):
+            threads[-1].join(timeout=_POLL)
+            if stop.is_set():
+                break
+            if should_cancel is not None and time.time() >= next_check:
+                reason = should_cancel()
+                if reason:
+                    stop.set()
+                    break
+                next_check = time.time() + poll_interval
+    finally:
+        stop.set()  # no-op after a clean run; otherwise unblocks every stage
+        for t in threads:
+            t.join()
+
+    if errors:
+        raise errors[0]
+    if reason:
+        raise PipelineCancelled(reason)
+    return {name: stats[name].as_dict() for name in names}
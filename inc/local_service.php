@@ -0,0 +1,99 @@
+<?php
+declare(strict_types=1);
+
+/**
+ * Client for the newline-delimited JSON Unix-socket services started from the
+ * Python helpers (see inc/local_service.py).
+ *
+ * Connections are reused for the lifetime of the PHP process. A socket that
+ * cannot be reached is remembered so callers fall back to their CLI path
+ * without paying the connect attempt again.
+ *
+ * $failure is set to why a call returned null: 'unavailable' (no socket or no
+ * connection), 'timeout' (the service accepted the request but did not answer
+ * in time, so it may still be working on it) or 'error' (anything else).
+ *
+ * @return array|null Decoded reply, or null when the service is unavailable.
+ */
+function local_service_call(string $socketPath, array $payload, float $timeoutSec = 5.0, ?string &$failure = null): ?array
+{
+    static $connections = [];
+    static $unavailable = [];
+
+    $failure = 'unavailable';
+    if ($socketPath === '' || isset($unavailable[$socketPath])) {
+        return null;
+    }
+    if (!file_exists($socketPath)) {
+        $unavailable[$socketPath] = true;
+        return null;
+    }
+
+    $failure = 'error';
+    $encoded = json_encode($payload, JSON_UNESCAPED_SLASHES | JSON_UNESCAPED_UNICODE | JSON_INVALID_UTF8_SUBSTITUTE);
+    if ($encoded === false) {
+        return null;
+    }
+    $encoded .= "\n";
+
+    // A kept-alive connection may have been closed by a service restart; retry once on a fresh one.
+    for ($attempt = 0; $attempt < 2; $attempt++) {
+        $conn = $connections[$socketPath] ?? null;
+        $reused = is_resource($conn);
+        if (!$reused) {
+            $errno = 0;
+            $errstr = '';
+            $conn = @stream_socket_client('unix://' . $socketPath, $errno, $errstr, $timeoutSec);
+            if ($conn === false) {
+                $unavailable[$socketPath] = true;
+                $failure = 'unavailable';
+                return null;
+            }
+            $connections[$socketPath] = $conn;
+        }
+
+        $seconds = (int)floor($timeoutSec);
+        stream_set_timeout($conn, $seconds, (int)(($timeoutSec - $seconds) * 1000000));
+
+        $line = false;
+        if (local_service_write_all($conn, $encoded)) {
+            $line = @fgets($conn);
+        }
+
+        if ($line !== false && $line !== '') {
+            $decoded = json_decode($line, true);
+            if (is_array($decoded)) {
+                $failure = null;
+                return $decoded;
+            }
+            return null;
+        }
+
+        $meta = @stream_get_meta_data($conn);
+        @fclose($conn);
+        unset($connections[$socketPath]);
+        if (!empty($meta['timed_out'])) {
+            $failure = 'timeout';
+            return null;
+        }
+        if (!$reused) {
+            return null;
+        }
+    }
+
+    return null;
+}
+
+function local_service_write_all($conn, string $data): bool
+{
+    $length = strlen($data);
+    $offset = 0;
+    while ($offset < $length) {
+        $written = @fwrite($conn, substr($data, $offset, 1048576));
+        if ($written === false || $written === 0) {
+            return false;
+        }
+        $offset += $written;
+    }
+    return true;
+}
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# local_service.py
+#
+# Minimal newline-delimited JSON server over a Unix socket, shared by the
+# long-running helpers (token_counter.py serve, ...). Each request is one JSON
+# object per line and gets exactly one JSON line back; clients may keep the
+# connection open and send as many requests as they like.
+
+import os, sys, json, socket, socketserver, signal, threading
+from typing import Any, Callable, Dict
+
+Dispatch = Callable[[Dict[str, Any]], Dict[str, Any]]
+
+
+class _LineHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for raw in self.rfile:
+            line = raw.strip()
+            if not line:
+                continue
+            try:
+                req = json.loads(line)
+                if not isinstance(req, dict):
+                    raise ValueError("request must be a JSON object")
+                resp = self.server.dispatch(req)
+            except Exception as e:
+                resp = {"ok": False, "error": str(e)}
+            try:
+                self.wfile.write(json.dumps(resp).encode("utf-8") + b"\n")
+                self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                return
+
+
+class LineJsonServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path: str, dispatch: Dispatch):
+        self.dispatch = dispatch
+        super().__init__(socket_path, _LineHandler)
+
+
+def _socket_in_use(path: str) -> bool:
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        s.connect(path)
+        return True
+    except OSError:
+        return False
+    finally:
+        s.close()
+
+
+def make_server(socket_path: str, dispatch: Dispatch, mode: int = 0o660) -> LineJsonServer:
+    if os.path.exists(socket_path):
+        if _socket_in_use(socket_path):
+            raise RuntimeError(f"socket already in use: {socket_path}")
+        os.unlink(socket_path)
+    parent = os.path.dirname(socket_path)
+    if parent:
+        os.makedirs(parent, exist_ok=True)
+    server = LineJsonServer(socket_path, dispatch)
+    os.chmod(socket_path, mode)
+    return server
+
+
+def serve_unix(socket_path: str, dispatch: Dispatch, name: str = "local_service", mode: int = 0o660):
+    server = make_server(socket_path, dispatch, mode)
+
+    def _stop(_signum, _frame):
+        # shutdown() blocks until serve_forever returns, so it cannot run on this thread
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+    sys.stderr.write(f"[{name}] listening on {socket_path}\n")
+    sys.stderr.flush()
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        try:
+            os.unlink(socket_path)
+        except OSError:
+            pass
+
+
+def request_unix(socket_path: str, payload: Dict[str, Any], timeout: float = 30.0) -> Dict[str, Any]:
+    """One-shot client, mainly for scripts and tests."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.settimeout(timeout)
+        s.connect(socket_path)
+        s.sendall(json.dumps(payload).encode("utf-8") + b"\n")
+        with s.makefile("rb") as f:
+            line = f.readline()
+    if not line:
+        raise RuntimeError("service closed the connection without replying")
+    return json.loads(line)
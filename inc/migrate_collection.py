@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+# migrate_collection.py
+#
+# Moves the RAG index to a new Qdrant collection without downtime, e.g. for a
+# new embedding model or `dimensions`. Every ready rag_index row is re-chunked
+# and re-embedded from document.content into the target collection while the
+# live one keeps serving; then the [qdrant] alias that rag_retrieve.py and
+# build_index.py read is swapped to the target in one atomic Qdrant call, and
+# the rag_index rows are pointed at it.
+#
+#   python3 migrate_collection.py --config /etc/apps/chat_config.next.ini --target nhlbi_large_1024
+#       [--alias nhlbi_live] [--workers 4] [--batch 32] [--chunk-tokens 8000] [--chunk-overlap 50]
+#       [--embedding-model NAME] [--state FILE] [--no-swap]
+#
+# --config is the INI with the *new* embedding settings (and [qdrant] alias);
+# install it for the web app right after the swap. Migrated points and
+# rag_index rows are labelled with that INI's embedding deployment (model for
+# OpenAI), or with --embedding-model when given. Documents are processed
+# --batch at a time, --workers in parallel; embedding requests share
+# build_index's adaptive rate limiter and chunk-embedding cache. Finished
+# documents are recorded in --state after each batch, so an interrupted run
+# (SIGTERM, crash, rate-limit storm) picks up where it stopped. Documents
+# indexed or re-indexed into the old collection while the migration ran are
+# caught up before the swap; running the tool again after the swap moves any
+# stragglers. Progress lines go to stderr, the summary JSON to stdout.
+
+import io, os, sys, json, time, uuid, tempfile, threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import build_index  # noqa: E402
+from text_chunker import iter_text_chunks, parse_structure  # noqa: E402
+from qdrant_client.http import models as qmodels  # noqa: E402
+
+FLUSH_EVERY = 256
+
+
+def LOG(msg: str):
+    sys.stderr.write(f"[migrate_collection] {msg}\n")
+    sys.stderr.flush()
+
+
+class MigrationState:
+    """Documents already in the target collection, keyed by rag_index id; saved atomically."""
+
+    def __init__(self, path: str, target: str, dim: int, model: str = ""):
+        self.path = path
+        self.target = target
+        self.dim = dim
+        self.model = model
+        self.docs: Dict[str, Dict[str, Any]] = {}
+        self.swapped = False
+        self._lock = threading.Lock()
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get("target") == target and data.get("dim") == dim and data.get("model", "") == model:
+            self.docs = data.get("docs") or {}
+            self.swapped = bool(data.get("swapped"))
+
+    def done(self, row: Dict[str, Any]) -> bool:
+        entry = self.docs.get(str(row["rag_index_id"]))
+        return bool(entry) and entry.get("content_sha256") == row.get("content_sha256") \
+            and entry.get("version") == row.get("version")
+
+    def record(self, row: Dict[str, Any], chunks: int):
+        with self._lock:
+            self.docs[str(row["rag_index_id"])] = {
+                "document_id": row["document_id"],
+                "version": row.get("version"),
+                "content_sha256": row.get("content_sha256"),
+                "embedding_model": self.model or row["embedding_model"],
+                "chunk_count": chunks,
+            }
+
+    def save(self):
+        with self._lock:
+            data = {"target": self.target, "dim": self.dim, "model": self.model, "swapped": self.swapped,
+                    "docs": self.docs}
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp, self.path)
+
+
+def pending_rows(cur, target: str) -> List[Dict[str, Any]]:
+    """Ready indexes of live documents that are not in the target collection yet (no content)."""
+    cur.execute("""SELECT ri.id AS rag_index_id, ri.document_id, ri.user, ri.embedding_model, ri.content_sha256,
+                          d.chat_id, d.name, d.version
+                   FROM rag_index ri JOIN document d ON d.id = ri.document_id
+                   WHERE ri.ready=1 AND d.deleted=0 AND ri.version=d.version AND ri.collection<>%s
+                   ORDER BY ri.document_id""", (target,))
+    return list(cur.fetchall())
+
+
+def load_contents(cur, document_ids: List[int]) -> Dict[int, Dict[str, Any]]:
+    marks = ",".join(["%s"] * len(document_ids))
+    try:
+        cur.execute(f"SELECT id, content, structure_index FROM document WHERE id IN ({marks})", document_ids)
+    except Exception:
+        # Schema without the structure_index column
+        cur.execute(f"SELECT id, content, NULL AS structure_index FROM document WHERE id IN ({marks})", document_ids)
+    return {int(r["id"]): r for r in cur.fetchall()}
+
+
+def migrate_document(client, target: str, row: Dict[str, Any], doc: Dict[str, Any], opts: Dict[str, Any],
+                     cache) -> Dict[str, int]:
+    """Chunks, embeds and upserts one document into `target`; returns chunk/embed/cache counts."""
+    content = (doc.get("content") or "").encode("utf-8")
+    structure = parse_structure(doc.get("structure_index"))
+    build_id = uuid.uuid4().hex
+    model = opts["model"]
+    base = {"user_id": row["user"], "chat_id": row["chat_id"], "document_id": int(row["document_id"]),
+            "version": int(row.get("version") or 1), "filename": row.get("name")}
+    chunks = iter_text_chunks(io.BytesIO(content), build_index.token_encoder(), opts["chunk_tokens"],
+                              opts["chunk_overlap"], structure=structure)
+    content_sha = row.get("content_sha256") or build_index.sha256_text(content.decode("utf-8"))
+    counts = {"chunks": 0, "cache_hits": 0}
+    texts: List[str] = []
+    payloads: List[Dict[str, Any]] = []
+
+    def flush():
+        vecs, hits = build_index.embed_texts_cached(texts, cache, opts["cache_model"], batch_size=64)
+        build_index.upsert_points(client, target, vecs, payloads)
+        counts["chunks"] += len(texts)
+        counts["cache_hits"] += hits
+        texts.clear()
+        payloads.clear()
+
+    for text, payload in build_index.iter_chunk_payloads(chunks, structure, base, content_sha, model, build_id):
+        texts.append(text)
+        payloads.append(payload)
+        if len(texts) >= FLUSH_EVERY:
+            flush()
+    if texts:
+        flush()
+    # Points from an earlier attempt whose chunks no longer exist
+    build_index.delete_stale_points(client, target, int(row["document_id"]), model, build_id)
+    return counts
+
+
+def current_alias_target(client, alias: str) -> Optional[str]:
+    for a in getattr(client.get_aliases(), "aliases", None) or []:
+        if a.alias_name == alias:
+            return a.collection_name
+    return None
+
+
+def swap_alias(client, alias: str, target: str) -> Optional[str]:
+    """Points `alias` at `target` in one atomic request; returns the collection it pointed at before."""
+    previous = current_alias_target(client, alias)
+    ops = []
+    if previous is not None:
+        ops.append(qmodels.DeleteAliasOperation(delete_alias=qmodels.DeleteAlias(alias_name=alias)))
+    ops.append(qmodels.CreateAliasOperation(create_alias=qmodels.CreateAlias(collection_name=target, alias_name=alias)))
+    client.update_collection_aliases(change_aliases_operations=ops)
+    return previous
+
+
+def finalize_rows(cur, state: MigrationState, entries: Dict[str, Dict[str, Any]]) -> int:
+    """Points the migrated rag_index rows at the target collection; rows changed since are left alone."""
+    updated = 0
+    for rag_index_id, entry in entries.items():
+        cur.execute("""UPDATE rag_index SET collection=%s, embedding_model=%s, embedding_dim=%s, chunk_count=%s, ready=1
+                       WHERE id=%s AND content_sha256 <=> %s""",
+                    (state.target, entry["embedding_model"], state.dim, entry["chunk_count"],
+                     int(rag_index_id), entry["content_sha256"]))
+        updated += cur.rowcount or 0
+    return updated
+
+
+def run(opts: Dict[str, Any]) -> Dict[str, Any]:
+    t0 = time.time()
+    build_index.load_ini(opts["config"])
+    alias = opts["alias"] or build_index.QDRANT_ALIAS
+    target = opts["target"]
+    if not alias and not opts["no_swap"]:
+        raise RuntimeError("no alias to swap: set [qdrant] alias in the new INI or pass --alias (or --no-swap)")
+    if alias and target == alias:
+        raise RuntimeError("--target must be a collection name, not the alias")
+    azure = build_index.AZURE["key"] and build_index.AZURE["endpoint"]
+    opts["cache_model"] = build_index.AZURE["deployment"] if azure else build_index.OPENAI["model"]
+    # The label payloads and rag_index rows get: the deployment that produced the vectors
+    opts["model"] = opts["embedding_model"] or opts["cache_model"]
+    state_path = opts["state"] or os.path.join(tempfile.gettempdir(), f"nhlbi_migrate_{target}.json")
+    state = MigrationState(state_path, target, build_index.EMBED_DIM, opts["model"])
+
+    client = build_index.qdrant_client()
+    build_index.ensure_collection(client, target, build_index.EMBED_DIM)
+    state.swapped = state.swapped or (bool(alias) and current_alias_target(client, alias) == target)
+    cache = build_index.chunk_cache()
+    LOG(f"target={target} alias={alias or '-'} dim={build_index.EMBED_DIM} model={opts['model']} "
+        f"resumed={len(state.docs)} swapped={state.swapped}")
+
+    totals = {"documents": 0, "chunks": 0, "cache_hits": 0, "failed": 0}
+    failed: Dict[int, str] = {}
+
+    def one(row, doc):
+        try:
+            return row, migrate_document(client, target, row, doc, opts, cache), None
+        except Exception as e:
+            return row, None, str(e)
+
+    interrupted = False
+    passes = 0
+    with ThreadPoolExecutor(max_workers=max(1, opts["workers"]), thread_name_prefix="migrate") as pool:
+        while not interrupted:
+            passes += 1
+            with build_index.db_conn() as conn, conn.cursor() as cur:
+                rows = [r for r in pending_rows(cur, target)
+                        if not state.done(r) and int(r["document_id"]) not in failed]
+            if not rows:
+                break
+            LOG(f"pass {passes}: {len(rows)} documents to migrate")
+            for start in range(0, len(rows), opts["batch"]):
+                if build_index._SHOULD_STOP:
+                    interrupted = True
+                    break
+                batch = rows[start:start + opts["batch"]]
+                with build_index.db_conn() as conn, conn.cursor() as cur:
+                    docs = load_contents(cur, [int(r["document_id"]) for r in batch])
+                finished = {}
+                for row, counts, err in pool.map(lambda r: one(r, docs.get(int(r["document_id"])) or {}), batch):
+                    if err is not None:
+                        failed[int(row["document_id"])] = err
+                        totals["failed"] += 1
+                        LOG(f"document {row['document_id']} failed: {err}")
+                        continue
+                    state.record(row, counts["chunks"])
+                    finished[str(row["rag_index_id"])] = state.docs[str(row["rag_index_id"])]
+                    totals["documents"] += 1
+                    totals["chunks"] += counts["chunks"]
+                    totals["cache_hits"] += counts["cache_hits"]
+                if state.swapped and finished:
+                    # Already live: stragglers are pointed at the target right away
+                    with build_index.db_conn() as conn, conn.cursor() as cur:
+                        finalize_rows(cur, state, finished)
+                state.save()
+                elapsed = max(time.time() - t0, 1e-6)
+                LOG(json.dumps({"pass": passes, "done": start + len(batch), "of": len(rows),
+                                "documents": totals["documents"], "chunks": totals["chunks"],
+                                "chunks_per_sec": round(totals["chunks"] / elapsed, 1),
+                                "docs_per_min": round(totals["documents"] * 60 / elapsed, 1),
+                                "failed": totals["failed"], "elapsed_sec": round(elapsed, 1)}))
+
+    out = {
+        "ok": not interrupted and not failed,
+        "target": target,
+        "alias": alias or None,
+        "embedding_dim": build_index.EMBED_DIM,
+        "embedding_model": opts["model"],
+        **totals,
+        "migrated_total": len(state.docs),
+        "failures": {str(k): v for k, v in failed.items()},
+        "state": state_path,
+        "swapped": state.swapped,
+        "previous_collection": None,
+        "rag_index_updated": 0,
+    }
+    if interrupted:
+        out["error"] = "interrupted; run again to resume"
+    elif failed:
+        out["error"] = "some documents failed; run again to retry them before the swap"
+    elif alias and not opts["no_swap"] and not state.swapped:
+        out["previous_collection"] = swap_alias(client, alias, target)
+        state.swapped = True
+        state.save()
+        with build_index.db_conn() as conn, conn.cursor() as cur:
+            out["rag_index_updated"] = finalize_rows(cur, state, state.docs)
+        out["swapped"] = True
+        LOG(f"alias {alias} -> {target} (was {out['previous_collection']}); "
+            f"{out['rag_index_updated']} rag_index rows updated")
+    elapsed = time.time() - t0
+    out["elapsed_sec"] = round(elapsed, 1)
+    out["chunks_per_sec"] = round(totals["chunks"] / elapsed, 1) if elapsed else None
+    return out
+
+
+_USAGE = ("Usage: python3 migrate_collection.py --config NEW.ini --target COLLECTION [--alias NAME] "
+          "[--workers N] [--batch N] [--chunk-tokens N] [--chunk-overlap N] [--embedding-model NAME] "
+          "[--state FILE] [--no-swap]")
+
+
+def main():
+    args = sys.argv[1:]
+    opts = {"config": None, "target": None, "alias": "", "workers": "4", "batch": "32",
+            "chunk_tokens": "8000", "chunk_overlap": "50", "embedding_model": "", "state": ""}
+    no_swap = False
+    while args:
+        key = args.pop(0)
+        if key == "--no-swap":
+            no_swap = True
+            continue
+        name = key[2:].replace("-", "_")
+        if not key.startswith("--") or name not in opts or not args:
+            print(_USAGE)
+            sys.exit(1)
+        opts[name] = args.pop(0)
+    if not opts["config"] or not opts["target"]:
+        print(_USAGE)
+        sys.exit(1)
+    for key in ("workers", "batch", "chunk_tokens", "chunk_overlap"):
+        opts[key] = int(opts[key])
+    opts["no_swap"] = no_swap
+    out = run(opts)
+    print(json.dumps(out))
+    sys.exit(0 if out["ok"] else 2)
+
+
+if __name__ == "__main__":
+    main()
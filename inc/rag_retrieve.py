@@ -1,24 +1,71 @@
 #!/usr/bin/env python3
 # rag_retrieve.py
 
-import os, sys, json, time, re, configparser, requests, pymysql, warnings
-from typing import Dict, Any, List
+import os, sys, json, time, re, configparser, requests, pymysql, warnings, threading, tempfile
+from collections import namedtuple
+from types import MappingProxyType
+from typing import Dict, Any, List, Mapping, Optional
 from qdrant_client import QdrantClient
+from qdrant_client.http import models as qmodels
 try:
     from qdrant_client.http.models import Filter, FieldCondition, MatchValue, MatchAny
 except ImportError:
     from qdrant_client.http.models import Filter, FieldCondition, MatchValue
     MatchAny = None
-import tiktoken
+
+try:
+    from encoding_registry import get_encoding, register_deployments, DEFAULT_CHAT_ENCODING
+    from embedding_cache import EmbeddingCache, normalize_query
+except ImportError:
+    from inc.encoding_registry import get_encoding, register_deployments, DEFAULT_CHAT_ENCODING
+    from inc.embedding_cache import EmbeddingCache, normalize_query
 
 warnings.filterwarnings("ignore", category=UserWarning)
 warnings.filterwarnings("ignore", category=DeprecationWarning)
 
-# ---- shared defaults (overridden by INI) ----
+# ---- defaults; each INI is parsed into its own Settings on top of these ----
 QDRANT_URL, QDRANT_API_KEY, QDRANT_COLLECTION = "http://127.0.0.1:6333", "", "nhlbi"
 AZURE = {"key":"", "endpoint":"", "deployment":"NHLBI-Chat-workflow-text-embedding-3-large", "api_version":"2024-06-01"}
 OPENAI = {"key":"", "base":"https://api.openai.com/v1", "model":"NHLBI-Chat-workflow-text-embedding-3-large"}
 EMBED_DIM = 1536
+# `dimensions` from the embedding section; must match what build_index.py indexed with
+EMBED_DIMENSIONS: Optional[int] = None
+# Search parameters matching build_index's collection profile ([qdrant] quantization,
+# oversampling, rescore, hnsw_ef). Quantized searches fetch oversampling * top_k
+# candidates on the compressed vectors and rescore them with the originals.
+SEARCH = {
+    "quantization": "none",
+    "oversampling": None,  # default per quantization: 2.0 for int8, 3.0 for binary
+    "rescore": True,
+    "hnsw_ef": None,
+}
+_DEFAULT_OVERSAMPLING = {"int8": 2.0, "binary": 3.0}
+# Query-embedding cache ([rag] query_cache_* in the INI); an empty path keeps it in memory only
+QUERY_CACHE = {
+    "path": os.path.join(tempfile.gettempdir(), "nhlbi_query_embeddings.sqlite3"),
+    "ttl_seconds": 7 * 86400,
+    "max_entries": 20000,
+    "memory_entries": 512,
+}
+
+# One parsed INI. rag_service.py runs retrievals concurrently, so a request
+# works from the Settings it started with and never reads module globals that
+# another request's config could be rewriting. azure/openai/search/query_cache
+# are read-only mappings.
+Settings = namedtuple("Settings", "qdrant_url qdrant_api_key collection azure openai "
+                                  "embed_dim embed_dimensions search query_cache")
+
+# Per-request state (the chat deployment snippets are budgeted for); thread-local
+# because rag_service.py runs retrievals concurrently in one process
+_REQUEST = threading.local()
+
+# Warm state reused across retrievals in a long-running process
+_STATE_LOCK = threading.Lock()
+_SETTINGS: Dict[str, tuple] = {}  # INI path -> (mtime, Settings)
+_QDRANT: Dict[tuple, QdrantClient] = {}
+_SESSION = None
+_QUERY_CACHES: Dict[tuple, EmbeddingCache] = {}
+_COLLECTION_DIMS: Dict[tuple, Optional[int]] = {}
 
 _SENT_SPLIT = re.compile(r'(?<=[\.!\?])\s+|\n+')
 _URL_RE     = re.compile(r'https?://\S+')
@@ -52,26 +99,154 @@ def _unquote(v:str)->str:
         v=v[1:-1]
     return v
 
-def load_ini(path:str):
-    global QDRANT_URL,QDRANT_API_KEY,QDRANT_COLLECTION,AZURE,OPENAI,EMBED_DIM
+def default_settings() -> Settings:
+    """Settings from the module defaults alone (no INI)."""
+    return Settings(QDRANT_URL, QDRANT_API_KEY, QDRANT_COLLECTION, MappingProxyType(dict(AZURE)),
+                    MappingProxyType(dict(OPENAI)), EMBED_DIM, EMBED_DIMENSIONS,
+                    MappingProxyType(dict(SEARCH)), MappingProxyType(dict(QUERY_CACHE)))
+
+def load_ini(path:str) -> Settings:
+    """Parses the INI into a new Settings; anything the file does not set keeps its default."""
     cfg = configparser.ConfigParser(interpolation=None)
     if not path or not cfg.read(path):
         raise RuntimeError(f"Config file not readable: {path}")
+    register_deployments(cfg)
+    url, api_key, collection = QDRANT_URL, QDRANT_API_KEY, QDRANT_COLLECTION
+    azure, openai, search, cache = dict(AZURE), dict(OPENAI), dict(SEARCH), dict(QUERY_CACHE)
+    embed_dim, dimensions = EMBED_DIM, EMBED_DIMENSIONS
     if "qdrant" in cfg:
-        QDRANT_URL        = _unquote(cfg["qdrant"].get("url", QDRANT_URL))
-        QDRANT_API_KEY    = _unquote(cfg["qdrant"].get("api_key", QDRANT_API_KEY))
-        QDRANT_COLLECTION = _unquote(cfg["qdrant"].get("collection", QDRANT_COLLECTION))
+        url        = _unquote(cfg["qdrant"].get("url", url))
+        api_key    = _unquote(cfg["qdrant"].get("api_key", api_key))
+        # An alias (swapped by migrate_collection.py) takes precedence over the collection name
+        collection = _unquote(cfg["qdrant"].get("alias", "")) or _unquote(cfg["qdrant"].get("collection", collection))
+        search["quantization"] = _unquote(cfg["qdrant"].get("quantization", search["quantization"])).lower() or "none"
+        search["rescore"] = _unquote(cfg["qdrant"].get("rescore", "1")).lower() not in ("0", "false", "no", "off")
+        for key, cast in (("oversampling", float), ("hnsw_ef", int)):
+            raw = _unquote(cfg["qdrant"].get(key, ""))
+            search[key] = cast(raw) if raw else None
     if "azure-embedding" in cfg:
-        AZURE["key"]        = _unquote(cfg["azure-embedding"].get("api_key", AZURE["key"]))
-        AZURE["endpoint"]   = _unquote(cfg["azure-embedding"].get("url", AZURE["endpoint"]))
-        AZURE["deployment"] = _unquote(cfg["azure-embedding"].get("deployment_name", AZURE["deployment"]))
-        AZURE["api_version"]= _unquote(cfg["azure-embedding"].get("api_version", AZURE["api_version"]))
-        EMBED_DIM = 3072 if "large" in AZURE["deployment"] else 1536
+        azure["key"]        = _unquote(cfg["azure-embedding"].get("api_key", azure["key"]))
+        azure["endpoint"]   = _unquote(cfg["azure-embedding"].get("url", azure["endpoint"]))
+        azure["deployment"] = _unquote(cfg["azure-embedding"].get("deployment_name", azure["deployment"]))
+        azure["api_version"]= _unquote(cfg["azure-embedding"].get("api_version", azure["api_version"]))
+        dimensions = _dimensions(cfg["azure-embedding"])
+        embed_dim = dimensions or (3072 if "large" in azure["deployment"] else 1536)
     if "openai-embedding" in cfg:
-        OPENAI["key"]   = _unquote(cfg["openai-embedding"].get("api_key", OPENAI["key"]))
-        OPENAI["base"]  = _unquote(cfg["openai-embedding"].get("base", OPENAI["base"]))
-        OPENAI["model"] = _unquote(cfg["openai-embedding"].get("model", OPENAI["model"]))
-        EMBED_DIM = 3072 if "large" in OPENAI["model"] else 1536
+        openai["key"]   = _unquote(cfg["openai-embedding"].get("api_key", openai["key"]))
+        openai["base"]  = _unquote(cfg["openai-embedding"].get("base", openai["base"]))
+        openai["model"] = _unquote(cfg["openai-embedding"].get("model", openai["model"]))
+        dimensions = _dimensions(cfg["openai-embedding"])
+        embed_dim = dimensions or (3072 if "large" in openai["model"] else 1536)
+    if "rag" in cfg:
+        cache["path"] = _unquote(cfg["rag"].get("query_cache_path", cache["path"]))
+        cache["ttl_seconds"] = int(_unquote(cfg["rag"].get("query_cache_ttl", str(cache["ttl_seconds"]))))
+        cache["max_entries"] = int(_unquote(cfg["rag"].get("query_cache_max_entries", str(cache["max_entries"]))))
+    return Settings(url, api_key, collection, MappingProxyType(azure), MappingProxyType(openai),
+                    embed_dim, dimensions, MappingProxyType(search), MappingProxyType(cache))
+
+def _dimensions(section) -> Optional[int]:
+    raw = _unquote(section.get("dimensions", ""))
+    return int(raw) if raw else None
+
+def ensure_config(path: str) -> Settings:
+    """Settings for the INI, parsed again only when the file's mtime changes."""
+    try:
+        mtime = os.path.getmtime(path) if path else None
+    except OSError:
+        mtime = None
+    with _STATE_LOCK:
+        cached = _SETTINGS.get(path)
+        if cached is not None and mtime is not None and cached[0] == mtime:
+            return cached[1]
+        settings = load_ini(path)
+        _SETTINGS[path] = (mtime, settings)
+        return settings
+
+def loaded_configs() -> List[str]:
+    """Paths of the INIs this process has parsed, sorted."""
+    with _STATE_LOCK:
+        return sorted(_SETTINGS)
+
+def qdrant(settings: Settings) -> QdrantClient:
+    """One QdrantClient per Qdrant URL and key for the life of the process."""
+    key = (settings.qdrant_url, settings.qdrant_api_key)
+    with _STATE_LOCK:
+        client = _QDRANT.get(key)
+        if client is None:
+            client = _QDRANT[key] = QdrantClient(url=settings.qdrant_url, api_key=settings.qdrant_api_key,
+                                                 timeout=15.0)
+        return client
+
+def search_params(search: Optional[Mapping[str, Any]] = None):
+    """qmodels.SearchParams for `search` (default SEARCH), or None when Qdrant's defaults apply."""
+    search = SEARCH if search is None else search
+    kw = {}
+    if search["hnsw_ef"]:
+        kw["hnsw_ef"] = search["hnsw_ef"]
+    kind = search["quantization"]
+    if kind in _DEFAULT_OVERSAMPLING:
+        kw["quantization"] = qmodels.QuantizationSearchParams(
+            ignore=False,
+            rescore=search["rescore"],
+            oversampling=search["oversampling"] or _DEFAULT_OVERSAMPLING[kind],
+        )
+    if not kw or not hasattr(qmodels, "SearchParams"):
+        return None
+    return qmodels.SearchParams(**kw)
+
+def http_session() -> requests.Session:
+    """Keep-alive session for the embedding endpoint, shared by all threads."""
+    global _SESSION
+    with _STATE_LOCK:
+        if _SESSION is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=16)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _SESSION = session
+        return _SESSION
+
+def query_cache(settings: Settings) -> EmbeddingCache:
+    """One query-embedding cache per distinct [rag] query_cache_* setting."""
+    opts = settings.query_cache
+    key = tuple(sorted(opts.items()))
+    with _STATE_LOCK:
+        cache = _QUERY_CACHES.get(key)
+        if cache is None:
+            cache = _QUERY_CACHES[key] = EmbeddingCache(opts["path"], table="query_embedding",
+                                                        memory_entries=opts["memory_entries"],
+                                                        max_entries=opts["max_entries"],
+                                                        ttl_seconds=opts["ttl_seconds"])
+        return cache
+
+def _embedding_model(settings: Settings) -> str:
+    suffix = f"@{settings.embed_dimensions}" if settings.embed_dimensions else ""
+    azure, openai = settings.azure, settings.openai
+    if azure["key"] and azure["endpoint"]:
+        return f"azure:{azure['endpoint'].rstrip('/')}/{azure['deployment']}{suffix}"
+    return f"openai:{openai['base'].rstrip('/')}/{openai['model']}{suffix}"
+
+def collection_dim(client: QdrantClient, settings: Settings) -> Optional[int]:
+    """Vector size of the configured collection, looked up once per process; None if unknown."""
+    key = (settings.qdrant_url, settings.collection)
+    if key not in _COLLECTION_DIMS:
+        cfg = getattr(client.get_collection(settings.collection), "config", None)
+        vc = getattr(getattr(cfg, "params", None), "vectors", None) or getattr(cfg, "vectors", None)
+        size = vc.get("size") if isinstance(vc, dict) else getattr(vc, "size", None)
+        _COLLECTION_DIMS[key] = size if isinstance(size, int) else None
+    return _COLLECTION_DIMS[key]
+
+def check_query_dim(client: QdrantClient, vec: List[float], settings: Settings):
+    size = collection_dim(client, settings)
+    if size and len(vec) != size:
+        # The alias may have been swapped to a collection of another size since the lookup
+        _COLLECTION_DIMS.pop((settings.qdrant_url, settings.collection), None)
+        size = collection_dim(client, settings)
+    if size and len(vec) != size:
+        raise RuntimeError(
+            f"Query embedding has {len(vec)} dimensions but collection '{settings.collection}' stores {size}; "
+            f"set `dimensions` in the embedding section to the value the index was built with"
+        )
 
 def read_input() -> Dict[str, Any]:
     if len(sys.argv) >= 3 and sys.argv[1] == "--json":
@@ -84,26 +259,44 @@ def read_input() -> Dict[str, Any]:
         raise RuntimeError("No JSON provided on stdin and no --json file specified")
     raise RuntimeError("usage: rag_retrieve.py --json file.json  (or pipe JSON to stdin)")
 
-def embed_query(text:str)->List[float]:
-    if AZURE["key"] and AZURE["endpoint"]:
-        url = f"{AZURE['endpoint'].rstrip('/')}/openai/deployments/{AZURE['deployment']}/embeddings?api-version={AZURE['api_version']}"
-        r = requests.post(url, headers={"api-key":AZURE["key"],"Content-Type":"application/json"}, json={"input": text},timeout=15)
+def embed_query(text:str, settings: Settings)->List[float]:
+    """
+    Embeds the question, answering repeats from the query cache. Records
+    "memory", "disk" or "miss" for the current request in _REQUEST.query_cache.
+    """
+    cache = query_cache(settings)
+    model, norm = _embedding_model(settings), normalize_query(text)
+    vec, tier = cache.lookup(model, norm)
+    _REQUEST.query_cache = tier
+    if vec is None:
+        vec = _embed_query_remote(text, settings)
+        cache.put(model, norm, vec)
+    return vec
+
+def _embed_query_remote(text:str, settings: Settings)->List[float]:
+    azure, openai = settings.azure, settings.openai
+    if azure["key"] and azure["endpoint"]:
+        url = f"{azure['endpoint'].rstrip('/')}/openai/deployments/{azure['deployment']}/embeddings?api-version={azure['api_version']}"
+        r = http_session().post(url, headers={"api-key":azure["key"],"Content-Type":"application/json"},
+                                json=_embedding_body({"input": text}, settings), timeout=15)
         r.raise_for_status()
         return r.json()["data"][0]["embedding"]
-    elif OPENAI["key"]:
-        url = f"{OPENAI['base'].rstrip('/')}/embeddings"
-        r = requests.post(url, headers={"Authorization":f"Bearer {OPENAI['key']}", "Content-Type":"application/json"},
-                          json={"model":OPENAI["model"], "input":text}, timeout=15)
+    elif openai["key"]:
+        url = f"{openai['base'].rstrip('/')}/embeddings"
+        r = http_session().post(url, headers={"Authorization":f"Bearer {openai['key']}", "Content-Type":"application/json"},
+                          json=_embedding_body({"model":openai["model"], "input":text}, settings), timeout=15)
         r.raise_for_status()
         return r.json()["data"][0]["embedding"]
     else:
         raise RuntimeError("No embedding backend configured")
 
+def _embedding_body(body: Dict[str, Any], settings: Settings) -> Dict[str, Any]:
+    if settings.embed_dimensions:
+        body["dimensions"] = settings.embed_dimensions
+    return body
+
 def _enc():
-    try:
-        return tiktoken.get_encoding("cl100k_base")
-    except Exception:
-        return tiktoken.encoding_for_model("gpt-4o-mini")
+    return get_encoding(getattr(_REQUEST, "deployment", None) or DEFAULT_CHAT_ENCODING)
 
 def _token_len(text: str) -> int:
     return len(_enc().encode(text))
@@ -124,6 +317,25 @@ def _score_sentence(sent: str, keys: set):
     s = set(re.findall(r"[0-9a-zA-Z-]+", sent.lower()))
     return len(s & keys)
 
+def _cite_bits(pl: Dict[str, Any]) -> List[str]:
+    """Citation parts for a chunk: real pages/slides when the parser recorded them, else the chunk number."""
+    bits = []
+    unit = pl.get("page_unit")
+    span = pl.get("page_range")
+    if unit in ("page", "slide") and span:
+        plural = "-" in str(span)
+        bits.append(f"{'pp.' if plural else 'p.'} {span}" if unit == "page" else f"slide{'s' if plural else ''} {span}")
+    else:
+        chunk_idx = pl.get("chunk_index")
+        if chunk_idx is not None:
+            try:
+                bits.append(f"chunk {int(chunk_idx)}")
+            except (TypeError, ValueError):
+                bits.append(f"chunk {chunk_idx}")
+    if pl.get("section"):
+        bits.append(f"{'sheet' if unit == 'sheet' else 'sec.'} {pl['section']}")
+    return bits
+
 def assemble_snippet(points, question: str, max_tokens: int):
     keys = _keywords(question)
     out = []
@@ -141,17 +353,7 @@ def assemble_snippet(points, question: str, max_tokens: int):
         used.add(key)
 
         filename = pl.get("filename") or f"doc-{pl.get('document_id')}"
-        cite_bits = []
-        chunk_idx = pl.get("chunk_index")
-        if chunk_idx is not None:
-            try:
-                chunk_label = int(chunk_idx)
-            except (TypeError, ValueError):
-                chunk_label = chunk_idx
-            cite_bits.append(f"chunk {chunk_label}")
-        if pl.get("section"):
-            cite_bits.append(f"sec. {pl['section']}")
-        cite_suffix = ", ".join(cite_bits)
+        cite_suffix = ", ".join(_cite_bits(pl))
         cite_tag = f"【{filename}"
         if cite_suffix:
             cite_tag += f", {cite_suffix}"
@@ -206,6 +408,7 @@ def assemble_snippet(points, question: str, max_tokens: int):
             "filename": filename,
             "section": pl.get("section"),
             "page_range": pl.get("page_range"),
+            "page_unit": pl.get("page_unit"),
             "excerpt": snippet,
             "score": getattr(p, "score", None),
         })
@@ -223,9 +426,14 @@ def assemble_snippet(points, question: str, max_tokens: int):
         used_chunks
     )
 
-def main():
+def retrieve(inp: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Runs one retrieval for a request dict (the same JSON the CLI reads) and
+    returns the result dict. Config, Qdrant client and HTTP session stay warm
+    between calls, so rag_service.py can call this per request. The request
+    uses one Settings snapshot throughout, even if the INI changes meanwhile.
+    """
     t0 = time.time()
-    inp = read_input()
     question   = inp.get("question","")
     chat_id    = inp.get("chat_id")
     user       = inp.get("user")
@@ -234,11 +442,13 @@ def main():
     ini_path   = inp.get("config_path")
 
     if not question or not chat_id or not user:
-        print(json.dumps({"error":"missing question/chat_id/user"})); sys.exit(1)
+        raise ValueError("missing question/chat_id/user")
 
-    load_ini(ini_path)
+    settings = ensure_config(ini_path)
+    _REQUEST.deployment = inp.get("deployment")
     mode = inp.get("mode")
-    client = QdrantClient(url=QDRANT_URL, api_key=QDRANT_API_KEY, timeout=15.0)
+    client = qdrant(settings)
+    used_model = settings.azure["deployment"] if settings.azure["key"] else settings.openai["model"]
     flt_base = [
         FieldCondition(key="user_id",  match=MatchValue(value=user)),
         FieldCondition(key="chat_id",  match=MatchValue(value=chat_id)),
@@ -265,7 +475,7 @@ def main():
         offset = None
         while True:
             res = client.scroll(
-                collection_name=QDRANT_COLLECTION,
+                collection_name=settings.collection,
                 scroll_filter=flt,
                 limit=64,
                 offset=offset,
@@ -290,12 +500,7 @@ def main():
                 continue
             fname = pl.get("filename") or f"doc-{pl.get('document_id')}"
             chunk_idx = pl.get("chunk_index")
-            cite_bits = []
-            if chunk_idx is not None:
-                cite_bits.append(f"chunk {chunk_idx}")
-            if pl.get("section"):
-                cite_bits.append(f"sec. {pl['section']}")
-            cite_suffix = ", ".join(cite_bits)
+            cite_suffix = ", ".join(_cite_bits(pl))
             cite_tag = f"【{fname}"
             if cite_suffix:
                 cite_tag += f", {cite_suffix}"
@@ -313,6 +518,7 @@ def main():
                 "filename": fname,
                 "section": pl.get("section"),
                 "page_range": pl.get("page_range"),
+                "page_unit": pl.get("page_unit"),
                 "excerpt": text,
                 "content": block,
                 "tokens": need,
@@ -332,6 +538,7 @@ def main():
                 "document_id": chunk.get("document_id"),
                 "filename": chunk.get("filename"),
                 "page": chunk.get("page_range"),
+                "page_unit": chunk.get("page_unit"),
                 "section": chunk.get("section"),
                 "chunk_index": chunk.get("chunk_index"),
                 "excerpt": chunk.get("excerpt"),
@@ -352,24 +559,30 @@ def main():
             "chunks": used_chunks,
             "retrieved": len(points),
             "latency_ms": int((time.time()-t0)*1000),
-            "embedding_model_used": AZURE['deployment'] if AZURE["key"] else OPENAI["model"],
-            "collection": QDRANT_COLLECTION,
+            "embedding_model_used": used_model,
+            "collection": settings.collection,
             "mode": "full_document_chunks"
         }
-        print(json.dumps(out))
-        return
+        return out
 
-    vec = embed_query(question)
+    _REQUEST.query_cache = None
+    vec = embed_query(question, settings)
+    check_query_dim(client, vec, settings)
 
     flt = Filter(must=flt_base)
 
+    query_kw = {}
+    params = search_params(settings.search)
+    if params is not None:
+        query_kw["search_params"] = params
     res = client.query_points(
-        collection_name=QDRANT_COLLECTION,
+        collection_name=settings.collection,
         query=vec,
         query_filter=flt,
         limit=top_k,
         with_payload=True,
         with_vectors=False,
+        **query_kw,
     )
 
     hits = res.points if hasattr(res, "points") else res
@@ -381,6 +594,7 @@ def main():
             "document_id": chunk.get("document_id"),
             "filename": chunk.get("filename"),
             "page": chunk.get("page_range"),
+            "page_unit": chunk.get("page_unit"),
             "section": chunk.get("section"),
             "chunk_index": chunk.get("chunk_index"),
             "excerpt": chunk.get("excerpt"),
@@ -400,9 +614,18 @@ def main():
         "citations": citations,
         "retrieved": len(hits),
         "latency_ms": int((time.time()-t0)*1000),
-        "embedding_model_used": AZURE['deployment'] if AZURE["key"] else OPENAI["model"],
-        "collection": QDRANT_COLLECTION
+        "embedding_model_used": used_model,
+        "collection": settings.collection,
+        "query_cache": dict(query_cache(settings).stats(), result=getattr(_REQUEST, "query_cache", None)),
     }
+    return out
+
+def main():
+    inp = read_input()
+    try:
+        out = retrieve(inp)
+    except ValueError as e:
+        print(json.dumps({"error": str(e)})); sys.exit(1)
     print(json.dumps(out))
 
 if __name__ == "__main__":
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# rag_service.py
+#
+# Long-running front end for rag_retrieve.retrieve(): keeps the INI, Qdrant
+# client, embedding HTTP session and tokenizer warm, and serves retrievals over
+# a Unix socket (newline-delimited JSON, see local_service.py). run_rag() in
+# RAG.inc.php calls it first and falls back to the rag_retrieve.py CLI.
+#
+#   python3 rag_service.py serve [socket] [--config /etc/apps/chat_config.ini]
+#
+# Requests are the CLI's JSON input plus "op": "retrieve"; replies are the CLI's
+# JSON output. {"op": "ping"} reports what is warm.
+
+import os, sys, time, tempfile
+from typing import Any, Dict
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import rag_retrieve  # noqa: E402
+from local_service import serve_unix  # noqa: E402
+
+_STARTED = time.time()
+
+
+def default_socket_path() -> str:
+    return os.getenv("RAG_SERVICE_SOCKET") or os.path.join(tempfile.gettempdir(), "nhlbi_rag_service.sock")
+
+
+def handle_request(req: Dict[str, Any]) -> Dict[str, Any]:
+    op = req.get("op", "retrieve")
+    if op == "ping":
+        return {"ok": True, "uptime_s": int(time.time() - _STARTED),
+                "configs": rag_retrieve.loaded_configs(),
+                "qdrant_client": bool(rag_retrieve._QDRANT)}
+    if op == "retrieve":
+        inp = {k: v for k, v in req.items() if k != "op"}
+        try:
+            return rag_retrieve.retrieve(inp)
+        except ValueError as e:
+            return {"error": str(e)}
+    raise ValueError(f"unknown op: {op}")
+
+
+def serve(socket_path: str, config_path: str = None):
+    if config_path:
+        # Pay for the INI, Qdrant client, session and encoding before the first request
+        settings = rag_retrieve.ensure_config(config_path)
+        rag_retrieve.qdrant(settings)
+        rag_retrieve.http_session()
+        rag_retrieve._enc()
+    serve_unix(socket_path, handle_request, name="rag_service")
+
+
+def main():
+    args = sys.argv[1:]
+    if not args or args[0] != "serve":
+        print("Usage: python rag_service.py serve [socket] [--config /path/to/chat_config.ini]")
+        sys.exit(1)
+    args = args[1:]
+    config_path = None
+    if "--config" in args:
+        i = args.index("--config")
+        config_path = args[i + 1] if i + 1 < len(args) else None
+        del args[i:i + 2]
+    serve(args[0] if args else default_socket_path(), config_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+# text_chunker.py
+#
+# Streaming token-level chunker used by build_index.py.
+#
+# The file is read in fixed-size byte blocks. Each block is hashed (optional)
+# and decoded incrementally, then cut at the last whitespace run so that no
+# word is split between two encode() calls. The tokens are appended to a
+# running buffer that carries over between blocks. Every character is
+# encoded exactly once, chunks are always `max_tokens` long (except the
+# last), and the `overlap` tokens between neighbours are kept across block
+# boundaries.
+#
+#   for chunk in iter_file_chunks(path, enc, max_tokens=450, overlap=50, hasher=hashlib.sha256()):
+#       ...
+#
+# With the parser's structure sidecar (byte offset -> page/slide/sheet, see
+# parser_multi.write_structure) the chunker also reports which pages each chunk
+# spans and prefers to end a chunk at a page boundary in its second half.
+
+import io, json, codecs
+from typing import Any, Dict, Iterator, List, Optional
+
+READ_SIZE = 256 * 1024
+# Text without any whitespace is cut anyway once this many characters are pending
+_MAX_CARRY = 4 * READ_SIZE
+
+
+class TokenChunker:
+    """
+    Incremental form of build_index.chunk_text(): feed() text pieces in order,
+    then finish(). Both yield decoded chunks of `max_tokens` tokens whose starts
+    are `max_tokens - overlap` tokens apart.
+    """
+
+    def __init__(self, encoder, max_tokens: int, overlap: int = 0, spans: bool = False):
+        if max_tokens < 1:
+            raise ValueError("max_tokens must be at least 1")
+        self.encoder = encoder
+        self.max_tokens = int(max_tokens)
+        self.step = self.max_tokens - min(max(0, int(overlap)), self.max_tokens - 1)
+        self.spans = spans  # yield (text, labels) instead of text
+        self.tokens_seen = 0
+        self._encode = getattr(encoder, "encode_ordinary", None) or encoder.encode
+        self._text = ""
+        self._tokens: List[int] = []
+        self._base = 0  # absolute index of self._tokens[0]
+        self._marks: List[tuple] = []  # (absolute token index, label), ascending
+        self._started = False
+
+    def mark(self, label: str) -> Iterator[Any]:
+        """Records a structural boundary (page, slide, sheet) at the current position."""
+        text, self._text = self._text, ""
+        if text:
+            yield from self._push(text)
+        self._marks.append((self._base + len(self._tokens), label))
+
+    def feed(self, text: str) -> Iterator[str]:
+        if not self._started:
+            text = text.lstrip()
+            if not text:
+                return
+            self._started = True
+        buf = self._text + text
+        cut = _last_break(buf)
+        if cut == 0 and len(buf) < _MAX_CARRY:
+            self._text = buf
+            return
+        if cut == 0:
+            cut = len(buf)
+        self._text = buf[cut:]
+        yield from self._push(buf[:cut])
+
+    def finish(self) -> Iterator[Any]:
+        tail, self._text = self._text.rstrip(), ""
+        if tail:
+            yield from self._push(tail)
+        if self._tokens:
+            yield self._emit(0, len(self._tokens))
+            self._base += len(self._tokens)
+            self._tokens = []
+
+    def _push(self, text: str) -> Iterator[Any]:
+        toks = self._encode(text)
+        self.tokens_seen += len(toks)
+        buf = self._tokens
+        buf.extend(toks)
+        start = 0
+        # Strictly greater: a full chunk that ends the text is emitted by finish()
+        while len(buf) - start > self.max_tokens:
+            end = start + self.max_tokens
+            boundary = self._boundary(start, end)
+            if boundary:
+                end = nxt = boundary
+            else:
+                nxt = start + self.step
+            yield self._emit(start, end)
+            start = nxt
+        if start:
+            del buf[:start]
+            self._base += start
+            self._drop_marks_before(self._base)
+
+    def _boundary(self, start: int, end: int) -> int:
+        """Relative index of the last mark in the second half of [start, end), or 0."""
+        lo = self._base + start + self.max_tokens // 2
+        hi = self._base + end
+        for pos, _ in reversed(self._marks):
+            if pos < hi:
+                return pos - self._base if pos > lo else 0
+        return 0
+
+    def _emit(self, start: int, end: int) -> Any:
+        text = self.encoder.decode(self._tokens[start:end])
+        if not self.spans:
+            return text
+        lo, hi = self._base + start, self._base + end
+        labels = []
+        for pos, label in self._marks:
+            if pos >= hi:
+                break
+            if pos <= lo:
+                labels = [label]  # the section the chunk starts in
+            elif not labels or labels[-1] != label:
+                labels.append(label)
+        return text, labels
+
+    def _drop_marks_before(self, pos: int):
+        # Keep the last mark at or before `pos`: it labels the next chunk's start
+        keep = 0
+        for i, (p, _) in enumerate(self._marks):
+            if p <= pos:
+                keep = i
+            else:
+                break
+        if keep:
+            del self._marks[:keep]
+
+
+def _last_break(text: str) -> int:
+    """Index where the last whitespace run starts, or 0 if there is none."""
+    j = len(text)
+    while j > 0 and not text[j - 1].isspace():
+        j -= 1
+    while j > 0 and text[j - 1].isspace():
+        j -= 1
+    return j
+
+
+def load_structure(path: Optional[str]) -> Optional[Dict[str, Any]]:
+    """Reads a parser structure sidecar; None when absent, unreadable or without marks."""
+    if not path:
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return parse_structure(f.read())
+    except OSError:
+        return None
+
+
+def parse_structure(raw: Optional[str]) -> Optional[Dict[str, Any]]:
+    """Decodes a structure index (sidecar file or document.structure_index); None if unusable."""
+    if not raw:
+        return None
+    try:
+        data = json.loads(raw)
+    except ValueError:
+        return None
+    if not isinstance(data, dict) or data.get("v") != 1 or not data.get("marks"):
+        return None
+    return data
+
+
+def iter_text_chunks(stream, encoder, max_tokens: int, overlap: int = 0, hasher=None,
+                     read_size: int = READ_SIZE, chunker: Optional[TokenChunker] = None,
+                     structure: Optional[Dict[str, Any]] = None) -> Iterator[Any]:
+    """
+    Chunks a binary stream of UTF-8 text. Undecodable bytes are dropped and
+    line endings are normalized to "\\n". `hasher` (e.g. hashlib.sha256())
+    receives every raw byte read, so the caller gets the content hash from the
+    same pass. With `structure`, yields (text, labels) where labels are the
+    pages/slides/sheets the chunk spans, in order.
+    """
+    chunker = chunker or TokenChunker(encoder, max_tokens, overlap, spans=structure is not None)
+    decoder = io.IncrementalNewlineDecoder(codecs.getincrementaldecoder("utf-8")(errors="ignore"), translate=True)
+    marks = iter(sorted((int(off), str(label)) for off, label in (structure or {}).get("marks", [])))
+    pending = next(marks, None)
+    pos = 0
+    while True:
+        block = stream.read(read_size)
+        if not block:
+            break
+        if hasher is not None:
+            hasher.update(block)
+        # Markers sit at line starts, so cutting the block there never splits a character
+        while pending is not None and pending[0] < pos + len(block):
+            cut = max(0, pending[0] - pos)
+            if cut:
+                yield from chunker.feed(decoder.decode(block[:cut]))
+                block = block[cut:]
+                pos += cut
+            yield from chunker.mark(pending[1])
+            pending = next(marks, None)
+        pos += len(block)
+        yield from chunker.feed(decoder.decode(block))
+    yield from chunker.feed(decoder.decode(b"", final=True))
+    yield from chunker.finish()
+
+
+def iter_file_chunks(path: str, encoder, max_tokens: int, overlap: int = 0, hasher=None,
+                     read_size: int = READ_SIZE, structure: Optional[Dict[str, Any]] = None) -> Iterator[Any]:
+    with open(path, "rb") as f:
+        yield from iter_text_chunks(f, encoder, max_tokens, overlap, hasher, read_size, structure=structure)
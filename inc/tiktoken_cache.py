@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# tiktoken_cache.py
+#
+# Offline tiktoken encodings for air-gapped hosts.
+#
+# `python3 inc/tiktoken_cache.py build` (run once at install time, on a host that
+# can reach the BPE files or with TIKTOKEN_CACHE_DIR already populated) fills
+# <app>/tiktoken_cache/ with:
+#   - tiktoken's own cache files, so plain tiktoken.get_encoding() never downloads
+#   - one pre-processed <encoding>.tkenc per encoding: ranks and token bytes laid
+#     out as flat arrays, so loading is a memory map plus one dict build instead
+#     of base64-decoding ~200k lines
+#
+# load_encoding() prefers the .tkenc file and falls back to tiktoken.get_encoding().
+
+import os, sys, json, mmap, shutil, struct, itertools
+from array import array
+from typing import Optional
+
+import tiktoken
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CACHE_DIR = os.getenv("NHLBI_TIKTOKEN_CACHE") or os.path.join(APP_DIR, "tiktoken_cache")
+
+DEFAULT_BUILD = ("cl100k_base", "o200k_base")
+
+_MAGIC = b"NHTKENC1"
+_PREAMBLE = struct.Struct("<8sII")  # magic, header length, token count
+
+# Point tiktoken at the bundled cache so any fallback load stays offline
+if os.path.isdir(CACHE_DIR):
+    os.environ.setdefault("TIKTOKEN_CACHE_DIR", CACHE_DIR)
+
+
+def cache_file(encoding_name: str, cache_dir: Optional[str] = None) -> str:
+    return os.path.join(cache_dir or CACHE_DIR, f"{encoding_name}.tkenc")
+
+
+def write_encoding(encoding, path: str) -> int:
+    """
+    Writes a loaded tiktoken.Encoding as a .tkenc file: preamble, JSON header
+    (pat_str, special tokens, ...), then rank (uint32) and length (uint16) arrays
+    and the concatenated token bytes. Returns the number of tokens written.
+    """
+    items = sorted(encoding._mergeable_ranks.items(), key=lambda kv: kv[1])
+    ranks = array("I", (rank for _, rank in items))
+    lengths = array("H", (len(token) for token, _ in items))
+    header = json.dumps({
+        "name": encoding.name,
+        "pat_str": encoding._pat_str,
+        "special_tokens": encoding._special_tokens,
+        "byteorder": sys.byteorder,
+    }).encode("utf-8")
+    header += b" " * (-len(header) % 4)  # keep the rank array 4-byte aligned
+
+    tmp = f"{path}.tmp.{os.getpid()}"
+    with open(tmp, "wb") as f:
+        f.write(_PREAMBLE.pack(_MAGIC, len(header), len(items)))
+        f.write(header)
+        f.write(ranks.tobytes())
+        f.write(lengths.tobytes())
+        for token, _ in items:
+            f.write(token)
+    os.replace(tmp, path)
+    return len(items)
+
+
+def read_encoding(path: str):
+    """Builds a tiktoken.Encoding from a memory-mapped .tkenc file."""
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        magic, header_len, count = _PREAMBLE.unpack_from(mm, 0)
+        if magic != _MAGIC:
+            raise ValueError(f"not a .tkenc file: {path}")
+        pos = _PREAMBLE.size
+        header = json.loads(mm[pos:pos + header_len])
+        if header.get("byteorder") != sys.byteorder:
+            raise ValueError(f"{path} was built on a {header.get('byteorder')}-endian host")
+        pos += header_len
+
+        ranks = array("I")
+        ranks.frombytes(mm[pos:pos + 4 * count])
+        pos += 4 * count
+        lengths = array("H")
+        lengths.frombytes(mm[pos:pos + 2 * count])
+        pos += 2 * count
+
+        # Each token is sliced straight out of the map: tiktoken needs bytes keys
+        # anyway, so this is the only copy and the blob is never read twice
+        ends = itertools.accumulate(lengths, initial=pos)
+        starts, ends = itertools.tee(ends)
+        next(ends, None)
+        mergeable_ranks = dict(zip(map(mm.__getitem__, map(slice, starts, ends)), ranks))
+
+    if len(mergeable_ranks) != count:
+        raise ValueError(f"{path} is truncated or corrupt")
+    return tiktoken.Encoding(
+        header["name"],
+        pat_str=header["pat_str"],
+        mergeable_ranks=mergeable_ranks,
+        special_tokens=header["special_tokens"],
+    )
+
+
+def load_encoding(encoding_name: str, cache_dir: Optional[str] = None):
+    """
+    Returns the encoding from its pre-processed cache file when there is one,
+    otherwise from tiktoken (which reads TIKTOKEN_CACHE_DIR before the network).
+    """
+    path = cache_file(encoding_name, cache_dir)
+    if os.path.exists(path):
+        try:
+            return read_encoding(path)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"[tiktoken_cache] ignoring {path}: {e}", file=sys.stderr)
+    return tiktoken.get_encoding(encoding_name)
+
+
+def build(encoding_names=DEFAULT_BUILD, cache_dir: Optional[str] = None, source_dir: Optional[str] = None) -> dict:
+    """
+    Populates the cache directory. `source_dir` may be an existing tiktoken cache
+    (e.g. copied from a connected host); otherwise tiktoken downloads the files.
+    """
+    cache_dir = cache_dir or CACHE_DIR
+    os.makedirs(cache_dir, exist_ok=True)
+    if source_dir:
+        for name in os.listdir(source_dir):
+            src = os.path.join(source_dir, name)
+            if os.path.isfile(src) and not name.endswith(".tkenc"):
+                shutil.copy2(src, os.path.join(cache_dir, name))
+    # tiktoken writes its raw cache files wherever TIKTOKEN_CACHE_DIR points
+    os.environ["TIKTOKEN_CACHE_DIR"] = cache_dir
+
+    built = {}
+    for name in encoding_names:
+        encoding = tiktoken.get_encoding(name)
+        built[name] = write_encoding(encoding, cache_file(name, cache_dir))
+    return built
+
+
+def main():
+    args = sys.argv[1:]
+    if not args or args[0] != "build":
+        print("Usage: python tiktoken_cache.py build [--dir DIR] [--from TIKTOKEN_CACHE] [encoding ...]")
+        sys.exit(1)
+    args = args[1:]
+    cache_dir = source_dir = None
+    names = []
+    while args:
+        arg = args.pop(0)
+        if arg == "--dir" and args:
+            cache_dir = args.pop(0)
+        elif arg == "--from" and args:
+            source_dir = args.pop(0)
+        else:
+            names.append(arg)
+    built = build(names or DEFAULT_BUILD, cache_dir, source_dir)
+    print(json.dumps({"cache_dir": cache_dir or CACHE_DIR, "tokens": built}))
+
+
+if __name__ == "__main__":
+    main()
@@ -11,9 +11,22 @@ NHLBI Chat – multipurpose document parser with optional on-prem OCR support
 Set environment variables:
   OCR_ENABLED=0            # disables all OCR work
   OCR_LANG=spa+eng         # any language string valid for tesseract
+  PDF_WORKERS=4            # processes for PDF pages (1 = serial, 0 = auto, up to 4)
+  OCR_WORKERS=4            # concurrent tesseract runs per document (0 = auto, up to 4)
+  OCR_DOC_BUDGET_SEC=900   # OCR time per document; later images are skipped (0 = no limit)
+  OCR_MIN_PIXELS=2500      # images with a smaller pixel area (icons, bullets) are not OCRed
+  OCR_MIN_STDDEV=2.0       # nor are near-uniform ones (grayscale std. deviation below this)
+  OCR_TARGET_DPI=300       # larger scans are downscaled to this before OCR
+  OCR_BATCH_SIZE=16        # images per tesseract process (1 = one process per image)
+  OCR_CACHE_PATH=…         # SQLite file caching OCR text across uploads (unset = per process only)
+  OCR_CACHE_MAX_MB=64      # size bound of that file; least recently used text is dropped
+  PARSER_STRUCTURE_FILE=…  # where to write the page/slide/sheet offset index
 """
 
-import os, sys, io, logging, itertools, json, time
+import os, re, sys, io, logging, itertools, json, time, threading, hashlib, sqlite3, subprocess, tempfile
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 import pandas as pd
 
 # 3rd-party helpers ----------------------------------------------------
@@ -27,17 +40,38 @@ from pptx import Presentation
 from pptx.enum.shapes import MSO_SHAPE_TYPE
 import xlrd
 
+try:  # optional: keeps the language model loaded between images
+    import tesserocr
+except ImportError:
+    tesserocr = None
+
 # ---------- configuration ----------
 OCR_ENABLED = os.getenv("OCR_ENABLED", "1") != "0"
 OCR_LANG = os.getenv("OCR_LANG", "eng")
 PDF_SKIP_IMAGE_OCR_TEXT_LEN = int(os.getenv("PDF_SKIP_IMAGE_OCR_TEXT_LEN", "200"))
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", "0")) or min(4, os.cpu_count() or 1)
+OCR_DOC_BUDGET_SEC = float(os.getenv("OCR_DOC_BUDGET_SEC", "900"))
+OCR_MIN_PIXELS = int(os.getenv("OCR_MIN_PIXELS", "2500"))
+OCR_MIN_STDDEV = float(os.getenv("OCR_MIN_STDDEV", "2.0"))
+OCR_TARGET_DPI = int(os.getenv("OCR_TARGET_DPI", "300"))
+# Longest side, in inches, assumed for images that carry no usable DPI (most
+# embedded ones): a letter or A4 page, so a full-page scan lands at OCR_TARGET_DPI.
+OCR_ASSUMED_PAGE_INCHES = 11.7
+OCR_BATCH_SIZE = max(1, int(os.getenv("OCR_BATCH_SIZE", "16")))
+OCR_CACHE_PATH = os.getenv("OCR_CACHE_PATH", "")
+OCR_CACHE_MAX_MB = float(os.getenv("OCR_CACHE_MAX_MB", "64"))
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", "0")) or min(4, os.cpu_count() or 1)
+# Pages handed to a worker at a time; small enough for steady progress, large
+# enough that re-opening the document per range stays cheap.
+PDF_PAGES_PER_TASK = 8
 
 log = logging.getLogger("nhlbi_parser")
 log.setLevel(logging.INFO)
 
 PROGRESS_FILE = os.getenv("PARSER_STATUS_FILE")
+STRUCTURE_FILE = os.getenv("PARSER_STRUCTURE_FILE")
 PARSER_JOB_ID = os.getenv("PARSER_JOB_ID")
-_PROGRESS_STATE = {"stage": None, "percent": -1.0, "last_write": 0.0}
+_PROGRESS_STATE = {"stage": None, "percent": -1.0, "last_write": 0.0, "ocr": None}
 
 
 def _write_progress(stage, percent, message, status) -> None:
@@ -51,6 +85,9 @@ def _write_progress(stage, percent, message, status) -> None:
         "message": message,
         "updated_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
     }
+    ocr = _PROGRESS_STATE.get("ocr")
+    if ocr is not None:
+        payload["ocr"] = ocr.snapshot()
     tmp_path = PROGRESS_FILE + ".tmp"
     try:
         with open(tmp_path, "w", encoding="utf-8") as handle:
@@ -104,22 +141,569 @@ def report_failure(stage, message: str) -> None:
     _write_progress(stage, _PROGRESS_STATE.get("percent"), message, "failed")
 
 
-def ocr_image_bytes(image_bytes: bytes, description: str = "") -> str:
+# ==========================================================
+# OCR triage (before tesseract)
+# ==========================================================
+def _ocr_scale(img) -> float:
+    """Downscale factor (<= 1) that brings the image to OCR_TARGET_DPI."""
+    scale = 1.0
+    try:
+        dpi = float((img.info.get("dpi") or (0, 0))[0])
+    except (TypeError, ValueError, IndexError):
+        dpi = 0.0
+    if dpi > OCR_TARGET_DPI:
+        scale = OCR_TARGET_DPI / dpi
+    # DPI metadata is often missing or a placeholder 72; the pixel size still says "page scan"
+    longest = OCR_TARGET_DPI * OCR_ASSUMED_PAGE_INCHES
+    if max(img.size) * scale > longest:
+        scale = longest / max(img.size)
+    return scale
+
+
+def _grayscale(img):
+    """8-bit grayscale; transparent areas become white instead of black."""
+    if img.mode in ("RGBA", "LA", "PA") or (img.mode == "P" and "transparency" in img.info):
+        rgba = img.convert("RGBA")
+        img = Image.alpha_composite(Image.new("RGBA", rgba.size, (255, 255, 255, 255)), rgba)
+    return img if img.mode == "L" else img.convert("L")
+
+
+def _near_uniform(img) -> bool:
+    hist = img.histogram()[:256]
+    count = sum(hist)
+    if not count:
+        return True
+    mean = sum(i * c for i, c in enumerate(hist)) / count
+    variance = sum(c * (i - mean) ** 2 for i, c in enumerate(hist)) / count
+    return variance ** 0.5 < OCR_MIN_STDDEV
+
+
+def triage_image(image_bytes: bytes):
+    """
+    Decides whether an image is worth OCR and prepares it: returns
+    (image or None, outcome) with outcome "skipped_small", "skipped_uniform",
+    "scaled" or "ok". Oversized scans are reduced to OCR_TARGET_DPI; JPEGs
+    via draft mode, so the decoder never produces the full-size bitmap.
     """
-    Run Tesseract OCR on raw image bytes. Returns empty string if OCR disabled
-    or no text found.
+    img = Image.open(io.BytesIO(image_bytes))
+    width, height = img.size
+    if width * height < OCR_MIN_PIXELS:
+        return None, "skipped_small"
+    outcome = "ok"
+    scale = _ocr_scale(img)
+    if scale < 1.0:
+        size = (max(1, int(width * scale)), max(1, int(height * scale)))
+        if img.format == "JPEG":
+            img.draft("L", size)  # decodes at 1/2, 1/4 or 1/8 scale, straight to grayscale
+        img = _grayscale(img)
+        if img.size[0] > size[0]:
+            img = img.resize(size, getattr(Image, "Resampling", Image).LANCZOS)
+        outcome = "scaled"
+    else:
+        img = _grayscale(img)
+    if _near_uniform(img):
+        return None, "skipped_uniform"
+    return img, outcome
+
+
+def _tesseract(image, timeout: float = 0) -> str:
+    """One tesseract run on a prepared image; raises on `timeout` (0 = no limit)."""
+    if timeout:
+        return pytesseract.image_to_string(image, lang=OCR_LANG, timeout=timeout).strip()
+    return pytesseract.image_to_string(image, lang=OCR_LANG).strip()
+
+
+def _tesseract_batch(images: list, timeout: float = 0) -> list:
+    """
+    OCRs several prepared images with one tesseract process, so the language
+    model is loaded once: the images are written to a temp dir and listed in a
+    file, and tesseract prints each one's text followed by a form feed. Raises
+    if the output does not split into exactly one page per image.
+    """
+    cmd = getattr(getattr(pytesseract, "pytesseract", None), "tesseract_cmd", "tesseract")
+    with tempfile.TemporaryDirectory(prefix="ocr_batch_") as tmp:
+        paths = []
+        for i, img in enumerate(images):
+            path = os.path.join(tmp, f"{i:05d}.png")
+            img.save(path, format="PNG")
+            paths.append(path)
+        list_path = os.path.join(tmp, "images.txt")
+        with open(list_path, "w", encoding="utf-8") as handle:
+            handle.write("\n".join(paths) + "\n")
+        proc = subprocess.run([cmd, list_path, "stdout", "-l", OCR_LANG],
+                              capture_output=True, timeout=timeout or None, check=True)
+    pages = proc.stdout.decode("utf-8", errors="replace").split("\f")
+    if len(pages) == len(images) + 1 and not pages[-1].strip():
+        pages.pop()  # separator after the last page, not between pages
+    if len(pages) != len(images):
+        raise RuntimeError(f"tesseract returned {len(pages)} pages for {len(images)} images")
+    return [page.strip() for page in pages]
+
+
+def ocr_image_bytes(image_bytes: bytes, description: str = "", timeout: float = 0) -> str:
+    """
+    Run Tesseract OCR on raw image bytes. Returns empty string if OCR disabled,
+    no text found, or tesseract ran longer than `timeout` seconds (0 = no limit).
     """
     if not OCR_ENABLED:
         return ""
     try:
-        img = Image.open(io.BytesIO(image_bytes))
-        text = pytesseract.image_to_string(img, lang=OCR_LANG)
-        return text.strip()
+        img, _outcome = triage_image(image_bytes)
+        return _tesseract(img, timeout) if img is not None else ""
     except Exception as exc:  # pylint: disable=broad-except
         log.warning("OCR failure on %s: %s", description, exc)
         return ""
 
 
+# ==========================================================
+# OCR cache
+# ==========================================================
+_TESSERACT_VERSION = None
+
+
+def tesseract_version() -> str:
+    global _TESSERACT_VERSION
+    if _TESSERACT_VERSION is None:
+        try:
+            _TESSERACT_VERSION = str(pytesseract.get_tesseract_version())
+        except Exception:  # pylint: disable=broad-except
+            _TESSERACT_VERSION = "unknown"
+    return _TESSERACT_VERSION
+
+
+class OcrCache:
+    """
+    OCR text keyed by (sha256 of the image bytes, OCR_LANG, tesseract version).
+    Repeats within a process come from a dict; with a path, text is also kept
+    in a SQLite file shared by every parser run, trimmed to `max_bytes` of text
+    by dropping the least recently used rows. Cache errors never fail a parse.
+    """
+
+    TABLE = "ocr_cache"
+
+    def __init__(self, path: str = None, max_bytes: int = 64 * 1024 * 1024, memory_entries: int = 4096):
+        self.path = path or None
+        self.max_bytes = max(0, int(max_bytes))
+        self.memory_entries = memory_entries
+        self._memory = {}
+        self._lock = threading.Lock()  # guards _memory and the eviction counter only
+        self._local = threading.local()
+        self._puts_since_evict = 0
+
+    def key(self, image_bytes: bytes) -> str:
+        digest = hashlib.sha256(image_bytes).hexdigest()
+        # The triage target changes what tesseract sees, so it is part of the key too
+        return f"{digest}:{OCR_LANG}:{tesseract_version()}:{OCR_TARGET_DPI}"
+
+    def _db(self):
+        """This thread's connection; OCR workers never wait on each other's disk I/O."""
+        if not self.path:
+            return None
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            parent = os.path.dirname(self.path)
+            if parent:
+                os.makedirs(parent, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.TABLE} ("
+                " key TEXT PRIMARY KEY, text TEXT NOT NULL, bytes INTEGER NOT NULL, last_used REAL NOT NULL)"
+            )
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {self.TABLE}_last_used ON {self.TABLE} (last_used)")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str):
+        """Returns (text, tier) with tier "memory", "disk" or "miss"."""
+        with self._lock:
+            text = self._memory.get(key)
+        if text is not None:
+            return text, "memory"
+        try:
+            db = self._db()
+            row = None
+            if db is not None:
+                row = db.execute(f"SELECT text FROM {self.TABLE} WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    db.execute(f"UPDATE {self.TABLE} SET last_used = ? WHERE key = ?", (time.time(), key))
+        except (sqlite3.Error, OSError) as exc:
+            log.warning("OCR cache read failed: %s", exc)
+            row = None
+        if row is None:
+            return None, "miss"
+        with self._lock:
+            self._remember(key, row[0])
+        return row[0], "disk"
+
+    def put(self, key: str, text: str) -> None:
+        with self._lock:
+            self._remember(key, text)
+            if not self.path:
+                return
+            self._puts_since_evict += 1
+            evict = self._puts_since_evict >= 32
+            if evict:
+                self._puts_since_evict = 0
+        try:
+            db = self._db()
+            db.execute(
+                f"INSERT OR REPLACE INTO {self.TABLE} (key, text, bytes, last_used) VALUES (?, ?, ?, ?)",
+                (key, text, len(text.encode("utf-8")), time.time()),
+            )
+            if evict:
+                self._evict(db)
+        except (sqlite3.Error, OSError) as exc:
+            log.warning("OCR cache write failed: %s", exc)
+
+    def evict(self) -> None:
+        """Drops the least recently used rows beyond max_bytes of cached text."""
+        try:
+            db = self._db()
+            if db is not None:
+                self._evict(db)
+        except (sqlite3.Error, OSError) as exc:
+            log.warning("OCR cache eviction failed: %s", exc)
+
+    def _evict(self, db) -> None:
+        if not self.max_bytes:
+            return
+        db.execute(
+            f"DELETE FROM {self.TABLE} WHERE key IN (SELECT key FROM ("
+            f" SELECT key, SUM(bytes) OVER (ORDER BY last_used DESC, key) AS running FROM {self.TABLE})"
+            " WHERE running > ?)",
+            (self.max_bytes,),
+        )
+
+    def _remember(self, key: str, text: str) -> None:
+        if len(self._memory) >= self.memory_entries:
+            self._memory.pop(next(iter(self._memory)))
+        self._memory[key] = text
+
+
+_OCR_CACHE = None
+
+
+def ocr_cache() -> OcrCache:
+    """The process-wide cache configured by OCR_CACHE_PATH / OCR_CACHE_MAX_MB."""
+    global _OCR_CACHE
+    if _OCR_CACHE is None:
+        _OCR_CACHE = OcrCache(OCR_CACHE_PATH, int(OCR_CACHE_MAX_MB * 1024 * 1024))
+    return _OCR_CACHE
+
+
+# ==========================================================
+# OCR executor (shared by the DOCX, PPTX and PDF parsers)
+# ==========================================================
+class OcrJob:
+    """Handle for one submitted image; text() waits for it."""
+
+    def __init__(self, future=None, text: str = "", executor=None):
+        self._future = future
+        self._text = text
+        self._executor = executor
+
+    def done(self) -> bool:
+        return self._future is None or self._future.done()
+
+    def text(self) -> str:
+        if self._future is None:
+            return self._text
+        if not self._future.done() and self._executor is not None:
+            self._executor.flush()  # the image may still sit in an unsent batch
+        return self._future.result()
+
+
+class OcrExecutor:
+    """
+    Bounded pool of tesseract runs for one document. Parsers submit images as
+    they find them and read the results back in document order. Threads are
+    enough here: tesseract itself runs in a subprocess (or in tesserocr,
+    which releases the GIL).
+
+    Images are sent in batches of `batch_size`, one tesseract process per
+    batch (_tesseract_batch), because loading the language model dominates
+    the run time for small images. A batch whose output cannot be mapped
+    back falls back to one run per image. With tesserocr installed, each
+    worker thread keeps its own loaded API instead and batches are not
+    needed.
+
+    submit() blocks while too many images are waiting, so a large deck is
+    not held in memory at once. Images already in the OcrCache, or already
+    submitted for this document, are not OCRed again. Each image goes
+    through triage_image() first; skipped and downscaled ones are counted.
+    Once the per-document budget is spent, images that have not started yet
+    are skipped (empty text), and running ones are cut off by a timeout (the
+    subprocess timeout, or Recognize()'s with tesserocr).
+    Timing, queue depth, batches and cache hits are written to the progress
+    file under "ocr".
+    """
+
+    def __init__(self, workers: int = None, budget_sec: float = None, cache: OcrCache = None,
+                 batch_size: int = None):
+        self.workers = max(1, workers or OCR_WORKERS)
+        self.budget_sec = OCR_DOC_BUDGET_SEC if budget_sec is None else budget_sec
+        self.cache = cache if cache is not None else ocr_cache()
+        if tesserocr is not None:
+            self.engine, self.batch_size = "tesserocr", 1
+        else:
+            self.batch_size = max(1, batch_size or OCR_BATCH_SIZE)
+            self.engine = "tesseract-batch" if self.batch_size > 1 else "tesseract"
+        self._seen = {}
+        self._batch = []
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="ocr")
+        self._slots = threading.BoundedSemaphore(max(3 * self.workers, 2 * self.batch_size))
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._apis = []
+        self._started = time.monotonic()
+        self._warned = False
+        self.stats = {
+            "engine": self.engine,
+            "workers": self.workers,
+            "submitted": 0,
+            "completed": 0,
+            "batches": 0,
+            "batch_fallbacks": 0,
+            "skipped_budget": 0,
+            "queue_depth": 0,
+            "max_queue_depth": 0,
+            "ocr_sec": 0.0,
+            "cache_hits_memory": 0,
+            "cache_hits_disk": 0,
+            "skipped_small": 0,
+            "skipped_uniform": 0,
+            "scaled": 0,
+        }
+
+    def __enter__(self):
+        _PROGRESS_STATE["ocr"] = self
+        return self
+
+    def __exit__(self, *exc):
+        self.flush()
+        self._pool.shutdown(wait=True, cancel_futures=True)
+        for api in self._apis:
+            api.End()
+        self.cache.evict()
+        return False
+
+    def _remaining(self) -> float:
+        if not self.budget_sec:
+            return 0.0
+        return self.budget_sec - (time.monotonic() - self._started)
+
+    def _over_budget(self) -> bool:
+        return bool(self.budget_sec) and self._remaining() <= 0
+
+    def _timeout(self) -> float:
+        return max(1.0, self._remaining()) if self.budget_sec else 0
+
+    def _count(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            self.stats[name] += n
+
+    def _skip_for_budget(self, n: int) -> None:
+        with self._lock:
+            self.stats["skipped_budget"] += n
+            if not self._warned:
+                self._warned = True
+                log.warning("OCR budget of %.0fs spent; skipping remaining images", self.budget_sec)
+
+    def _ocr_one(self, img, description: str):
+        """Text of one prepared image, or None on failure (not cached; the next upload retries it)."""
+        try:
+            if self.engine == "tesserocr":
+                api = getattr(self._local, "api", None)
+                if api is None:
+                    api = self._local.api = tesserocr.PyTessBaseAPI(lang=OCR_LANG)
+                    with self._lock:
+                        self._apis.append(api)
+                if self._over_budget():
+                    self._skip_for_budget(1)
+                    return None
+                api.SetImage(img)
+                # Recognize() honours a timeout in ms; GetUTF8Text() on its own has none
+                if self.budget_sec and (self._over_budget() or not api.Recognize(int(self._timeout() * 1000))):
+                    self._skip_for_budget(1)
+                    return None
+                return api.GetUTF8Text().strip()
+            remaining = self._remaining()
+            t0 = time.monotonic()
+            text = _tesseract(img, timeout=self._timeout())
+            if self.budget_sec and time.monotonic() - t0 >= remaining:
+                self._skip_for_budget(1)  # ran past the budget; a real run is cut off by the timeout
+            return text
+        except Exception as exc:  # pylint: disable=broad-except
+            if self._over_budget():
+                self._skip_for_budget(1)
+            else:
+                log.warning("OCR failure on %s: %s", description, exc)
+            return None
+
+    def _ocr_many(self, images: list, descriptions: list) -> list:
+        if self.engine == "tesseract-batch" and len(images) > 1:
+            try:
+                texts = _tesseract_batch(images, timeout=self._timeout())
+                self._count("batches")
+                return texts
+            except subprocess.TimeoutExpired:
+                self._skip_for_budget(len(images))
+                return [None] * len(images)
+            except Exception as exc:  # pylint: disable=broad-except
+                log.warning("Batched OCR of %d images failed (%s); running them one by one", len(images), exc)
+                self._count("batch_fallbacks")
+        texts = []
+        for img, description in zip(images, descriptions):
+            if self._over_budget():
+                self._skip_for_budget(1)
+                texts.append(None)
+            else:
+                texts.append(self._ocr_one(img, description))
+        return texts
+
+    def _run_batch(self, batch: list) -> None:
+        try:
+            if self._over_budget():
+                self._skip_for_budget(len(batch))
+                return
+            t0 = time.monotonic()
+            prepared = []
+            for key, image_bytes, description, future in batch:
+                try:
+                    img, outcome = triage_image(image_bytes)
+                except Exception as exc:  # pylint: disable=broad-except
+                    log.warning("OCR failure on %s: %s", description, exc)
+                    continue
+                if outcome != "ok":
+                    self._count(outcome)
+                # Skipped images are not cached, so new thresholds take effect
+                if img is not None:
+                    prepared.append((key, future, img, description))
+            if prepared:
+                texts = self._ocr_many([p[2] for p in prepared], [p[3] for p in prepared])
+                for (key, future, _img, _description), text in zip(prepared, texts):
+                    if text is not None:
+                        self.cache.put(key, text)
+                        future.set_result(text)
+            self._count("ocr_sec", time.monotonic() - t0)
+        finally:
+            for _key, _bytes, _description, future in batch:
+                if not future.done():
+                    future.set_result("")
+                self._slots.release()
+            with self._lock:
+                self.stats["completed"] += len(batch)
+                self.stats["queue_depth"] -= len(batch)
+
+    def flush(self) -> None:
+        """Sends the images collected so far, even if the batch is not full."""
+        with self._lock:
+            batch, self._batch = self._batch, []
+        if batch:
+            self._pool.submit(self._run_batch, batch)
+
+    def submit(self, image_bytes: bytes, description: str = "") -> OcrJob:
+        if not OCR_ENABLED:
+            return OcrJob()
+        key = self.cache.key(image_bytes)
+        future = self._seen.get(key)
+        if future is not None:
+            self._count("cache_hits_memory")
+            return OcrJob(future, executor=self)
+        text, tier = self.cache.get(key)
+        if text is not None:
+            self._count(f"cache_hits_{tier}")
+            return OcrJob(text=text)
+        if not self._slots.acquire(blocking=False):
+            self.flush()  # what is waiting may be our own unsent batch
+            self._slots.acquire()
+        future = Future()
+        self._seen[key] = future
+        with self._lock:
+            self.stats["submitted"] += 1
+            self.stats["queue_depth"] += 1
+            self.stats["max_queue_depth"] = max(self.stats["max_queue_depth"], self.stats["queue_depth"])
+            self._batch.append((key, image_bytes, description, future))
+            full = len(self._batch) >= self.batch_size
+        if full:
+            self.flush()
+        return OcrJob(future, executor=self)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            out = dict(self.stats)
+        out["ocr_sec"] = round(out["ocr_sec"], 2)
+        out["wall_sec"] = round(time.monotonic() - self._started, 2)
+        return out
+
+
+def _resolve_parts(parts: list) -> list:
+    """Strings pass through; (job, prefix, suffix) becomes prefix + text + suffix, or nothing if no text."""
+    out = []
+    for part in parts:
+        if isinstance(part, str):
+            out.append(part)
+            continue
+        job, prefix, suffix = part
+        text = job.text()
+        if text:
+            out.append(prefix + text + suffix)
+    return out
+
+
+def _emit_ready(pending: deque, emit, wait: bool = False) -> None:
+    """Hands (index, parts) units whose OCR jobs have finished to emit(), in order."""
+    while pending:
+        index, parts = pending[0]
+        if not wait and not all(p[0].done() for p in parts if not isinstance(p, str)):
+            return
+        pending.popleft()
+        emit(index, _resolve_parts(parts))
+
+
+# ==========================================================
+# Structure sidecar
+# ==========================================================
+_STRUCTURE_MARK = re.compile(r"^--- (?:(Page|Slide) (\d+)|(Sheet): (.*?)) ---$", re.M)
+
+
+def structure_index(text: str) -> dict:
+    """
+    Byte offsets (into the UTF-8 output) of the page/slide/sheet markers the
+    parsers emit, as {"v", "unit", "bytes", "marks": [[offset, label], ...]}.
+    Only markers of the first unit found are kept; no markers → no marks.
+    """
+    marks = []
+    unit = None
+    pos = 0
+    offset = 0
+    for m in _STRUCTURE_MARK.finditer(text):
+        kind = (m.group(1) or m.group(3)).lower()
+        if unit is None:
+            unit = kind
+        if kind != unit:
+            continue
+        offset += len(text[pos:m.start()].encode("utf-8"))
+        pos = m.start()
+        marks.append([offset, m.group(2) or m.group(4)])
+    return {"v": 1, "unit": unit, "bytes": len(text.encode("utf-8")), "marks": marks}
+
+
+def write_structure(text: str, path: str = None) -> None:
+    path = path or STRUCTURE_FILE
+    if not path:
+        return
+    tmp_path = path + ".tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as handle:
+            json.dump(structure_index(text), handle, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp_path, path)
+    except OSError as exc:
+        log.warning("could not write structure index %s: %s", path, exc)
+
+
 # ==========================================================
 # Dispatch entry
 # ==========================================================
@@ -151,32 +735,101 @@ def parse_doc(file_path: str, filename: str) -> str:
 # ==========================================================
 # PDF (text + images via PyMuPDF)
 # ==========================================================
+def _pdf_page_parts(doc, page, page_idx: int) -> tuple:
+    """Text of one page plus the (img_idx, bytes) of the images to OCR."""
+    page_text = page.get_text()
+    text_len = len(page_text.strip())
+    skip_image_ocr = text_len >= PDF_SKIP_IMAGE_OCR_TEXT_LEN
+
+    images = []
+    for img_idx, img in enumerate(page.get_images(full=True), start=1):
+        if skip_image_ocr:
+            continue
+        xref = img[0]
+        base = doc.extract_image(xref)
+        images.append((img_idx, base["image"]))
+    return [f"--- Page {page_idx} ---\n", page_text], images
+
+
+def _parse_pdf_range(file_path: str, start: int, stop: int) -> list:
+    """
+    Worker side of the parallel PDF mode: opens its own handle (PyMuPDF
+    documents must not be shared between processes) and returns the text and
+    images of pages start..stop-1 (0-based). OCR stays in the parent's executor.
+    """
+    doc = fitz.open(file_path)
+    try:
+        return [_pdf_page_parts(doc, doc[i], i + 1) for i in range(start, stop)]
+    finally:
+        doc.close()
+
+
+def _iter_pdf_pages_parallel(file_path: str, total_pages: int, workers: int):
+    """
+    Yields each page's text and images in page order while later ranges are
+    still being parsed. At most 2 x `workers` ranges are in flight; the next
+    one is submitted as the oldest is consumed, so the parent never holds
+    more than that many ranges' images while OCR catches up.
+    """
+    ranges = deque((start, min(start + PDF_PAGES_PER_TASK, total_pages))
+                   for start in range(0, total_pages, PDF_PAGES_PER_TASK))
+    workers = min(workers, len(ranges))
+    in_flight = deque()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        try:
+            while ranges or in_flight:
+                while ranges and len(in_flight) < 2 * workers:
+                    in_flight.append(pool.submit(_parse_pdf_range, file_path, *ranges.popleft()))
+                pages = in_flight.popleft().result()
+                yield from pages
+        finally:
+            for future in in_flight:
+                future.cancel()
+
+
 def parse_pdf(file_path: str) -> str:
     doc = fitz.open(file_path)
     out = []
     total_pages = getattr(doc, "page_count", len(doc)) or len(doc)
     if total_pages <= 0:
         total_pages = len(doc) or 1
+    workers = min(PDF_WORKERS, -(-total_pages // PDF_PAGES_PER_TASK))
     report_stage_message("parsing", f"Parsing PDF ({total_pages} page(s))")
 
-    for page_idx, page in enumerate(doc, start=1):
-        page_text = page.get_text()
-        text_len = len(page_text.strip())
-        skip_image_ocr = text_len >= PDF_SKIP_IMAGE_OCR_TEXT_LEN
-
-        out.append(f"--- Page {page_idx} ---\n")
-        out.append(page_text)
-
-        for img_idx, img in enumerate(page.get_images(full=True), start=1):
-            if skip_image_ocr:
-                continue
-            xref = img[0]
-            base = doc.extract_image(xref)
-            img_bytes = base["image"]
-            ocr_txt = ocr_image_bytes(img_bytes, f"PDF page {page_idx} image {img_idx}")
-            if ocr_txt:
-                out.append(f"\n[OCR – Page {page_idx} Image {img_idx}]\n{ocr_txt}\n")
-        report_progress("parsing", page_idx, total_pages, f"PDF page {page_idx}/{total_pages}")
+    if workers > 1:
+        doc.close()
+        pages = _iter_pdf_pages_parallel(file_path, total_pages, workers)
+        log.info("Parsing %d PDF pages with %d worker processes", total_pages, workers)
+    else:
+        pages = (_pdf_page_parts(doc, page, page_idx) for page_idx, page in enumerate(doc, start=1))
+
+    def emit(idx, parts):
+        out.extend(parts)
+        report_progress("parsing", idx, total_pages, f"PDF page {idx}/{total_pages}")
+
+    def queue_page(idx, parts, images):
+        for img_idx, img_bytes in images:
+            job = ocr.submit(img_bytes, f"PDF page {idx} image {img_idx}")
+            parts.append((job, f"\n[OCR – Page {idx} Image {img_idx}]\n", "\n"))
+        pending.append((idx, parts))
+        _emit_ready(pending, emit)
+
+    pending = deque()
+    page_idx = 0
+    with OcrExecutor() as ocr:
+        try:
+            for page_idx, (parts, images) in enumerate(pages, start=1):
+                queue_page(page_idx, parts, images)
+        except BrokenProcessPool as exc:
+            # A worker died (OOM, crash in MuPDF): finish the remaining pages here
+            log.warning("PDF worker pool failed after page %d (%s); continuing serially", page_idx, exc)
+            doc = fitz.open(file_path)
+            try:
+                for i in range(page_idx, total_pages):
+                    queue_page(i + 1, *_pdf_page_parts(doc, doc[i], i + 1))
+            finally:
+                doc.close()
+        _emit_ready(pending, emit, wait=True)
 
     joined = "\n".join(out).strip()
     report_completion("parsing", "Finished PDF conversion")
@@ -193,6 +846,7 @@ def parse_docx(file_path: str) -> str:
     # 1. Paragraphs & tables --------------------------------
     items = list(document.iter_inner_content())
     total = len(items) or 1
+    image_rels = [rel for rel in document.part._rels.values() if "image" in rel.reltype]
     report_stage_message("parsing", f"Parsing DOCX ({total} blocks)")
     for idx, item in enumerate(items, start=1):
         if isinstance(item, Paragraph):
@@ -203,15 +857,21 @@ def parse_docx(file_path: str) -> str:
                 out.append(cells)
         # newline after every element
         out.append("")
-        report_progress("parsing", idx, total, f"DOCX block {idx}/{total}")
+        report_progress("parsing", idx, total + len(image_rels), f"DOCX block {idx}/{total}")
 
     # 2. Inline / header images ------------------------------
-    for rel in document.part._rels.values():
-        if "image" in rel.reltype:
-            img_bytes = rel.target_part.blob
-            ocr_txt = ocr_image_bytes(img_bytes, "DOCX image")
-            if ocr_txt:
-                out.append("[OCR – Image]\n" + ocr_txt + "\n")
+    pending = deque()
+
+    def emit(idx, parts):
+        out.extend(parts)
+        report_progress("parsing", total + idx, total + len(image_rels), f"DOCX image {idx}/{len(image_rels)}")
+
+    with OcrExecutor() as ocr:
+        for idx, rel in enumerate(image_rels, start=1):
+            job = ocr.submit(rel.target_part.blob, "DOCX image")
+            pending.append((idx, [(job, "[OCR – Image]\n", "\n")]))
+            _emit_ready(pending, emit)
+        _emit_ready(pending, emit, wait=True)
 
     report_completion("parsing", "Finished DOCX conversion")
     return "\n".join(out).strip()
@@ -245,20 +905,26 @@ def parse_pptx(file_path: str) -> str:
         total_slides = 1
     report_stage_message("parsing", f"Parsing PPTX ({total_slides} slide(s))")
 
-    for slide_idx, slide in enumerate(prs.slides, start=1):
-        slide_chunks = [f"--- Slide {slide_idx} ---"]
-        for shp in _iter_shapes_recursive(slide.shapes):
-            # regular text / table
-            _collect_shape_text(shp, slide_chunks)
-
-            # images
-            if shp.shape_type == MSO_SHAPE_TYPE.PICTURE:
-                ocr_txt = ocr_image_bytes(shp.image.blob, f"PPTX slide {slide_idx} image")
-                if ocr_txt:
-                    slide_chunks.append(f"[OCR – Slide {slide_idx} Image]\n{ocr_txt}")
-
-        out.append("\n".join(slide_chunks))
-        report_progress("parsing", slide_idx, total_slides, f"PPTX slide {slide_idx}/{total_slides}")
+    def emit(idx, chunks):
+        out.append("\n".join(chunks))
+        report_progress("parsing", idx, total_slides, f"PPTX slide {idx}/{total_slides}")
+
+    pending = deque()
+    with OcrExecutor() as ocr:
+        for slide_idx, slide in enumerate(prs.slides, start=1):
+            slide_chunks = [f"--- Slide {slide_idx} ---"]
+            for shp in _iter_shapes_recursive(slide.shapes):
+                # regular text / table
+                _collect_shape_text(shp, slide_chunks)
+
+                # images
+                if shp.shape_type == MSO_SHAPE_TYPE.PICTURE:
+                    job = ocr.submit(shp.image.blob, f"PPTX slide {slide_idx} image")
+                    slide_chunks.append((job, f"[OCR – Slide {slide_idx} Image]\n", ""))
+
+            pending.append((slide_idx, slide_chunks))
+            _emit_ready(pending, emit)
+        _emit_ready(pending, emit, wait=True)
     report_completion("parsing", "Finished PPTX conversion")
     return "\n\n".join(out).strip()
 
@@ -327,7 +993,12 @@ if __name__ == "__main__":
         sys.exit(1)
 
     try:
-        print(parse_doc(sys.argv[1], sys.argv[2]))
+        text = parse_doc(sys.argv[1], sys.argv[2])
+        ext = sys.argv[2].lower().rsplit(".", 1)[-1]
+        sys.stdout.buffer.write(text.encode("utf-8") + b"\n")
+        sys.stdout.flush()
+        if ext in {"pdf", "pptx", "csv", "xls", "xlsx"}:
+            write_structure(text)
     except Exception as exc:  # pylint: disable=broad-except
         report_failure("parsing", str(exc))
         raise
@@ -2,6 +2,7 @@
 declare(strict_types=1);
 
 require_once __DIR__ . '/bootstrap.php';
+require_once __DIR__ . '/inc/document_structure.php';
 
 header('Content-Type: application/json');
 
@@ -131,6 +132,13 @@ try {
         $excerpt = 'Preview is not available for this retrieved chunk.';
     }
 
+    // Whole page/slide/sheet the chunk came from, when the parser recorded the structure
+    $pageUnit = $match['page_unit'] ?? null;
+    $pageLabel = $pageUnit === 'sheet' ? ($match['section'] ?? null) : ($match['page'] ?? null);
+    $pageSection = ($pageUnit !== null && $pageLabel !== null && $pageLabel !== '')
+        ? document_structure_section($pdo, $docId, (string)$pageLabel)
+        : null;
+
     $payload = [
         'name'                => (string)($match['filename'] ?? 'Document excerpt'),
         'source'              => 'RAG',
@@ -143,6 +151,8 @@ try {
         'excerpt'             => $excerpt,
         'section'             => $match['section'] ?? null,
         'page'                => $match['page'] ?? null,
+        'page_unit'           => $pageUnit,
+        'page_text'           => $pageSection['text'] ?? null,
         'chunk_index'         => $match['chunk_index'] ?? null,
     ];
 
@@ -128,6 +128,7 @@ foreach ($jobs as $jobFile) {
 
         $payload['file_path']         = $parseOutcome['file_path'];
         $payload['parsed_size_bytes'] = $parseOutcome['parsed_size_bytes'];
+        $payload['structure_path']    = $parseOutcome['structure_path'] ?? null;
         $payload['cleanup_tmp']       = true;
 
         if (!rewriteJobPayload($jobFile, $payload)) {
@@ -187,6 +188,9 @@ foreach ($jobs as $jobFile) {
         if (!empty($payload['cleanup_tmp']) && !empty($payload['file_path'])) {
             @unlink($payload['file_path']);
         }
+        if (!empty($payload['cleanup_tmp']) && !empty($payload['structure_path'])) {
+            @unlink($payload['structure_path']);
+        }
     } else {
         echo sprintf("[%s] document_id=%s failed (rc=%d)\n", date('c'), $documentId, $exitCode);
         rag_processing_status_write($documentId, $ragPaths, [
@@ -269,6 +273,8 @@ function parseAndPersistDocument(
     ]);
 
     $txtPath = $paths['parsed'] . '/rag_' . uniqid('', true) . '.txt';
+    // Page/slide/sheet byte offsets written by the parser next to the text
+    $structurePath = $txtPath . '.structure.json';
     $parseHandle = fopen($txtPath, 'w');
     if ($parseHandle === false) {
         return [
@@ -285,8 +291,11 @@ function parseAndPersistDocument(
     ];
 
     $env = array_merge($_ENV ?? [], [
-        'PARSER_STATUS_FILE' => rag_processing_status_path($documentId, $paths),
-        'PARSER_JOB_ID'      => (string)$documentId,
+        'PARSER_STATUS_FILE'    => rag_processing_status_path($documentId, $paths),
+        'PARSER_JOB_ID'         => (string)$documentId,
+        'PARSER_STRUCTURE_FILE' => $structurePath,
+        // OCR text of images seen in earlier uploads (logos, recurring forms)
+        'OCR_CACHE_PATH'        => getenv('OCR_CACHE_PATH') ?: $paths['root'] . '/cache/ocr_cache.sqlite',
     ]);
 
     $cmd = sprintf(
@@ -332,6 +341,7 @@ function parseAndPersistDocument(
     $rc = proc_close($process);
     if ($rc !== 0) {
         @unlink($txtPath);
+        @unlink($structurePath);
         $message = sprintf('Parser exited with rc=%d %s', $rc, trim(substr($stderr, 0, 400)));
         error_log($message);
         if (!empty($payload['cleanup_tmp']) && is_file($sourcePath)) {
@@ -347,6 +357,7 @@ function parseAndPersistDocument(
     $parsedSize = @filesize($txtPath);
     if ($parsedSize === false || $parsedSize === 0) {
         @unlink($txtPath);
+        @unlink($structurePath);
         if (!empty($payload['cleanup_tmp']) && is_file($sourcePath)) {
             @unlink($sourcePath);
         }
@@ -365,9 +376,7 @@ function parseAndPersistDocument(
         $parsedText = '';
     }
 
-    $tokenLength = ($parsedText !== '')
-        ? get_token_count($parsedText, 'cl100k_base')
-        : token_count_from_file($txtPath);
+    $tokenLength = token_count_from_file($txtPath);
 
     $ragInlineThreshold = isset($config['rag']['inline_fulltext_tokens'])
         ? (int)$config['rag']['inline_fulltext_tokens']
@@ -398,6 +407,7 @@ function parseAndPersistDocument(
     } catch (Throwable $e) {
         error_log('Failed to persist parsed document: ' . $e->getMessage());
         @unlink($txtPath);
+        @unlink($structurePath);
         if (!empty($payload['cleanup_tmp']) && is_file($sourcePath)) {
             @unlink($sourcePath);
         }
@@ -408,6 +418,20 @@ function parseAndPersistDocument(
         ];
     }
 
+    $structureJson = is_file($structurePath) ? @file_get_contents($structurePath) : false;
+    if ($structureJson !== false && $structureJson !== '') {
+        try {
+            $stmt = $pdo->prepare('UPDATE document SET structure_index = :structure WHERE id = :id LIMIT 1');
+            $stmt->execute([
+                ':structure' => $structureJson,
+                ':id'        => $documentId,
+            ]);
+        } catch (Throwable $e) {
+            // Older schemas lack the column; page lookups then fall back to the full text
+            error_log('Failed to store document structure index: ' . $e->getMessage());
+        }
+    }
+
     if (!empty($payload['source_path']) && is_file($payload['source_path'])) {
         try {
             $fileSha = hash_file('sha256', $payload['source_path']);
@@ -430,6 +454,7 @@ function parseAndPersistDocument(
 
     if (!$shouldIndex) {
         @unlink($txtPath);
+        @unlink($structurePath);
     }
 
     if (empty($payload['embedding_model'])) {
@@ -440,6 +465,7 @@ function parseAndPersistDocument(
         'ok'                 => true,
         'payload'            => $payload,
         'file_path'          => $shouldIndex ? $txtPath : null,
+        'structure_path'     => ($shouldIndex && is_file($structurePath)) ? $structurePath : null,
         'parsed_size_bytes'  => $parsedSize ?: null,
         'should_index'       => $shouldIndex,
         'progress'           => $shouldIndex ? 60 : 100,
@@ -448,11 +474,33 @@ function parseAndPersistDocument(
 
 function token_count_from_file(string $path, int $chunkSize = 100000): int
 {
+    // Counted with the default chat deployment's encoding, since the totals feed its context budget.
+    $encoding = token_counter_encoding($GLOBALS['config']['azure']['default'] ?? null);
+
+    // Exact count in one streaming pass; the slice loop below is only a fallback.
+    $exact = token_counter_count_file($path, $encoding, rag_python_binary($GLOBALS['config'] ?? null));
+    if ($exact !== null) {
+        return $exact;
+    }
+
     $fh = @fopen($path, 'r');
     if ($fh === false) {
         return 0;
     }
     $total = 0;
+    $pending = [];
+    $flush = static function (array $slices) use ($encoding): int {
+        // One service round trip per batch of slices; per-slice spawns only as a fallback.
+        $counts = token_counter_service_counts($slices, $encoding);
+        if ($counts !== null) {
+            return array_sum($counts);
+        }
+        $sum = 0;
+        foreach ($slices as $slice) {
+            $sum += get_token_count($slice, $encoding);
+        }
+        return $sum;
+    };
     while (!feof($fh)) {
         $chunk = fread($fh, $chunkSize);
         if ($chunk === false) {
@@ -461,9 +509,16 @@ function token_count_from_file(string $path, int $chunkSize = 100000): int
         if ($chunk === '') {
             continue;
         }
-        $total += get_token_count($chunk, 'cl100k_base');
+        $pending[] = $chunk;
+        if (count($pending) >= 32) {
+            $total += $flush($pending);
+            $pending = [];
+        }
     }
     fclose($fh);
+    if ($pending) {
+        $total += $flush($pending);
+    }
     return $total;
 }
 
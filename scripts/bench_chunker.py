@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# bench_chunker.py
+#
+# Chunking throughput and peak memory for build_index.py, old vs new:
+#   "windowed"  - the previous stream_text_chunks(): 200K-character windows of
+#                 space-joined lines, each encoded and sliced by chunk_text(),
+#                 plus the separate sha256_file() read
+#   "streaming" - text_chunker.iter_file_chunks() with the hash taken in the same pass
+#
+#   python3 scripts/bench_chunker.py [--size-mb 100] [--file parsed.txt] [--encoding cl100k_base]
+#                                    [--max-tokens 8000] [--overlap 50]
+#
+# Without --file a synthetic text file of --size-mb is generated in the temp
+# directory. Each mode runs in a fresh interpreter so peak RSS is its own.
+# Prints one JSON object with tokens/sec, chunk counts and peak RSS in MB.
+
+import os, sys, json, random, tempfile, subprocess
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_CHILD = r"""
+import os, sys, json, time, hashlib, resource
+mode, path, name, max_tokens, overlap, inc_dir = sys.argv[1:7]
+max_tokens, overlap = int(max_tokens), int(overlap)
+sys.path.insert(0, inc_dir)
+from encoding_registry import get_encoding
+from text_chunker import TokenChunker, iter_text_chunks
+enc = get_encoding(name)
+enc.encode("warm up")
+rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+t0 = time.perf_counter()
+chunks = tokens = 0
+if mode == "windowed":
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for b in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(b)
+
+    def chunk_text(text):
+        global tokens
+        toks = enc.encode(text)
+        tokens += len(toks)
+        out, start = [], 0
+        while start < len(toks):
+            end = min(start + max_tokens, len(toks))
+            out.append(enc.decode(toks[start:end]))
+            if end == len(toks):
+                break
+            start = max(0, end - overlap)
+        return out
+
+    buf, chars = [], 0
+    with open(path, "r", encoding="utf-8", errors="ignore") as f:
+        for line in f:
+            buf.append(line.rstrip("\n"))
+            chars += len(buf[-1]) + 1
+            if chars >= 200_000:
+                chunks += len(chunk_text(" ".join(buf).strip()))
+                buf, chars = [], 0
+    if buf:
+        chunks += len(chunk_text(" ".join(buf).strip()))
+else:
+    h = hashlib.sha256()
+    chunker = TokenChunker(enc, max_tokens, overlap)
+    with open(path, "rb") as f:
+        for _ in iter_text_chunks(f, enc, max_tokens, overlap, hasher=h, chunker=chunker):
+            chunks += 1
+    tokens = chunker.tokens_seen
+elapsed = time.perf_counter() - t0
+peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss  # KiB on Linux
+print(json.dumps({"sec": elapsed, "tokens": tokens, "chunks": chunks, "sha256": h.hexdigest(),
+                  "peak_rss_kb": peak, "rss_after_encoder_kb": rss_before}))
+"""
+
+_WORDS = ("the of and to in a is that for it as was with be by on not he this are or his from at which "
+          "but have an they you were her she there been one all we their has would when if so no what up "
+          "patient cohort randomized trial cardiovascular pulmonary hemodynamic protocol outcome baseline "
+          "analysis confidence interval hazard ratio enrollment adverse event placebo dose response").split()
+
+
+def make_corpus(path: str, size_mb: int, seed: int = 7):
+    rnd = random.Random(seed)
+    target = size_mb * 1024 * 1024
+    written = 0
+    with open(path, "w", encoding="utf-8") as f:
+        page = 1
+        while written < target:
+            lines = [f"--- Page {page} ---"]
+            for _ in range(40):
+                lines.append(" ".join(rnd.choice(_WORDS) for _ in range(rnd.randint(6, 18))).capitalize() + ".")
+            block = "\n".join(lines) + "\n\n"
+            f.write(block)
+            written += len(block)
+            page += 1
+
+
+def run_mode(mode: str, path: str, encoding: str, max_tokens: int, overlap: int) -> dict:
+    out = subprocess.run(
+        [sys.executable, "-c", _CHILD, mode, path, encoding, str(max_tokens), str(overlap),
+         os.path.join(APP_DIR, "inc")],
+        capture_output=True, text=True, check=True,
+    ).stdout
+    r = json.loads(out)
+    return {
+        "tokens": r["tokens"],
+        "chunks": r["chunks"],
+        "sec": round(r["sec"], 2),
+        "tokens_per_sec": int(r["tokens"] / r["sec"]) if r["sec"] else None,
+        "peak_rss_mb": round(r["peak_rss_kb"] / 1024, 1),
+        "rss_over_encoder_mb": round((r["peak_rss_kb"] - r["rss_after_encoder_kb"]) / 1024, 1),
+        "sha256": r["sha256"],
+    }
+
+
+def main():
+    args = sys.argv[1:]
+    opts = {"--size-mb": "100", "--file": None, "--encoding": "cl100k_base",
+            "--max-tokens": "8000", "--overlap": "50"}
+    while args:
+        key = args.pop(0)
+        if key not in opts or not args:
+            print("Usage: python3 scripts/bench_chunker.py [--size-mb N] [--file PATH] "
+                  "[--encoding NAME] [--max-tokens N] [--overlap N]")
+            sys.exit(1)
+        opts[key] = args.pop(0)
+
+    path = opts["--file"]
+    generated = False
+    if not path:
+        path = os.path.join(tempfile.gettempdir(), f"nhlbi_chunk_bench_{opts['--size-mb']}mb.txt")
+        if not os.path.exists(path):
+            make_corpus(path, int(opts["--size-mb"]))
+            generated = True
+
+    results = {mode: run_mode(mode, path, opts["--encoding"], int(opts["--max-tokens"]), int(opts["--overlap"]))
+               for mode in ("windowed", "streaming")}
+    print(json.dumps({
+        "file": path,
+        "generated": generated,
+        "bytes": os.path.getsize(path),
+        "encoding": opts["--encoding"],
+        "max_tokens": int(opts["--max-tokens"]),
+        "overlap": int(opts["--overlap"]),
+        "results": results,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
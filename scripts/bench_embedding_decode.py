@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# bench_embedding_decode.py
+#
+# Response-parse time and peak memory per embedding batch, old vs new:
+#   "json_floats" - encoding_format "float": r.json() turns every component into
+#                   a Python float, vectors are held as List[List[float]]
+#   "base64"      - encoding_format "base64": r.json() sees one string per vector,
+#                   build_index._vectors_in_order() decodes it into a float32 matrix
+#
+#   python3 scripts/bench_embedding_decode.py [--batch 64] [--dim 3072] [--rounds 20]
+#
+# The response bodies are synthesized with the same shapes the embeddings API
+# returns, so no endpoint is needed. Each mode runs in a fresh interpreter;
+# peak memory is tracemalloc's peak while parsing one batch (the body itself
+# excluded), time is the median over --rounds. Prints one JSON object.
+
+import os, sys, json, subprocess
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_CHILD = r"""
+import sys, json, time, base64, statistics, tracemalloc
+import numpy as np
+mode, batch, dim, rounds, inc_dir = sys.argv[1], int(sys.argv[2]), int(sys.argv[3]), int(sys.argv[4]), sys.argv[5]
+sys.path.insert(0, inc_dir)
+import build_index
+
+rng = np.random.default_rng(3)
+vecs = rng.standard_normal((batch, dim)).astype("<f4")
+vecs /= np.linalg.norm(vecs, axis=1, keepdims=True)
+if mode == "json_floats":
+    items = [{"object": "embedding", "index": i, "embedding": [float(x) for x in v]} for i, v in enumerate(vecs)]
+else:
+    items = [{"object": "embedding", "index": i, "embedding": base64.b64encode(v.tobytes()).decode("ascii")}
+             for i, v in enumerate(vecs)]
+body = json.dumps({"object": "list", "data": items, "model": "text-embedding-3-large",
+                   "usage": {"prompt_tokens": 0, "total_tokens": 0}}).encode("utf-8")
+del items
+
+
+def parse():
+    data = json.loads(body)
+    if mode == "json_floats":
+        out = [None] * batch
+        for item in data["data"]:
+            out[item["index"]] = item["embedding"]
+        return out
+    return build_index._vectors_in_order(data, batch)
+
+
+parse()  # warm up
+times = []
+for _ in range(rounds):
+    t0 = time.perf_counter()
+    result = parse()
+    times.append(time.perf_counter() - t0)
+    del result
+
+tracemalloc.start()
+base = tracemalloc.get_traced_memory()[0]
+result = parse()
+held, peak = tracemalloc.get_traced_memory()
+tracemalloc.stop()
+print(json.dumps({"body_bytes": len(body), "median_ms": statistics.median(times) * 1000,
+                  "peak_bytes": peak - base, "held_bytes": held - base}))
+"""
+
+
+def run_mode(mode: str, batch: int, dim: int, rounds: int) -> dict:
+    out = subprocess.run(
+        [sys.executable, "-c", _CHILD, mode, str(batch), str(dim), str(rounds), os.path.join(APP_DIR, "inc")],
+        capture_output=True, text=True, check=True,
+    ).stdout
+    r = json.loads(out.strip().splitlines()[-1])
+    return {
+        "response_kb": round(r["body_bytes"] / 1024, 1),
+        "parse_ms": round(r["median_ms"], 2),
+        "peak_mb": round(r["peak_bytes"] / 1048576, 2),
+        "held_mb": round(r["held_bytes"] / 1048576, 2),
+    }
+
+
+def main():
+    args = sys.argv[1:]
+    opts = {"--batch": "64", "--dim": "3072", "--rounds": "20"}
+    while args:
+        key = args.pop(0)
+        if key not in opts or not args:
+            print("Usage: python3 scripts/bench_embedding_decode.py [--batch N] [--dim N] [--rounds N]")
+            sys.exit(1)
+        opts[key] = args.pop(0)
+    batch, dim, rounds = int(opts["--batch"]), int(opts["--dim"]), int(opts["--rounds"])
+
+    results = {mode: run_mode(mode, batch, dim, rounds) for mode in ("json_floats", "base64")}
+    old, new = results["json_floats"], results["base64"]
+    print(json.dumps({
+        "batch": batch,
+        "dim": dim,
+        "results": results,
+        "parse_speedup": round(old["parse_ms"] / new["parse_ms"], 1) if new["parse_ms"] else None,
+        "peak_memory_ratio": round(old["peak_mb"] / new["peak_mb"], 1) if new["peak_mb"] else None,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# bench_ocr_batch.py
+#
+# OCR wall time for a fixture of small text images, one tesseract process per
+# image vs. batched runs (parser_multi._tesseract_batch), plus tesserocr when it
+# is installed:
+#   "per_image"  - OcrExecutor(batch_size=1): pytesseract, one process per image
+#   "batch"      - OcrExecutor(batch_size=--batch): one process per batch
+#   "tesserocr"  - OcrExecutor with the in-process API (skipped if not installed)
+#
+#   python3 scripts/bench_ocr_batch.py [--images 200] [--batch 16] [--workers 4] [--lang eng]
+#
+# The fixture is generated with Pillow: each image is one line of known text
+# (label plus a number), large enough to pass the OCR triage. Every mode gets a
+# fresh in-memory OcrCache, so nothing is served from cache. Needs Pillow and
+# the tesseract binary. Prints one JSON object with wall time, images/sec and
+# word recall against the known text, so a batch mode that maps output back
+# to the wrong image shows up as lost recall, not as a speedup.
+
+import os, sys, io, json, time
+
+from PIL import Image, ImageDraw, ImageFont
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+import parser_multi  # noqa: E402
+
+WORDS = ["protocol", "cohort", "baseline", "screening", "enrollment", "adverse", "placebo", "dosage",
+         "follow", "visit", "consent", "sample", "plasma", "cardiac", "pulmonary", "registry"]
+
+
+def fixture(count: int) -> list:
+    """(png_bytes, expected_text) pairs; every image differs so the cache never hits."""
+    try:
+        font = ImageFont.load_default(size=32)
+    except TypeError:  # Pillow < 10.1 only has the small bitmap font
+        font = ImageFont.load_default()
+    out = []
+    for i in range(count):
+        text = f"{WORDS[i % len(WORDS)]} {WORDS[(i * 7 + 3) % len(WORDS)]} {1000 + i}"
+        img = Image.new("L", (720, 96), 255)
+        ImageDraw.Draw(img).text((24, 28), text, fill=0, font=font)
+        buf = io.BytesIO()
+        img.save(buf, format="PNG")
+        out.append((buf.getvalue(), text))
+    return out
+
+
+def word_recall(found: list, expected: list) -> float:
+    hits = total = 0
+    for got, want in zip(found, expected):
+        words = set(got.lower().split())
+        for word in want.lower().split():
+            total += 1
+            hits += word in words
+    return round(hits / max(1, total), 4)
+
+
+def run_mode(images: list, workers: int, batch_size: int) -> dict:
+    t0 = time.perf_counter()
+    with parser_multi.OcrExecutor(workers=workers, budget_sec=0, cache=parser_multi.OcrCache(),
+                                  batch_size=batch_size) as pool:
+        jobs = [pool.submit(data, f"image {i}") for i, (data, _) in enumerate(images)]
+        texts = [job.text() for job in jobs]
+        stats = pool.snapshot()
+    wall = time.perf_counter() - t0
+    return {
+        "engine": stats["engine"],
+        "wall_sec": round(wall, 2),
+        "images_per_sec": round(len(images) / wall, 1) if wall else None,
+        "tesseract_batches": stats["batches"],
+        "batch_fallbacks": stats["batch_fallbacks"],
+        "word_recall": word_recall(texts, [text for _, text in images]),
+    }, texts
+
+
+def main():
+    args = sys.argv[1:]
+    opts = {"--images": "200", "--batch": "16", "--workers": "4", "--lang": "eng"}
+    while args:
+        key = args.pop(0)
+        if key not in opts or not args:
+            print("Usage: python3 scripts/bench_ocr_batch.py [--images N] [--batch N] [--workers N] [--lang L]")
+            sys.exit(1)
+        opts[key] = args.pop(0)
+    count, batch, workers = int(opts["--images"]), int(opts["--batch"]), int(opts["--workers"])
+    parser_multi.OCR_LANG = opts["--lang"]
+    parser_multi.OCR_ENABLED = True
+
+    images = fixture(count)
+    results, outputs = {}, {}
+    tesserocr = parser_multi.tesserocr
+    try:
+        parser_multi.tesserocr = None  # the subprocess modes first
+        results["per_image"], outputs["per_image"] = run_mode(images, workers, 1)
+        results["batch"], outputs["batch"] = run_mode(images, workers, batch)
+    finally:
+        parser_multi.tesserocr = tesserocr
+    if tesserocr is not None:
+        results["tesserocr"], outputs["tesserocr"] = run_mode(images, workers, 1)
+
+    same = sum(a == b for a, b in zip(outputs["per_image"], outputs["batch"]))
+    print(json.dumps({
+        "images": count,
+        "batch_size": batch,
+        "workers": workers,
+        "tesseract_version": parser_multi.tesseract_version(),
+        "results": results,
+        "batch_matches_per_image": round(same / max(1, count), 4),
+        "batch_speedup": round(results["per_image"]["wall_sec"] / results["batch"]["wall_sec"], 2)
+        if results["batch"]["wall_sec"] else None,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+# bench_qdrant_filters.py
+#
+# Filtered-search latency on a synthetic multi-tenant collection, before and
+# after build_index.ensure_payload_indexes() (user_id as the tenant key).
+#
+#   python3 scripts/bench_qdrant_filters.py [--url http://127.0.0.1:6333] [--api-key KEY]
+#       [--points 1000000] [--dim 64] [--tenants 5000] [--queries 300] [--keep]
+#
+# Points get the same payload shape the indexer writes (user_id, chat_id,
+# document_id, deleted, embedding_model, version); tenants are Zipf-sized so a
+# few users own most points, like the shared "nhlbi" collection. Queries use
+# rag_retrieve's filter (user_id + chat_id + deleted, half of them also
+# document_id). Needs a Qdrant server and numpy; the collection is dropped
+# at the end unless --keep. Prints one JSON object with latency percentiles.
+# The indexes are added after loading, i.e. the migration path an existing
+# collection takes on its next ensure_collection().
+
+import os, sys, json, time, uuid, statistics
+
+import numpy as np
+from qdrant_client import QdrantClient
+from qdrant_client.http import models
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(APP_DIR, "inc"))
+import build_index  # noqa: E402
+
+MODEL = "bench-embedding"
+
+
+def tenant_weights(tenants: int) -> np.ndarray:
+    w = 1.0 / np.arange(1, tenants + 1) ** 1.1
+    return w / w.sum()
+
+
+def synthetic_batches(points: int, dim: int, tenants: int, batch: int, seed: int = 11):
+    """Yields (ids, vectors, payloads); each tenant owns a few chats, each chat a few documents."""
+    rng = np.random.default_rng(seed)
+    weights = tenant_weights(tenants)
+    for start in range(0, points, batch):
+        n = min(batch, points - start)
+        users = rng.choice(tenants, size=n, p=weights)
+        chats = rng.integers(0, 8, size=n)
+        docs = rng.integers(0, 4, size=n)
+        deleted = rng.random(n) < 0.03
+        vecs = rng.standard_normal((n, dim), dtype=np.float32)
+        vecs /= np.linalg.norm(vecs, axis=1, keepdims=True)
+        payloads = [{
+            "user_id": f"user{u}",
+            "chat_id": f"chat{u}-{c}",
+            "document_id": int(u) * 100 + int(c) * 10 + int(d),
+            "deleted": bool(x),
+            "embedding_model": MODEL,
+            "version": 1,
+        } for u, c, d, x in zip(users, chats, docs, deleted)]
+        yield list(range(start, start + n)), vecs, payloads
+
+
+def wait_green(client: QdrantClient, collection: str, timeout: float = 3600.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        info = client.get_collection(collection)
+        if str(getattr(info, "status", "green")).lower().endswith("green"):
+            return
+        time.sleep(1.0)
+    raise RuntimeError(f"collection {collection} did not finish optimizing")
+
+
+def make_queries(count: int, dim: int, tenants: int, seed: int = 23):
+    rng = np.random.default_rng(seed)
+    users = rng.choice(tenants, size=count, p=tenant_weights(tenants))
+    out = []
+    for i, u in enumerate(users):
+        c = int(rng.integers(0, 8))
+        must = [
+            models.FieldCondition(key="user_id", match=models.MatchValue(value=f"user{u}")),
+            models.FieldCondition(key="chat_id", match=models.MatchValue(value=f"chat{u}-{c}")),
+            models.FieldCondition(key="deleted", match=models.MatchValue(value=False)),
+        ]
+        if i % 2:
+            doc = int(u) * 100 + c * 10 + int(rng.integers(0, 4))
+            must.append(models.FieldCondition(key="document_id", match=models.MatchValue(value=doc)))
+        vec = rng.standard_normal(dim).astype(np.float32)
+        out.append((vec / np.linalg.norm(vec), models.Filter(must=must)))
+    return out
+
+
+def run_queries(client: QdrantClient, collection: str, queries, top_k: int = 8) -> dict:
+    for vec, flt in queries[:10]:  # warm caches and connections
+        client.query_points(collection_name=collection, query=vec.tolist(), query_filter=flt, limit=top_k)
+    samples = []
+    for vec, flt in queries:
+        t0 = time.perf_counter()
+        client.query_points(collection_name=collection, query=vec.tolist(), query_filter=flt, limit=top_k,
+                            with_payload=False)
+        samples.append((time.perf_counter() - t0) * 1000.0)
+    samples.sort()
+    return {
+        "queries": len(samples),
+        "mean_ms": round(statistics.fmean(samples), 2),
+        "p50_ms": round(samples[len(samples) // 2], 2),
+        "p95_ms": round(samples[int(len(samples) * 0.95) - 1], 2),
+        "p99_ms": round(samples[max(0, int(len(samples) * 0.99) - 1)], 2),
+    }
+
+
+def main():
+    args = sys.argv[1:]
+    opts = {"--url": build_index.QDRANT_URL, "--api-key": "", "--points": "1000000", "--dim": "64",
+            "--tenants": "5000", "--queries": "300"}
+    keep = False
+    while args:
+        key = args.pop(0)
+        if key == "--keep":
+            keep = True
+            continue
+        if key not in opts or not args:
+            print("Usage: python3 scripts/bench_qdrant_filters.py [--url URL] [--api-key KEY] [--points N] "
+                  "[--dim N] [--tenants N] [--queries N] [--keep]")
+            sys.exit(1)
+        opts[key] = args.pop(0)
+    points, dim = int(opts["--points"]), int(opts["--dim"])
+    tenants, nq = int(opts["--tenants"]), int(opts["--queries"])
+
+    if opts["--url"] == ":memory:":  # embedded mode: smoke-tests the script, ignores payload indexes
+        client = QdrantClient(location=":memory:")
+    else:
+        client = QdrantClient(url=opts["--url"], api_key=opts["--api-key"] or None, timeout=600.0)
+    collection = f"bench_filters_{uuid.uuid4().hex[:8]}"
+    client.create_collection(collection_name=collection,
+                             vectors_config=models.VectorParams(size=dim, distance=models.Distance.COSINE))
+    try:
+        t0 = time.time()
+        for ids, vecs, payloads in synthetic_batches(points, dim, tenants, batch=2048):
+            client.upsert(collection_name=collection, wait=False,
+                          points=models.Batch(ids=ids, vectors=vecs.tolist(), payloads=payloads))
+        wait_green(client, collection)
+        load_sec = time.time() - t0
+
+        queries = make_queries(nq, dim, tenants)
+        before = run_queries(client, collection, queries)
+
+        t0 = time.time()
+        created = build_index.ensure_payload_indexes(client, collection, {})
+        wait_green(client, collection)
+        index_sec = time.time() - t0
+        after = run_queries(client, collection, queries)
+
+        print(json.dumps({
+            "collection": collection,
+            "points": points,
+            "dim": dim,
+            "tenants": tenants,
+            "load_sec": round(load_sec, 1),
+            "payload_indexes": created,
+            "index_build_sec": round(index_sec, 1),
+            "without_indexes": before,
+            "with_indexes": after,
+            "p50_speedup": round(before["p50_ms"] / after["p50_ms"], 2) if after["p50_ms"] else None,
+        }, indent=2))
+    finally:
+        if not keep:
+            client.delete_collection(collection)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# bench_quantization.py
+#
+# Recall and latency of the [qdrant] quantization profiles (none, int8, binary)
+# against exact search, each on its own copy of the same synthetic collection.
+#
+#   python3 scripts/bench_quantization.py [--url :memory:|http://127.0.0.1:6333] [--api-key KEY]
+#       [--points 50000] [--dim 256] [--queries 200] [--top-k 8] [--hnsw-ef 0]
+#       [--oversampling 0] [--profiles none,int8,binary] [--on-disk] [--keep]
+#
+# Collections are created through build_index.ensure_collection() with the
+# profile under test, and queried with rag_retrieve.search_params(), i.e. the
+# same settings production uses. Vectors are clustered (a few hundred centroids
+# plus noise) so the neighbourhoods resemble real embeddings more than pure
+# noise does. Recall@k compares each profile's top-k with an exact (brute
+# force) search on the original vectors. The default --url :memory: is the
+# local embedded stand-in from qdrant-client: it ignores quantization and HNSW,
+# so it only checks the script end to end; point --url at a server for numbers.
+# Prints one JSON object.
+
+import os, sys, json, time, uuid, statistics
+
+import numpy as np
+from qdrant_client import QdrantClient
+from qdrant_client.http import models
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(APP_DIR, "inc"))
+import build_index  # noqa: E402
+import rag_retrieve  # noqa: E402
+
+
+def clustered_vectors(points: int, dim: int, seed: int = 5) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centroids = rng.standard_normal((max(8, points // 200), dim), dtype=np.float32)
+    vecs = centroids[rng.integers(0, len(centroids), size=points)]
+    vecs += 0.35 * rng.standard_normal((points, dim), dtype=np.float32)
+    vecs /= np.linalg.norm(vecs, axis=1, keepdims=True)
+    return vecs
+
+
+def wait_green(client: QdrantClient, collection: str, timeout: float = 3600.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        info = client.get_collection(collection)
+        if str(getattr(info, "status", "green")).lower().endswith("green"):
+            return
+        time.sleep(1.0)
+    raise RuntimeError(f"collection {collection} did not finish optimizing")
+
+
+def load(client: QdrantClient, collection: str, vecs: np.ndarray, batch: int = 2048):
+    for start in range(0, len(vecs), batch):
+        part = vecs[start:start + batch]
+        client.upsert(collection_name=collection, wait=False,
+                      points=models.Batch(ids=list(range(start, start + len(part))), vectors=part.tolist()))
+    wait_green(client, collection)
+
+
+def search(client: QdrantClient, collection: str, queries: np.ndarray, top_k: int, params) -> tuple:
+    for q in queries[:10]:  # warm caches and connections
+        client.query_points(collection_name=collection, query=q.tolist(), limit=top_k, search_params=params)
+    ids, samples = [], []
+    for q in queries:
+        t0 = time.perf_counter()
+        res = client.query_points(collection_name=collection, query=q.tolist(), limit=top_k,
+                                  search_params=params, with_payload=False)
+        samples.append((time.perf_counter() - t0) * 1000.0)
+        ids.append([p.id for p in res.points])
+    samples.sort()
+    return ids, {
+        "mean_ms": round(statistics.fmean(samples), 2),
+        "p50_ms": round(samples[len(samples) // 2], 2),
+        "p95_ms": round(samples[int(len(samples) * 0.95) - 1], 2),
+    }
+
+
+def recall(found, truth) -> float:
+    hits = sum(len(set(f) & set(t)) for f, t in zip(found, truth))
+    return round(hits / max(1, sum(len(t) for t in truth)), 4)
+
+
+def main():
+    args = sys.argv[1:]
+    opts = {"--url": ":memory:", "--api-key": "", "--points": "50000", "--dim": "256", "--queries": "200",
+            "--top-k": "8", "--hnsw-ef": "0", "--oversampling": "0", "--profiles": "none,int8,binary"}
+    flags = {"--on-disk": False, "--keep": False}
+    while args:
+        key = args.pop(0)
+        if key in flags:
+            flags[key] = True
+            continue
+        if key not in opts or not args:
+            print("Usage: python3 scripts/bench_quantization.py [--url URL] [--api-key KEY] [--points N] [--dim N] "
+                  "[--queries N] [--top-k N] [--hnsw-ef N] [--oversampling X] [--profiles none,int8,binary] "
+                  "[--on-disk] [--keep]")
+            sys.exit(1)
+        opts[key] = args.pop(0)
+    points, dim, nq, top_k = (int(opts[k]) for k in ("--points", "--dim", "--queries", "--top-k"))
+    profiles = [p.strip() for p in opts["--profiles"].split(",") if p.strip()]
+    for p in profiles:
+        if p not in build_index.QUANTIZATION_KINDS:
+            raise SystemExit(f"unknown profile '{p}'")
+
+    if opts["--url"] == ":memory:":
+        client = QdrantClient(location=":memory:")
+    else:
+        client = QdrantClient(url=opts["--url"], api_key=opts["--api-key"] or None, timeout=600.0)
+
+    vecs = clustered_vectors(points, dim)
+    queries = clustered_vectors(nq, dim, seed=9)
+    exact = models.SearchParams(exact=True)
+
+    results, truth, created = {}, None, []
+    try:
+        for kind in profiles:
+            collection = f"bench_quant_{kind}_{uuid.uuid4().hex[:8]}"
+            build_index.COLLECTION_PROFILE.update(quantization=kind, on_disk_vectors=flags["--on-disk"])
+            build_index.ensure_collection(client, collection, dim)
+            created.append(collection)
+            t0 = time.time()
+            load(client, collection, vecs)
+            load_sec = time.time() - t0
+
+            if truth is None:
+                truth, exact_latency = search(client, collection, queries, top_k, exact)
+                results["exact"] = {"recall_at_k": 1.0, **exact_latency}
+
+            rag_retrieve.SEARCH.update(quantization=kind, hnsw_ef=int(opts["--hnsw-ef"]) or None,
+                                       oversampling=float(opts["--oversampling"]) or None, rescore=True)
+            params = rag_retrieve.search_params()
+            found, latency = search(client, collection, queries, top_k, params)
+            row = {"recall_at_k": recall(found, truth), **latency, "load_sec": round(load_sec, 1)}
+            if kind != "none":
+                rag_retrieve.SEARCH["rescore"] = False
+                found, latency = search(client, collection, queries, top_k, rag_retrieve.search_params())
+                row["without_rescore"] = {"recall_at_k": recall(found, truth), **latency}
+            results[kind] = row
+
+        print(json.dumps({
+            "url": opts["--url"],
+            "points": points,
+            "dim": dim,
+            "queries": nq,
+            "top_k": top_k,
+            "on_disk_vectors": flags["--on-disk"],
+            "results": results,
+        }, indent=2))
+    finally:
+        if not flags["--keep"]:
+            for collection in created:
+                client.delete_collection(collection)
+
+
+if __name__ == "__main__":
+    main()
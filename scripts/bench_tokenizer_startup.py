@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# bench_tokenizer_startup.py
+#
+# Cold encoder load time, before and after the offline cache: every run is a
+# fresh interpreter so nothing is warm except the OS page cache.
+#
+#   python3 inc/tiktoken_cache.py build            # once
+#   python3 scripts/bench_tokenizer_startup.py [--runs 7] [encoding ...]
+#
+# "tiktoken" is tiktoken.get_encoding() reading its own cache files (the old path,
+# minus the download); "tkenc" is tiktoken_cache.read_encoding() on the
+# pre-processed file. Prints one JSON object with per-mode timings in ms.
+
+import os, sys, json, statistics, subprocess
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(APP_DIR, "inc"))
+import tiktoken_cache  # noqa: E402
+
+_CHILD = r"""
+import os, sys, time, json
+t0 = time.perf_counter()
+mode, name, inc_dir = sys.argv[1:4]
+sys.path.insert(0, inc_dir)
+if mode == "tiktoken":
+    import tiktoken
+    enc = tiktoken.get_encoding(name)
+else:
+    import tiktoken_cache
+    enc = tiktoken_cache.read_encoding(tiktoken_cache.cache_file(name))
+enc.encode("warm up the core")
+print(json.dumps({"ms": (time.perf_counter() - t0) * 1000.0}))
+"""
+
+
+def run_once(mode: str, name: str) -> float:
+    env = dict(os.environ, TIKTOKEN_CACHE_DIR=tiktoken_cache.CACHE_DIR)
+    out = subprocess.run(
+        [sys.executable, "-c", _CHILD, mode, name, os.path.join(APP_DIR, "inc")],
+        env=env, capture_output=True, text=True, check=True,
+    ).stdout
+    return json.loads(out)["ms"]
+
+
+def main():
+    args = sys.argv[1:]
+    runs = 7
+    if "--runs" in args:
+        i = args.index("--runs")
+        runs = int(args[i + 1])
+        del args[i:i + 2]
+    names = args or list(tiktoken_cache.DEFAULT_BUILD)
+
+    results = {}
+    for name in names:
+        if not os.path.exists(tiktoken_cache.cache_file(name)):
+            results[name] = {"error": "cache not built; run python3 inc/tiktoken_cache.py build"}
+            continue
+        results[name] = {}
+        for mode in ("tiktoken", "tkenc"):
+            samples = [run_once(mode, name) for _ in range(runs)]
+            results[name][mode] = {
+                "min_ms": round(min(samples), 1),
+                "median_ms": round(statistics.median(samples), 1),
+            }
+    print(json.dumps({"cache_dir": tiktoken_cache.CACHE_DIR, "runs": runs, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -28,3 +28,32 @@ register_test('configured rag python path must be executable', function (): void
         }
     }
 });
+
+register_test('rag service timeout does not fall back to the cli', function (): void {
+    $previousConfig = $GLOBALS['config'] ?? null;
+    $socket = sys_get_temp_dir() . '/rag_timeout_' . bin2hex(random_bytes(4)) . '.sock';
+    // Listens but never answers, like a service stuck on a slow request
+    $server = stream_socket_server('unix://' . $socket);
+    $GLOBALS['config'] = [
+        'rag' => [
+            'service_socket' => $socket,
+            'python' => '/tmp/does-not-exist',
+        ],
+    ];
+
+    try {
+        $started = microtime(true);
+        $result = run_rag('Test question', 1, 'tester', '/tmp/does-not-exist.ini', 1);
+        assert_equals(124, $result['rc'] ?? null, 'Service timeout should return rc=124');
+        assert_equals('service:' . $socket, $result['cmd'] ?? null, 'No CLI fallback after a timeout');
+        assert_true(microtime(true) - $started < 3.0, 'The turn should not wait for the timeout twice');
+    } finally {
+        fclose($server);
+        @unlink($socket);
+        if ($previousConfig !== null) {
+            $GLOBALS['config'] = $previousConfig;
+        } else {
+            unset($GLOBALS['config']);
+        }
+    }
+});
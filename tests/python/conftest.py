@@ -97,6 +97,21 @@ if 'qdrant_client' not in sys.modules:
     class Filter:
         def __init__(self, *args, **kwargs):
             self.must = kwargs.get('must', [])
+            self.must_not = kwargs.get('must_not', [])
+
+    class FilterSelector:
+        def __init__(self, filter):
+            self.filter = filter
+
+    class SetPayload:
+        def __init__(self, payload, points=None, filter=None):
+            self.payload = payload
+            self.points = points
+            self.filter = filter
+
+    class SetPayloadOperation:
+        def __init__(self, set_payload):
+            self.set_payload = set_payload
 
     class FieldCondition:
         def __init__(self, *args, **kwargs):
@@ -113,6 +128,9 @@ if 'qdrant_client' not in sys.modules:
     models_mod.Filter = Filter
     models_mod.FieldCondition = FieldCondition
     models_mod.MatchValue = MatchValue
+    models_mod.FilterSelector = FilterSelector
+    models_mod.SetPayload = SetPayload
+    models_mod.SetPayloadOperation = SetPayloadOperation
 
     sys.modules['qdrant_client'] = qc_mod
     sys.modules['qdrant_client.http'] = http_mod
@@ -125,12 +143,18 @@ if 'tiktoken' not in sys.modules:
     tiktoken = types.ModuleType('tiktoken')
 
     class DummyEncoding:
-        def encode(self, text):
+        def encode(self, text, **_kwargs):
             return [ord(ch) for ch in text]
 
+        def encode_ordinary_batch(self, texts, **_kwargs):
+            return [self.encode(text) for text in texts]
+
         def decode(self, tokens):
             return ''.join(chr(t) for t in tokens)
 
+        def decode_bytes(self, tokens):
+            return self.decode(tokens).encode('utf-8')
+
     def get_encoding(_name):
         return DummyEncoding()
 
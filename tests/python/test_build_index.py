@@ -1,15 +1,104 @@
+import contextlib
+import hashlib
 import importlib
+import io
+import json
 import os
 import tempfile
+import time
 from types import SimpleNamespace
 from unittest import TestCase, mock
 
+import numpy as np
+
 import tests.python.stubs  # noqa: F401  ensures optional deps are stubbed before imports
 
 
+class FakeDb:
+    """Answers the handful of queries build_index.main() issues."""
+
+    def __init__(self, doc):
+        self.doc = doc
+        self.rag_index = None
+        self.reusable = None
+        self.statements = []
+
+    def connect(self):
+        db = self
+
+        class Cursor:
+            lastrowid = None
+
+            def execute(self, sql, params=()):
+                sql = ' '.join(sql.split())
+                db.statements.append((sql, params))
+                self._row = None
+                if sql.startswith('SELECT id, chat_id, name'):
+                    self._row = dict(db.doc)
+                elif sql.startswith('SELECT deleted FROM document'):
+                    self._row = {'deleted': db.doc['deleted']}
+                elif sql.startswith('SELECT id, ready, chunk_count, content_sha256, embedding_dim FROM rag_index'):
+                    self._row = db.rag_index
+                elif sql.startswith('SELECT ri.document_id, ri.version, ri.chunk_count'):
+                    self._row = db.reusable
+                elif sql.startswith('INSERT INTO rag_index'):
+                    db.rag_index = {'id': 7, 'ready': 0, 'chunk_count': 0, 'content_sha256': params[4],
+                                    'embedding_dim': params[7]}
+                    self.lastrowid = 7
+                elif sql.startswith('UPDATE rag_index SET chunk_count=%s, ready=1'):
+                    db.rag_index.update(chunk_count=params[0], ready=1, content_sha256=params[1],
+                                        embedding_dim=params[2], chunk_tokens=params[3], chunk_overlap=params[4])
+
+            def fetchone(self):
+                return self._row
+
+            def fetchall(self):
+                return [self._row] if self._row else []
+
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc):
+                return False
+
+        class Conn:
+            def cursor(self):
+                return Cursor()
+
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc):
+                return False
+
+        return Conn()
+
+
+class WordEncoding:
+    """One token per whitespace-separated word."""
+
+    def encode(self, text):
+        return text.split()
+
+    def decode(self, tokens):
+        return ' '.join(tokens)
+
+
+def fake_qdrant(stored=(), source=()):
+    """A client whose id-only scroll returns `stored` and whose vector scroll returns `source`."""
+    client = mock.Mock()
+    client.scroll.side_effect = lambda **kw: (list(source if kw.get('with_vectors') else stored), None)
+    return client
+
+
 class BuildIndexTests(TestCase):
     def setUp(self):
         self.module = importlib.reload(importlib.import_module('inc.build_index'))
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.module.CHUNK_CACHE['path'] = os.path.join(self.cache_dir.name, 'chunks.sqlite3')
+
+    def tearDown(self):
+        self.cache_dir.cleanup()
 
     def test_chunk_text_overlap(self):
         class DummyEncoding:
@@ -47,7 +136,8 @@ class BuildIndexTests(TestCase):
             result = self.module.embed_texts(['a', 'b'], batch_size=2)
 
         mock_embed.assert_called_once_with(['a', 'b'])
-        self.assertEqual(fake_vectors, result)
+        self.assertEqual(np.float32, result.dtype)
+        np.testing.assert_allclose(fake_vectors, result, rtol=1e-6)
 
     def test_ensure_collection_validates_dimension(self):
         class DummyClient:
@@ -61,6 +151,9 @@ class BuildIndexTests(TestCase):
                 cfg = SimpleNamespace(vectors=SimpleNamespace(size=self.current_size))
                 return SimpleNamespace(config=cfg)
 
+            def create_payload_index(self, **kwargs):
+                pass
+
         client = DummyClient()
         self.module.ensure_collection(client, 'test', 256)
 
@@ -68,15 +161,468 @@ class BuildIndexTests(TestCase):
         with self.assertRaises(RuntimeError):
             self.module.ensure_collection(client, 'test', 256)
 
-    def test_stream_text_chunks_batches(self):
-        data = 'line1\nline2\nline3'
-        with tempfile.NamedTemporaryFile('w', delete=False) as tmp:
-            tmp.write(data)
+    def test_stream_text_chunks_hashes_and_chunks_in_one_pass(self):
+        data = 'line1\r\nline2\nline3\n'
+        with tempfile.NamedTemporaryFile('wb', delete=False) as tmp:
+            tmp.write(data.encode('utf-8'))
             path = tmp.name
 
         try:
-            with mock.patch.object(self.module, 'chunk_text', return_value=[data.replace('\n', ' ').upper()]):
-                chunks = list(self.module.stream_text_chunks(path, max_tokens=10, overlap=2))
-            self.assertEqual([data.replace('\n', ' ').upper()], chunks)
+            hasher = hashlib.sha256()
+            with mock.patch.object(self.module, 'token_encoder', return_value=WordEncoding()):
+                chunks = list(self.module.stream_text_chunks(path, max_tokens=2, overlap=1, hasher=hasher))
+            self.assertEqual(['line1 line2', 'line2 line3'], chunks)
+            self.assertEqual(self.module.sha256_file(path), hasher.hexdigest())
+        finally:
+            os.unlink(path)
+
+    def test_embed_texts_concurrent_keeps_order(self):
+        self.module.AZURE.update({'key': 'abc', 'endpoint': 'https://example', 'deployment': 'model', 'api_version': '2024'})
+        self.module.EMBED_CONCURRENCY = 4
+        texts = [f't{i}' for i in range(10)]
+
+        def fake_embed(batch):
+            time.sleep(0.01 * (10 - int(batch[0][1:])) / 10)
+            return [[float(t[1:])] for t in batch]
+
+        with mock.patch.object(self.module, 'embed_azure', side_effect=fake_embed) as mock_embed:
+            result = self.module.embed_texts(texts, batch_size=3)
+
+        self.assertEqual(4, mock_embed.call_count)
+        self.assertEqual([[float(i)] for i in range(10)], result.tolist())
+
+    def test_post_retries_after_429_and_shrinks_concurrency(self):
+        limiter = self.module.AdaptiveLimiter(4)
+        throttled = SimpleNamespace(status_code=429, text='slow down', headers={'retry-after-ms': '10'})
+        ok = SimpleNamespace(status_code=200, text='', headers={'x-ratelimit-remaining-requests': '100'},
+                             raise_for_status=lambda: None)
+        session = mock.Mock()
+        session.post.side_effect = [throttled, ok]
+
+        with mock.patch.object(self.module, 'http_session', return_value=session), \
+                mock.patch.object(self.module.time, 'sleep') as sleep:
+            response = self.module._post_json_with_retry('https://example', {}, {}, limiter=limiter)
+
+        self.assertIs(ok, response)
+        self.assertEqual(2, limiter.limit)
+        self.assertEqual(0, limiter.in_flight)
+        self.assertGreaterEqual(sleep.call_args[0][0], 0.01)
+
+    def test_retry_after_header_forms(self):
+        self.assertEqual(2.0, self.module._retry_after_seconds({'Retry-After': '2'}))
+        self.assertEqual(0.5, self.module._retry_after_seconds({'retry-after-ms': '500'}))
+        self.assertEqual(0.0, self.module._retry_after_seconds({}))
+
+    def _run_main(self, text, db, job=None, **patches):
+        with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False) as tmp:
+            tmp.write(text)
+            path = tmp.name
+        inp = {'document_id': 5, 'chat_id': 'c1', 'user': 'u1', 'file_path': path,
+               'embedding_model': 'emb', 'chunk_tokens': 1, 'chunk_overlap': 0, 'config_path': 'x.ini'}
+        inp.update(job or {})
+        upserted = []
+        defaults = {
+            'read_input': mock.Mock(return_value=inp),
+            'load_ini': mock.Mock(),
+            'db_conn': db.connect,
+            'qdrant_client': mock.Mock(return_value=fake_qdrant()),
+            'ensure_collection': mock.Mock(),
+            'embed_texts': lambda texts, batch_size=64: [[float(len(t))] for t in texts],
+            'upsert_points': lambda client, collection, vecs, payloads, wait=True: upserted.extend(zip(vecs, payloads)),
+            'token_encoder': mock.Mock(return_value=WordEncoding()),
+        }
+        defaults.update(patches)
+        out = io.StringIO()
+        try:
+            with contextlib.ExitStack() as stack:
+                for name, value in defaults.items():
+                    stack.enter_context(mock.patch.object(self.module, name, value))
+                stack.enter_context(contextlib.redirect_stdout(out))
+                self.module.main()
         finally:
             os.unlink(path)
+        return json.loads(out.getvalue().strip().splitlines()[-1]), upserted
+
+    def test_main_pipeline_indexes_all_chunks_in_order(self):
+        db = FakeDb({'id': 5, 'chat_id': 'c1', 'name': 'a.txt', 'type': 'text/plain', 'content': '',
+                     'file_sha256': 'f', 'content_sha256': None, 'version': 1, 'deleted': 0})
+        words = [f'w{i}' for i in range(600)]
+        result, upserted = self._run_main(' '.join(words), db)
+
+        self.assertTrue(result['ok'])
+        self.assertEqual(600, result['chunk_count'])
+        self.assertEqual(list(range(600)), [p['chunk_index'] for _, p in upserted])
+        self.assertEqual(words, [p['chunk_text'] for _, p in upserted])
+        self.assertEqual({'chunk', 'embed', 'upsert', 'record'}, set(result['stages']))
+        self.assertEqual(3, result['stages']['record']['items'])
+        self.assertEqual(1, db.rag_index['ready'])
+
+    def test_reupload_reuses_cached_chunk_embeddings(self):
+        db = FakeDb({'id': 5, 'chat_id': 'c1', 'name': 'a.txt', 'type': 'text/plain', 'content': '',
+                     'file_sha256': 'f', 'content_sha256': None, 'version': 1, 'deleted': 0})
+        first, _ = self._run_main('alpha beta gamma', db)
+        self.assertEqual({'hits': 0, 'misses': 3, 'hit_rate': 0.0}, first['embedding_cache'])
+
+        embedded = []
+
+        def embed(texts, batch_size=64):
+            embedded.extend(texts)
+            return [[9.0] for _ in texts]
+
+        db.doc['version'] = 2
+        second, upserted = self._run_main('alpha beta delta', db, embed_texts=embed)
+        self.assertEqual(['delta'], embedded)
+        self.assertEqual(2, second['embedding_cache']['hits'])
+        self.assertEqual([[5.0], [4.0], [9.0]], [vec for vec, _ in upserted])
+
+    def test_same_content_copies_vectors_from_ready_index(self):
+        db = FakeDb({'id': 5, 'chat_id': 'c1', 'name': 'mine.txt', 'type': 'text/plain', 'content': '',
+                     'file_sha256': 'f', 'content_sha256': None, 'version': 1, 'deleted': 0})
+        db.reusable = {'document_id': 2, 'version': 3, 'chunk_count': 2}
+        shared = {'user_id': 'other', 'chat_id': 'c9', 'document_id': 2, 'version': 3, 'filename': 'theirs.txt',
+                  'page_range': '1', 'embedding_model': 'emb', 'deleted': False}
+        points = [SimpleNamespace(payload=dict(shared, chunk_index=i, chunk_text=t), vector=[float(i)])
+                  for i, t in enumerate(['alpha', 'beta'])]
+        client = fake_qdrant(source=points)
+        embed = mock.Mock()
+
+        result, upserted = self._run_main('alpha beta', db, qdrant_client=mock.Mock(return_value=client),
+                                          embed_texts=embed)
+
+        embed.assert_not_called()
+        self.assertEqual(2, result['reused_from_document_id'])
+        # Only an index chunked the way this job asks for may be copied
+        sql, params = next(s for s in db.statements if s[0].startswith('SELECT ri.document_id'))
+        self.assertIn('ri.chunk_tokens=%s AND ri.chunk_overlap=%s', sql)
+        self.assertEqual((1, 0), params[4:6])
+        self.assertEqual((1, 0), (db.rag_index['chunk_tokens'], db.rag_index['chunk_overlap']))
+        self.assertEqual(2, result['chunk_count'])
+        self.assertEqual([[0.0], [1.0]], [vec for vec, _ in upserted])
+        payload = upserted[1][1]
+        self.assertEqual(('u1', 'c1', 5, 1, 'mine.txt'),
+                         (payload['user_id'], payload['chat_id'], payload['document_id'], payload['version'], payload['filename']))
+        self.assertEqual('beta', payload['chunk_text'])
+        self.assertEqual(1, db.rag_index['ready'])
+
+    def test_incomplete_reuse_copy_is_deleted_before_reindexing(self):
+        db = FakeDb({'id': 5, 'chat_id': 'c1', 'name': 'mine.txt', 'type': 'text/plain', 'content': '',
+                     'file_sha256': 'f', 'content_sha256': None, 'version': 1, 'deleted': 0})
+        db.reusable = {'document_id': 2, 'version': 3, 'chunk_count': 3}
+        shared = {'user_id': 'other', 'chat_id': 'c9', 'document_id': 2, 'version': 3, 'filename': 'theirs.txt',
+                  'page_range': '1', 'embedding_model': 'emb', 'deleted': False}
+        points = [SimpleNamespace(payload=dict(shared, chunk_index=0, chunk_text='alpha beta'), vector=[0.0])]
+        client = fake_qdrant(source=points)
+
+        result, upserted = self._run_main('alpha beta', db, qdrant_client=mock.Mock(return_value=client))
+
+        self.assertIsNone(result['reused_from_document_id'])
+        copy_build = upserted[0][1]['index_build']
+        self.assertEqual(['alpha beta', 'alpha', 'beta'], [p['chunk_text'] for _, p in upserted])
+        deletes = [c.kwargs['points_selector'].filter for c in client.delete.call_args_list]
+        self.assertEqual(2, len(deletes))
+        # First the partial copy, by this build's ID, then the usual stale delete
+        self.assertEqual([5, 'emb', copy_build], [c.match.value for c in deletes[0].must])
+        self.assertEqual(copy_build, deletes[1].must_not[0].match.value)
+
+    def test_non_incremental_job_never_reuses(self):
+        db = FakeDb({'id': 5, 'chat_id': 'c1', 'name': 'mine.txt', 'type': 'text/plain', 'content': '',
+                     'file_sha256': 'f', 'content_sha256': None, 'version': 1, 'deleted': 0})
+        db.reusable = {'document_id': 2, 'version': 3, 'chunk_count': 2}
+        client = fake_qdrant(source=[SimpleNamespace(payload={'chunk_text': 'alpha'}, vector=[0.0])])
+
+        result, upserted = self._run_main('alpha beta', db, job={'incremental': False},
+                                          qdrant_client=mock.Mock(return_value=client))
+
+        self.assertIsNone(result['reused_from_document_id'])
+        self.assertEqual(['alpha', 'beta'], [p['chunk_text'] for _, p in upserted])
+        self.assertFalse(any(sql.startswith('SELECT ri.document_id') for sql, _ in db.statements))
+        client.scroll.assert_not_called()
+
+    def test_unchanged_ready_index_is_a_no_op(self):
+        db = FakeDb({'id': 5, 'chat_id': 'c1', 'name': 'a.txt', 'type': 'text/plain', 'content': '',
+                     'file_sha256': 'f', 'content_sha256': None, 'version': 1, 'deleted': 0})
+        self._run_main('alpha beta', db)
+        client = fake_qdrant()
+        embed = mock.Mock()
+
+        result, upserted = self._run_main('alpha beta', db, qdrant_client=mock.Mock(return_value=client),
+                                          embed_texts=embed)
+
+        self.assertTrue(result['unchanged'])
+        self.assertEqual(2, result['chunk_count'])
+        self.assertEqual([], upserted)
+        embed.assert_not_called()
+        client.scroll.assert_not_called()
+        self.assertEqual(1, db.rag_index['ready'])
+
+    def test_incremental_reindex_embeds_only_changed_chunks(self):
+        db = FakeDb({'id': 5, 'chat_id': 'c1', 'name': 'a.txt', 'type': 'text/plain', 'content': '',
+                     'file_sha256': 'f', 'content_sha256': None, 'version': 1, 'deleted': 0})
+        _, first = self._run_main('alpha beta gamma', db)
+        stored = [SimpleNamespace(id=self.module._point_id_from_payload(p), payload=None) for _, p in first]
+        client = fake_qdrant(stored=stored)
+        embedded = []
+
+        def embed(texts, batch_size=64):
+            embedded.extend(texts)
+            return [[9.0] for _ in texts]
+
+        self.module.CHUNK_CACHE['path'] = ''  # make every miss reach the embedder
+        result, upserted = self._run_main('delta alpha gamma', db, qdrant_client=mock.Mock(return_value=client),
+                                          embed_texts=embed)
+
+        self.assertEqual(['delta'], embedded)
+        self.assertEqual(['delta'], [p['chunk_text'] for _, p in upserted])
+        self.assertEqual({'kept': 2, 'embedded': 1, 'stale': 1}, result['incremental'])
+        self.assertEqual(3, result['chunk_count'])
+
+        ops = client.batch_update_points.call_args.kwargs['update_operations']
+        refreshed = {op.set_payload.points[0]: op.set_payload.payload['chunk_index'] for op in ops}
+        self.assertEqual({stored[0].id: 1, stored[2].id: 2}, refreshed)
+        self.assertTrue(all('chunk_text' not in op.set_payload.payload for op in ops))
+
+        build = upserted[0][1]['index_build']
+        flt = client.delete.call_args.kwargs['points_selector'].filter
+        self.assertEqual(build, flt.must_not[0].match.value)
+        self.assertEqual([5, 'emb'], [c.match.value for c in flt.must])
+
+    def test_structure_sidecar_sets_page_range(self):
+        db = FakeDb({'id': 5, 'chat_id': 'c1', 'name': 'a.pdf', 'type': 'application/pdf', 'content': '',
+                     'file_sha256': 'f', 'content_sha256': None, 'version': 1, 'deleted': 0})
+        text = '--- Page 1 ---\nalpha\n--- Page 2 ---\nbeta'
+        with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as tmp:
+            json.dump({'v': 1, 'unit': 'page', 'bytes': len(text),
+                       'marks': [[0, '1'], [text.index('--- Page 2'), '2']]}, tmp)
+            structure_path = tmp.name
+        try:
+            _, upserted = self._run_main(text, db, job={'structure_path': structure_path, 'chunk_tokens': 100})
+        finally:
+            os.unlink(structure_path)
+
+        payload = upserted[0][1]
+        self.assertEqual(('1-2', None, 'page'), (payload['page_range'], payload['section'], payload['page_unit']))
+        self.assertEqual({'page_range': None, 'section': 'Q1', 'page_unit': 'sheet'},
+                         self.module.structure_fields('sheet', ['Q1']))
+
+    def test_ensure_collection_adds_missing_payload_indexes(self):
+        client = mock.Mock()
+        client.create_collection.side_effect = Exception('exists')
+        client.get_collection.return_value = SimpleNamespace(
+            config=SimpleNamespace(vectors=SimpleNamespace(size=8)),
+            payload_schema={'user_id': SimpleNamespace(params=None), 'chat_id': SimpleNamespace(params=None)},
+        )
+        tenant = SimpleNamespace(KeywordIndexParams=lambda **kw: SimpleNamespace(**kw))
+
+        with mock.patch.object(self.module, 'qmodels', tenant):
+            self.module.ensure_collection(client, 'nhlbi', 8)
+
+        calls = {c.kwargs['field_name']: c.kwargs['field_schema'] for c in client.create_payload_index.call_args_list}
+        # chat_id is already there; user_id is re-created as the tenant key
+        self.assertEqual({'user_id', 'document_id', 'deleted', 'embedding_model', 'version'}, set(calls))
+        self.assertTrue(calls['user_id'].is_tenant)
+        self.assertEqual('integer', calls['document_id'])
+        self.assertEqual('bool', calls['deleted'])
+
+        client.create_payload_index.reset_mock()
+        client.get_collection.return_value.payload_schema = {
+            field: SimpleNamespace(params=SimpleNamespace(is_tenant=True)) for field, _, _ in self.module.PAYLOAD_INDEXES
+        }
+        with mock.patch.object(self.module, 'qmodels', tenant):
+            self.module.ensure_collection(client, 'nhlbi', 8)
+        client.create_payload_index.assert_not_called()
+
+    def test_collection_profile_applied_on_create_and_update(self):
+        ns = lambda **kw: SimpleNamespace(**kw)
+        fake_models = SimpleNamespace(
+            ScalarQuantization=ns, ScalarQuantizationConfig=ns, ScalarType=SimpleNamespace(INT8='int8'),
+            BinaryQuantization=ns, BinaryQuantizationConfig=ns, HnswConfigDiff=ns, VectorParamsDiff=ns,
+            Disabled=SimpleNamespace(DISABLED='Disabled'), KeywordIndexParams=ns,
+        )
+        ini = tempfile.NamedTemporaryFile('w', suffix='.ini', delete=False)
+        ini.write('[qdrant]\nquantization = "int8"\nhnsw_m = 32\nef_construct = 256\n')
+        ini.close()
+        try:
+            self.module.load_ini(ini.name)
+        finally:
+            os.unlink(ini.name)
+        self.assertEqual({'quantization': 'int8', 'on_disk_vectors': False, 'hnsw_m': 32, 'ef_construct': 256},
+                         self.module.COLLECTION_PROFILE)
+
+        client = mock.Mock()
+        with mock.patch.object(self.module, 'qmodels', fake_models):
+            self.module.ensure_collection(client, 'nhlbi', 8)
+        kwargs = client.create_collection.call_args.kwargs
+        self.assertEqual('int8', kwargs['quantization_config'].scalar.type)
+        self.assertEqual((32, 256), (kwargs['hnsw_config'].m, kwargs['hnsw_config'].ef_construct))
+        client.update_collection.assert_not_called()
+
+        # Existing collection: unquantized with the default graph -> one update call
+        client = mock.Mock()
+        client.create_collection.side_effect = Exception('exists')
+        client.get_collection.return_value = SimpleNamespace(
+            config=SimpleNamespace(params=SimpleNamespace(vectors=SimpleNamespace(size=8, on_disk=None)),
+                                   hnsw_config=SimpleNamespace(m=16, ef_construct=100), quantization_config=None),
+            payload_schema={},
+        )
+        self.module.COLLECTION_PROFILE.update(quantization='none', on_disk_vectors=True)
+        with mock.patch.object(self.module, 'qmodels', fake_models):
+            self.module.ensure_collection(client, 'nhlbi', 8)
+        kwargs = client.update_collection.call_args.kwargs
+        self.assertNotIn('quantization_config', kwargs)
+        self.assertEqual(32, kwargs['hnsw_config'].m)
+        self.assertTrue(kwargs['vectors_config'][''].on_disk)
+
+        client.get_collection.return_value.config.params.vectors.size = 4
+        with self.assertRaises(RuntimeError):
+            self.module.ensure_collection(client, 'nhlbi', 8)
+
+    def test_dimensions_config_is_sent_and_recorded(self):
+        with tempfile.NamedTemporaryFile('w', delete=False) as tmp:
+            tmp.write('[openai-embedding]\napi_key = "KEY"\nmodel = "text-embedding-3-large"\ndimensions = 1024\n')
+            ini_path = tmp.name
+        try:
+            self.module.load_ini(ini_path)
+        finally:
+            os.unlink(ini_path)
+        self.assertEqual(1024, self.module.EMBED_DIM)
+
+        response = mock.Mock()
+        response.json.return_value = {'data': [{'index': 0, 'embedding': [0.0] * 1024}]}
+        with mock.patch.object(self.module, '_post_json_with_retry', return_value=response) as post:
+            self.assertEqual(1024, len(self.module.embed_openai(['a'])[0]))
+        self.assertEqual(1024, post.call_args[0][2]['dimensions'])
+
+        response.json.return_value = {'data': [{'index': 0, 'embedding': [0.0] * 1536}]}
+        with mock.patch.object(self.module, '_post_json_with_retry', return_value=response):
+            with self.assertRaises(RuntimeError):
+                self.module.embed_openai(['a'])
+
+        db = FakeDb({'id': 5, 'chat_id': 'c1', 'name': 'a.txt', 'type': 'text/plain', 'content': '',
+                     'file_sha256': 'f', 'content_sha256': None, 'version': 1, 'deleted': 0})
+        result, _ = self._run_main('alpha beta', db)
+        self.assertEqual(1024, result['embedding_dim'])
+        self.assertEqual(1024, db.rag_index['embedding_dim'])
+
+        # Same content indexed at another size is re-embedded, not reported unchanged
+        self.module.EMBED_DIM = 512
+        result, upserted = self._run_main('alpha beta', db)
+        self.assertNotIn('unchanged', result)
+        self.assertEqual(2, len(upserted))
+        self.assertEqual(512, db.rag_index['embedding_dim'])
+
+    def test_base64_embeddings_decode_into_float32_matrix(self):
+        import base64
+        self.module.AZURE.update({'key': 'abc', 'endpoint': 'https://example', 'deployment': 'model', 'api_version': '2024'})
+        rows = np.arange(12, dtype='<f4').reshape(3, 4)
+        response = mock.Mock()
+        # Out of order, as the API may return them
+        response.json.return_value = {'data': [
+            {'index': i, 'embedding': base64.b64encode(rows[i].tobytes()).decode('ascii')} for i in (2, 0, 1)
+        ]}
+        with mock.patch.object(self.module, '_post_json_with_retry', return_value=response) as post:
+            result = self.module.embed_azure(['a', 'b', 'c'])
+
+        self.assertEqual('base64', post.call_args[0][2]['encoding_format'])
+        self.assertEqual((3, 4), result.shape)
+        self.assertEqual(np.float32, result.dtype)
+        self.assertTrue(result.flags['C_CONTIGUOUS'])
+        np.testing.assert_array_equal(rows, result)
+
+        response.json.return_value = {'data': [{'index': 0, 'embedding': [1.0, 2.0]}]}
+        with mock.patch.object(self.module, '_post_json_with_retry', return_value=response):
+            with self.assertRaisesRegex(RuntimeError, 'missing'):
+                self.module.embed_azure(['a', 'b'])
+        # Indices are checked before anything is decoded
+        response.json.return_value = {'data': [{'index': 0, 'embedding': None}, {'index': 0, 'embedding': None}]}
+        with mock.patch.object(self.module, '_post_json_with_retry', return_value=response), \
+                mock.patch.object(self.module, '_decode_vector') as decode:
+            with self.assertRaisesRegex(RuntimeError, 'missing'):
+                self.module.embed_azure(['a', 'b'])
+        decode.assert_not_called()
+
+        # Cached rows come back as arrays too, merged in input order with fresh ones
+        cache = self.module.chunk_cache()
+        with mock.patch.object(self.module, 'embed_texts', return_value=rows[:2]):
+            self.module.embed_texts_cached(['x', 'y'], cache, 'm')
+        with mock.patch.object(self.module, 'embed_texts', return_value=rows[2:]) as embed:
+            vectors, hits = self.module.embed_texts_cached(['x', 'z', 'y'], cache, 'm')
+        embed.assert_called_once_with(['z'], batch_size=64)
+        self.assertEqual(2, hits)
+        np.testing.assert_array_equal(rows[[0, 2, 1]], vectors)
+
+    def test_upsert_points_uploads_arrays(self):
+        client = mock.Mock()
+        payloads = [{'document_id': 1, 'embedding_model': 'm', 'chunk_sha256': 'a', 'chunk_ordinal': 0},
+                    {'document_id': 1, 'embedding_model': 'm', 'chunk_sha256': 'b', 'chunk_ordinal': 0}]
+        self.module.upsert_points(client, 'nhlbi', np.ones((2, 4), dtype=np.float32), payloads)
+        kwargs = client.upload_collection.call_args.kwargs
+        self.assertIsInstance(kwargs['vectors'], np.ndarray)
+        self.assertEqual(2, len(set(kwargs['ids'])))
+        self.assertTrue(kwargs['wait'])
+
+    def test_upload_settings_from_ini_reach_client(self):
+        ini = tempfile.NamedTemporaryFile('w', suffix='.ini', delete=False)
+        ini.write('[qdrant]\nprefer_grpc = true\ngrpc_port = 16334\nupload_parallel = 3\nupload_wait = 1\n')
+        ini.close()
+        try:
+            self.module.load_ini(ini.name)
+        finally:
+            os.unlink(ini.name)
+        self.assertEqual((True, 16334, 3, True), (self.module.QDRANT_UPLOAD['prefer_grpc'],
+                                                  self.module.QDRANT_UPLOAD['grpc_port'],
+                                                  self.module.QDRANT_UPLOAD['parallel'],
+                                                  self.module.QDRANT_UPLOAD['wait']))
+        with mock.patch.object(self.module, 'QdrantClient') as client_cls:
+            self.module.qdrant_client()
+        kwargs = client_cls.call_args.kwargs
+        self.assertTrue(kwargs['prefer_grpc'])
+        self.assertEqual(16334, kwargs['grpc_port'])
+
+    def test_transient_upload_errors_are_retried(self):
+        class Unavailable(Exception):
+            status_code = 503
+
+        client = mock.Mock()
+        client.upload_collection.side_effect = [Unavailable('busy'), ConnectionError('reset'), None]
+        payloads = [{'document_id': 1, 'embedding_model': 'm', 'chunk_sha256': 'a', 'chunk_ordinal': 0}]
+        with mock.patch.object(self.module.time, 'sleep') as sleep:
+            self.module.upsert_points(client, 'nhlbi', np.ones((1, 4), dtype=np.float32), payloads, wait=False)
+        self.assertEqual(3, client.upload_collection.call_count)
+        self.assertEqual(2, sleep.call_count)
+        self.assertFalse(client.upload_collection.call_args.kwargs['wait'])
+
+        client.upload_collection.side_effect = ValueError('bad vector')
+        with self.assertRaises(ValueError):
+            self.module.upsert_points(client, 'nhlbi', np.ones((1, 4), dtype=np.float32), payloads)
+
+    def test_point_uploader_barrier_raises_first_failure(self):
+        sent = []
+
+        def upsert(client, collection, vecs, payloads, wait=True):
+            if payloads[0]['n'] == 2:
+                raise RuntimeError('upload failed')
+            sent.append((payloads[0]['n'], wait))
+
+        uploader = self.module.PointUploader(mock.Mock(), 'nhlbi', parallel=2)
+        with mock.patch.object(self.module, 'upsert_points', upsert):
+            for n in range(3):
+                uploader.submit([[0.0]], [{'n': n}])
+            with self.assertRaises(RuntimeError):
+                uploader.barrier()
+            # Later submissions fail fast instead of queueing behind a broken build
+            with self.assertRaises(RuntimeError):
+                uploader.submit([[0.0]], [{'n': 3}])
+        uploader.close()
+        self.assertEqual({0, 1}, {n for n, _ in sent})
+        self.assertFalse(any(wait for _, wait in sent))
+        stats = uploader.stats()
+        self.assertEqual((3, 3, 2), (stats['points'], stats['batches'], stats['parallel']))
+
+    def test_main_reports_upsert_stats(self):
+        db = FakeDb({'id': 5, 'chat_id': 'c1', 'name': 'a.txt', 'type': 'text/plain', 'content': '',
+                     'file_sha256': 'f', 'content_sha256': None, 'version': 1, 'deleted': 0})
+        result, upserted = self._run_main('one two three', db)
+        self.assertEqual(3, len(upserted))
+        self.assertEqual(3, result['upsert']['points'])
+        self.assertEqual('rest', result['upsert']['transport'])
+        self.assertIn('barrier_sec', result['upsert'])
@@ -0,0 +1,72 @@
+import importlib
+import os
+import tempfile
+import time
+from unittest import TestCase, mock
+
+import tests.python.stubs  # noqa: F401  ensures optional deps are stubbed before imports
+
+
+class EmbeddingCacheTests(TestCase):
+    def setUp(self):
+        self.module = importlib.import_module('inc.embedding_cache')
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'cache.sqlite3')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_shared_disk_tier_across_instances(self):
+        writer = self.module.EmbeddingCache(self.path)
+        writer.put('model-a', 'hello', [0.5, -1.0, 2.0])
+        reader = self.module.EmbeddingCache(self.path)
+        self.assertEqual(([0.5, -1.0, 2.0], 'disk'), reader.lookup('model-a', 'hello'))
+        self.assertEqual(([0.5, -1.0, 2.0], 'memory'), reader.lookup('model-a', 'hello'))
+        self.assertIsNone(reader.get('model-b', 'hello'))
+        self.assertEqual({'hits_memory': 1, 'hits_disk': 1, 'misses': 1}, reader.stats())
+
+    def test_ttl_expires_entries(self):
+        cache = self.module.EmbeddingCache(self.path, ttl_seconds=60)
+        cache.put('m', 'old', [1.0])
+        later = time.time() + 120
+        with mock.patch.object(self.module.time, 'time', return_value=later):
+            self.assertIsNone(cache.get('m', 'old'))
+            self.assertIsNone(self.module.EmbeddingCache(self.path, ttl_seconds=60).get('m', 'old'))
+
+    def test_evicts_least_recently_used_beyond_limit(self):
+        cache = self.module.EmbeddingCache(self.path, memory_entries=2, max_entries=3)
+        for i in range(5):
+            cache.put('m', f'text {i}', [float(i)])
+        cache.evict()
+        fresh = self.module.EmbeddingCache(self.path)
+        self.assertEqual([None, None, [2.0], [3.0], [4.0]], [fresh.get('m', f'text {i}') for i in range(5)])
+        self.assertEqual(2, len(cache._lru))
+
+    def test_normalize_query(self):
+        self.assertEqual('What is ＲAG?'.replace('Ｒ', 'R'), self.module.normalize_query('  What\tis\n ＲAG? '))
+
+    def test_eviction_runs_periodically_not_per_write(self):
+        cache = self.module.EmbeddingCache(self.path, max_entries=3, evict_every=10, evict_interval=3600)
+        with mock.patch.object(cache, 'evict', wraps=cache.evict) as evict:
+            cache.put_many((f'k{i}', [float(i)]) for i in range(4))
+            cache.put_many((f'k{i}', [float(i)]) for i in range(4, 8))
+            evict.assert_not_called()
+            cache.put_many((f'k{i}', [float(i)]) for i in range(8, 12))
+            evict.assert_called_once()
+        rows = cache._db().execute('SELECT COUNT(*) FROM embedding_cache').fetchone()[0]
+        self.assertEqual(3, rows)
+        indexes = {r[1] for r in cache._db().execute("PRAGMA index_list('embedding_cache')")}
+        self.assertIn('embedding_cache_created', indexes)
+
+    def test_evicts_least_recently_used_beyond_byte_limit(self):
+        # 4-dim float32 vectors are 16 bytes each; 40 bytes keeps the newest two
+        cache = self.module.EmbeddingCache(self.path, memory_entries=0, max_entries=0, max_bytes=40)
+        now = time.time()
+        for i in range(5):
+            with mock.patch.object(self.module.time, 'time', return_value=now + i):
+                cache.put('m', f'text {i}', [float(i)] * 4)
+        with mock.patch.object(self.module.time, 'time', return_value=now + 10):
+            cache.get('m', 'text 1')  # a read makes it recent again
+            cache.evict()
+        fresh = self.module.EmbeddingCache(self.path)
+        self.assertEqual([None, [1.0] * 4, None, None, [4.0] * 4], [fresh.get('m', f'text {i}') for i in range(5)])
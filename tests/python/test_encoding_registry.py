@@ -0,0 +1,40 @@
+import configparser
+import importlib
+from unittest import TestCase
+
+import tests.python.stubs  # noqa: F401  ensures optional deps are stubbed before imports
+
+
+class EncodingRegistryTests(TestCase):
+    def setUp(self):
+        self.module = importlib.reload(importlib.import_module('inc.encoding_registry'))
+
+    def test_model_families(self):
+        name = self.module.encoding_name_for
+        self.assertEqual('o200k_base', name('gpt-4o-mini'))
+        self.assertEqual('o200k_base', name('gpt-4.1'))
+        self.assertEqual('o200k_base', name('o3-mini'))
+        self.assertEqual('o200k_base', name('gpt-5'))
+        self.assertEqual('cl100k_base', name('gpt-4-turbo'))
+        self.assertEqual('cl100k_base', name('gpt-35-turbo-16k'))
+        self.assertEqual('cl100k_base', name('text-embedding-3-large'))
+        self.assertEqual('cl100k_base', name('cl100k_base'))
+        self.assertEqual('o200k_base', name(None))
+
+    def test_ini_deployments_and_pinned_tokenizer(self):
+        cfg = configparser.ConfigParser(interpolation=None)
+        cfg.read_string(
+            '[azure-main]\ndeployment_name = "NHLBI-Chat-prod"\nmodel = "gpt-4o"\n'
+            '[azure-legacy]\ndeployment_name = "old-one"\ntokenizer = "cl100k_base"\n'
+            '[database]\nhost = x\n'
+        )
+        self.assertEqual(2, self.module.register_deployments(cfg))
+        self.assertEqual('o200k_base', self.module.encoding_name_for('azure-main'))
+        self.assertEqual('o200k_base', self.module.encoding_name_for('nhlbi-chat-prod'))
+        self.assertEqual('cl100k_base', self.module.encoding_name_for('azure-legacy'))
+        self.assertEqual((4, -1), self.module.message_overheads('old-one'))
+
+    def test_encodings_loaded_once(self):
+        first = self.module.get_encoding('gpt-4o')
+        self.assertIs(first, self.module.get_encoding('o200k_base'))
+        self.assertEqual(['o200k_base'], self.module.loaded_encodings())
@@ -0,0 +1,190 @@
+import importlib
+import json
+import os
+import tempfile
+from types import SimpleNamespace
+from unittest import TestCase, mock
+
+import tests.python.stubs  # noqa: F401  ensures optional deps are stubbed before imports
+
+
+class WordEncoding:
+    def encode(self, text):
+        return text.split()
+
+    def decode(self, tokens):
+        return ' '.join(tokens)
+
+
+class FakeDb:
+    def __init__(self, rows, contents):
+        self.rows = rows
+        self.contents = contents
+        self.updates = []
+
+    def connect(self):
+        db = self
+
+        class Cursor:
+            rowcount = 0
+
+            def execute(self, sql, params=()):
+                sql = ' '.join(sql.split())
+                self._rows = []
+                if sql.startswith('SELECT ri.id AS rag_index_id'):
+                    self._rows = [dict(r) for r in db.rows if r['collection'] != params[0]]
+                elif sql.startswith('SELECT id, content, structure_index FROM document'):
+                    self._rows = [dict(db.contents[i], id=i) for i in params]
+                elif sql.startswith('UPDATE rag_index SET collection=%s'):
+                    db.updates.append(params)
+                    for r in db.rows:
+                        if r['rag_index_id'] == params[4] and r['content_sha256'] == params[5]:
+                            r['collection'] = params[0]
+                            r['embedding_model'] = params[1]
+                            self.rowcount = 1
+
+            def fetchall(self):
+                return self._rows
+
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc):
+                return False
+
+        class Conn:
+            def cursor(self):
+                return Cursor()
+
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc):
+                return False
+
+        return Conn()
+
+
+ALIAS_MODELS = SimpleNamespace(
+    DeleteAliasOperation=lambda **kw: ('delete', kw['delete_alias']),
+    DeleteAlias=lambda **kw: kw['alias_name'],
+    CreateAliasOperation=lambda **kw: ('create', kw['create_alias']),
+    CreateAlias=lambda **kw: (kw['alias_name'], kw['collection_name']),
+)
+
+
+class MigrateCollectionTests(TestCase):
+    def setUp(self):
+        self.module = importlib.reload(importlib.import_module('inc.migrate_collection'))
+        self.bi = importlib.reload(self.module.build_index)
+        self.module.build_index = self.bi
+        self.tmp = tempfile.TemporaryDirectory()
+        self.bi.CHUNK_CACHE['path'] = ''
+        self.bi.EMBED_DIM = 4
+        self.bi.OPENAI['model'] = 'emb'
+        self.state_path = os.path.join(self.tmp.name, 'state.json')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _rows(self):
+        return [
+            {'rag_index_id': 1, 'document_id': 10, 'user': 'u1', 'embedding_model': 'emb', 'content_sha256': 'a',
+             'chat_id': 'c1', 'name': 'a.pdf', 'version': 1, 'collection': 'nhlbi'},
+            {'rag_index_id': 2, 'document_id': 11, 'user': 'u2', 'embedding_model': 'emb', 'content_sha256': 'b',
+             'chat_id': 'c2', 'name': 'b.txt', 'version': 1, 'collection': 'nhlbi'},
+        ]
+
+    def _run(self, db, client, embed, **opts):
+        base = {'config': 'x.ini', 'target': 'nhlbi_v2', 'alias': 'nhlbi_live', 'workers': 2, 'batch': 1,
+                'chunk_tokens': 6, 'chunk_overlap': 0, 'embedding_model': '', 'state': self.state_path,
+                'no_swap': False}
+        base.update(opts)
+        upserted = []
+        self.stale = mock.Mock()
+        with mock.patch.multiple(
+            self.bi,
+            load_ini=mock.Mock(),
+            db_conn=db.connect,
+            qdrant_client=mock.Mock(return_value=client),
+            ensure_collection=mock.Mock(),
+            embed_texts=embed,
+            token_encoder=mock.Mock(return_value=WordEncoding()),
+            upsert_points=lambda c, coll, vecs, payloads: upserted.extend((coll, p) for p in payloads),
+            delete_stale_points=self.stale,
+        ), mock.patch.object(self.module, 'qmodels', ALIAS_MODELS):
+            return self.module.run(base), upserted
+
+    def test_migrates_resumes_and_swaps_alias(self):
+        structure = json.dumps({'v': 1, 'unit': 'page', 'bytes': 46, 'marks': [[0, '1'], [21, '2']]})
+        db = FakeDb(self._rows(), {
+            10: {'content': '--- Page 1 ---\nalpha\n--- Page 2 ---\nbeta gamma', 'structure_index': structure},
+            11: {'content': 'delta epsilon', 'structure_index': None},
+        })
+        client = mock.Mock()
+        client.get_aliases.return_value = SimpleNamespace(aliases=[SimpleNamespace(alias_name='nhlbi_live',
+                                                                                   collection_name='nhlbi')])
+        calls = []
+
+        def flaky(texts, batch_size=64):
+            calls.append(list(texts))
+            if 'delta epsilon' in texts:
+                raise RuntimeError('rate limited')
+            return [[0.0] * 4 for _ in texts]
+
+        out, upserted = self._run(db, client, flaky)
+        self.assertFalse(out['ok'])
+        self.assertEqual(1, out['documents'])
+        self.assertFalse(out['swapped'])
+        client.update_collection_aliases.assert_not_called()
+        self.assertEqual({'1'}, set(json.load(open(self.state_path))['docs']))
+        self.assertTrue(all(coll == 'nhlbi_v2' for coll, _ in upserted))
+        self.assertEqual(['1', '2'], [p['page_range'] for _, p in upserted])
+
+        # Second run: document 10 is skipped from the state file, 11 succeeds, alias swaps
+        calls.clear()
+        out, upserted = self._run(db, client, lambda texts, batch_size=64: [[0.0] * 4 for _ in texts])
+        self.assertTrue(out['ok'])
+        self.assertEqual(1, out['documents'])
+        self.assertEqual({11}, {p['document_id'] for _, p in upserted})
+        self.assertEqual('nhlbi', out['previous_collection'])
+        ops = client.update_collection_aliases.call_args.kwargs['change_aliases_operations']
+        self.assertEqual([('delete', 'nhlbi_live'), ('create', ('nhlbi_live', 'nhlbi_v2'))], ops)
+        self.assertEqual(2, out['rag_index_updated'])
+        self.assertEqual({'nhlbi_v2'}, {r['collection'] for r in db.rows})
+        self.assertEqual({4}, {u[2] for u in db.updates})
+
+    def test_state_entry_is_stale_after_content_change(self):
+        state = self.module.MigrationState(self.state_path, 'nhlbi_v2', 4)
+        row = self._rows()[0]
+        state.record(row, 3)
+        state.save()
+
+        reloaded = self.module.MigrationState(self.state_path, 'nhlbi_v2', 4)
+        self.assertTrue(reloaded.done(row))
+        self.assertFalse(reloaded.done(dict(row, content_sha256='changed')))
+        # Another target or dimension starts from scratch
+        self.assertEqual({}, self.module.MigrationState(self.state_path, 'nhlbi_v2', 8).docs)
+
+    def test_model_migration_labels_points_and_rows_with_new_model(self):
+        db = FakeDb(self._rows(), {10: {'content': 'alpha beta', 'structure_index': None},
+                                   11: {'content': 'gamma', 'structure_index': None}})
+        client = mock.Mock()
+        client.get_aliases.return_value = SimpleNamespace(aliases=[])
+        self.bi.OPENAI['model'] = 'emb-large'
+        out, upserted = self._run(db, client, lambda texts, batch_size=64: [[0.0] * 4 for _ in texts])
+
+        self.assertTrue(out['ok'])
+        self.assertEqual('emb-large', out['embedding_model'])
+        self.assertEqual({'emb-large'}, {p['embedding_model'] for _, p in upserted})
+        self.assertEqual({'emb-large'}, {c.args[3] for c in self.stale.call_args_list})
+        self.assertEqual({('nhlbi_v2', 'emb-large')}, {(r['collection'], r['embedding_model']) for r in db.rows})
+
+        # --embedding-model overrides the INI deployment name
+        for r in db.rows:
+            r['collection'] = 'nhlbi'
+        os.unlink(self.state_path)
+        out, upserted = self._run(db, client, lambda texts, batch_size=64: [[0.0] * 4 for _ in texts],
+                                  embedding_model='emb-large-v2')
+        self.assertEqual({'emb-large-v2'}, {p['embedding_model'] for _, p in upserted})
+        self.assertEqual({'emb-large-v2'}, {r['embedding_model'] for r in db.rows})
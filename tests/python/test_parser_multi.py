@@ -1,12 +1,92 @@
 import importlib
+import json
 import os
 import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
 from unittest import TestCase, mock
 
 
+class FakePage:
+    def __init__(self, number):
+        self.number = number
+
+    def get_text(self):
+        # Every third page is a "scan": no text layer, two images to OCR
+        return '' if self.number % 3 == 0 else f'text of page {self.number}\n'
+
+    def get_images(self, full=False):
+        return [(self.number * 10 + i,) for i in range(2)] if self.number % 3 == 0 else []
+
+
+class FakePdf:
+    def __init__(self, pages):
+        self.pages = [FakePage(n) for n in range(1, pages + 1)]
+        self.page_count = pages
+
+    def __len__(self):
+        return len(self.pages)
+
+    def __iter__(self):
+        return iter(self.pages)
+
+    def __getitem__(self, index):
+        return self.pages[index]
+
+    def extract_image(self, xref):
+        return {'image': str(xref).encode()}
+
+    def close(self):
+        pass
+
+
+class FakeImage:
+    """Just enough of PIL.Image for triage_image()."""
+
+    def __init__(self, size, mode='RGB', fmt='PNG', info=None, hist=None):
+        self.size = size
+        self.mode = mode
+        self.format = fmt
+        self.info = info or {}
+        self.hist = hist or ([0] * 10 + [500] * 246)
+        self.drafted = None
+        self.resized = None
+
+    def _copy(self, **changes):
+        img = FakeImage(self.size, self.mode, self.format, self.info, self.hist)
+        img.drafted, img.resized = self.drafted, self.resized
+        img.__dict__.update(changes)
+        return img
+
+    def draft(self, mode, size):
+        factor = 1
+        while factor < 8 and self.size[0] // (factor * 2) >= size[0] and self.size[1] // (factor * 2) >= size[1]:
+            factor *= 2
+        self.drafted = (mode, size)
+        self.size = (self.size[0] // factor, self.size[1] // factor)
+        self.mode = mode
+
+    def convert(self, mode):
+        return self._copy(mode=mode)
+
+    def resize(self, size, resample=None):
+        return self._copy(size=size, resized=size)
+
+    def histogram(self):
+        return self.hist
+
+
 class ParserMultiTests(TestCase):
     def setUp(self):
         self.module = importlib.reload(importlib.import_module('parser_multi'))
+        # Images in these tests are plain bytes; the triage tests call the real function
+        self.triage_image = self.module.triage_image
+        patcher = mock.patch.object(self.module, 'triage_image', lambda data: (data, 'ok'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.module.OCR_BATCH_SIZE = 1  # one tesseract run per image unless a test batches
 
     def test_parse_doc_requires_existing_file(self):
         with self.assertRaises(ValueError):
@@ -44,3 +124,318 @@ class ParserMultiTests(TestCase):
                 self.module.parse_doc(path, 'artifact.bin')
         finally:
             os.unlink(path)
+
+    def test_structure_index_records_marker_byte_offsets(self):
+        text = '--- Page 1 ---\nCafé\n\n--- Page 2 ---\nSecond\n--- Page 3 ---\nThird'
+        index = self.module.structure_index(text)
+
+        data = text.encode('utf-8')
+        self.assertEqual('page', index['unit'])
+        self.assertEqual(len(data), index['bytes'])
+        self.assertEqual(['1', '2', '3'], [label for _, label in index['marks']])
+        for offset, label in index['marks']:
+            self.assertTrue(data[offset:].startswith(f'--- Page {label} ---'.encode('utf-8')))
+
+    def test_structure_index_for_sheets_keeps_names(self):
+        index = self.module.structure_index('Preamble\n--- Sheet: Q1 - Sales ---\n{}\n--- Sheet: Notes ---\n{}')
+        self.assertEqual('sheet', index['unit'])
+        self.assertEqual(['Q1 - Sales', 'Notes'], [label for _, label in index['marks']])
+
+    def test_write_structure_writes_sidecar(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'out.txt.structure.json')
+            self.module.write_structure('--- Slide 1 ---\nA\n\n--- Slide 2 ---\nB', path)
+            with open(path, encoding='utf-8') as handle:
+                data = json.load(handle)
+        self.assertEqual({'v': 1, 'unit': 'slide', 'bytes': 36, 'marks': [[0, '1'], [19, '2']]}, data)
+
+    def test_parallel_pdf_matches_serial_output_and_reports_in_order(self):
+        ocr = lambda data, timeout=0: f'ocr {data.decode()}'
+        with mock.patch.object(self.module.fitz, 'open', lambda _path: FakePdf(30), create=True), \
+                mock.patch.object(self.module, '_tesseract', ocr):
+            self.module.PDF_WORKERS = 1
+            serial = self.module.parse_pdf('scan.pdf')
+            self.module.PDF_WORKERS = 3
+            # Threads stand in for worker processes so the patched fitz is visible to them
+            with mock.patch.object(self.module, 'ProcessPoolExecutor', ThreadPoolExecutor), \
+                    mock.patch.object(self.module, 'report_progress') as progress, \
+                    mock.patch.object(self.module, '_parse_pdf_range',
+                                      wraps=self.module._parse_pdf_range) as ranges:
+                parallel = self.module.parse_pdf('scan.pdf')
+
+        self.assertEqual(serial, parallel)
+        self.assertIn('[OCR – Page 3 Image 2]\nocr 31', parallel)
+        self.assertEqual(4, ranges.call_count)
+        self.assertEqual(list(range(1, 31)), [c.args[1] for c in progress.call_args_list])
+
+    def test_parallel_pdf_keeps_bounded_number_of_ranges_in_flight(self):
+        submitted = []
+
+        class Pool(ThreadPoolExecutor):
+            def submit(self, fn, *args):
+                submitted.append(args[1])
+                return super().submit(fn, *args)
+
+        with mock.patch.object(self.module.fitz, 'open', lambda _path: FakePdf(80), create=True), \
+                mock.patch.object(self.module, 'ProcessPoolExecutor', Pool):
+            pages = self.module._iter_pdf_pages_parallel('scan.pdf', 80, 2)
+            first = next(pages)
+            self.assertEqual([0, 8, 16, 24], submitted)  # 2 x workers, not all 10 ranges
+            rest = list(pages)
+
+        self.assertEqual(80, 1 + len(rest))
+        self.assertEqual(list(range(0, 80, 8)), submitted)
+        self.assertIn('Page 1', first[0][0])
+
+    def test_ocr_executor_returns_results_in_submission_order(self):
+        release = threading.Event()
+
+        def ocr(data, timeout=0):
+            if data == b'slow':
+                release.wait(5)
+            return data.decode()
+
+        with mock.patch.object(self.module, '_tesseract', ocr), \
+                self.module.OcrExecutor(workers=2, budget_sec=0) as pool:
+            jobs = [pool.submit(b'slow'), pool.submit(b'fast')]
+            jobs[1].text()
+            self.assertFalse(jobs[0].done())
+            pending = self.module.deque([(1, ['a', (jobs[0], '[', ']')]), (2, [(jobs[1], '<', '>')])])
+            emitted = []
+            self.module._emit_ready(pending, lambda idx, parts: emitted.append((idx, parts)))
+            self.assertEqual([], emitted)  # page 2 is done but waits behind page 1
+            release.set()
+            self.module._emit_ready(pending, lambda idx, parts: emitted.append((idx, parts)), wait=True)
+            stats = pool.snapshot()
+        self.assertEqual([(1, ['a', '[slow]']), (2, ['<fast>'])], emitted)
+        self.assertEqual((2, 2, 0), (stats['submitted'], stats['completed'], stats['queue_depth']))
+        self.assertGreaterEqual(stats['max_queue_depth'], 1)
+
+    def test_ocr_budget_skips_images_once_spent(self):
+        def ocr(data, timeout=0):
+            time.sleep(0.05)
+            return 'text'
+
+        with mock.patch.object(self.module, '_tesseract', ocr), \
+                self.module.OcrExecutor(workers=1, budget_sec=0.03) as pool:
+            texts = [pool.submit(bytes([i])).text() for i in range(3)]
+            stats = pool.snapshot()
+        self.assertEqual('text', texts[0])
+        self.assertEqual(['', ''], texts[1:])
+        self.assertEqual(3, stats['skipped_budget'])  # the first one ran past the budget too
+
+    def test_tesserocr_runs_are_bounded_by_the_budget(self):
+        timeouts = []
+
+        class Api:
+            def __init__(self, lang):
+                pass
+
+            def SetImage(self, img):
+                self.img = img
+
+            def Recognize(self, timeout=0):
+                timeouts.append(timeout)
+                return self.img != b'\x01'  # the pathological image hits the timeout
+
+            def GetUTF8Text(self):
+                return 'text '
+
+            def End(self):
+                pass
+
+        with mock.patch.object(self.module, 'tesserocr', SimpleNamespace(PyTessBaseAPI=Api)), \
+                mock.patch.object(self.module, '_tesseract', side_effect=AssertionError('subprocess used')):
+            with self.module.OcrExecutor(workers=1, budget_sec=30) as pool:
+                texts = [pool.submit(bytes([i])).text() for i in range(2)]
+                stats = pool.snapshot()
+            with self.module.OcrExecutor(workers=1, budget_sec=30) as spent:
+                spent._started -= 60
+                self.assertEqual('', spent.submit(b'late').text())
+        self.assertEqual(['text', ''], texts)
+        self.assertEqual(1, stats['skipped_budget'])
+        self.assertEqual(2, len(timeouts))  # nothing reached Recognize once the budget was spent
+        self.assertTrue(all(0 < t <= 30000 for t in timeouts))
+
+    def test_pptx_ocr_stays_in_slide_order_and_stats_reach_progress_file(self):
+        picture = self.module.MSO_SHAPE_TYPE.PICTURE
+
+        def shape(kind, blob=b''):
+            return mock.Mock(shape_type=kind, has_text_frame=False, has_table=False,
+                             image=mock.Mock(blob=blob))
+
+        slides = [mock.Mock(shapes=[shape(picture, b'one'), shape(picture, b'two')]),
+                  mock.Mock(shapes=[shape(picture, b'three')])]
+        prs = mock.Mock(slides=slides)
+        ocr = lambda data, timeout=0: data.decode().upper()
+        with tempfile.TemporaryDirectory() as tmp:
+            status = os.path.join(tmp, 'status.json')
+            with mock.patch.object(self.module, 'Presentation', return_value=prs), \
+                    mock.patch.object(self.module, '_tesseract', ocr), \
+                    mock.patch.object(self.module, 'PROGRESS_FILE', status):
+                text = self.module.parse_pptx('deck.pptx')
+            with open(status, encoding='utf-8') as handle:
+                progress = json.load(handle)
+        self.assertEqual('--- Slide 1 ---\n[OCR – Slide 1 Image]\nONE\n[OCR – Slide 1 Image]\nTWO\n\n'
+                         '--- Slide 2 ---\n[OCR – Slide 2 Image]\nTHREE', text)
+        self.assertEqual('complete', progress['status'])
+        self.assertEqual(3, progress['ocr']['completed'])
+        self.assertIn('max_queue_depth', progress['ocr'])
+
+    def test_repeated_logo_is_ocred_once(self):
+        picture = self.module.MSO_SHAPE_TYPE.PICTURE
+        logo = mock.Mock(shape_type=picture, has_text_frame=False, has_table=False, image=mock.Mock(blob=b'logo'))
+        prs = mock.Mock(slides=[mock.Mock(shapes=[logo]) for _ in range(80)])
+        tesseract = mock.Mock(return_value='NHLBI')
+        with mock.patch.object(self.module, 'Presentation', return_value=prs), \
+                mock.patch.object(self.module, '_tesseract', tesseract), \
+                self.module.OcrExecutor(workers=4, budget_sec=0, cache=self.module.OcrCache()) as pool, \
+                mock.patch.object(self.module, 'OcrExecutor', return_value=pool):
+            text = self.module.parse_pptx('deck.pptx')
+            stats = pool.snapshot()
+        tesseract.assert_called_once()
+        self.assertEqual(80, text.count('[OCR – Slide'))
+        self.assertEqual((1, 79), (stats['submitted'], stats['cache_hits_memory']))
+
+    def test_ocr_cache_persists_across_runs_and_stays_size_bounded(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'ocr.sqlite')
+            first = self.module.OcrCache(path, max_bytes=1000)
+            key = first.key(b'scan')
+            first.put(key, 'weekly form')
+
+            second = self.module.OcrCache(path, max_bytes=1000)
+            self.assertEqual(('weekly form', 'disk'), second.get(key))
+            self.assertEqual(('weekly form', 'memory'), second.get(key))
+            with mock.patch.object(self.module, 'OCR_LANG', 'spa'):
+                self.assertNotEqual(key, second.key(b'scan'))
+
+            for i in range(40):
+                second.put(second.key(bytes([i])), 'x' * 100)
+            second.evict()
+            total = second._db().execute('SELECT SUM(bytes), COUNT(*) FROM ocr_cache').fetchone()
+            self.assertLessEqual(total[0], 1000)
+            self.assertEqual(('x' * 100, 'disk'), self.module.OcrCache(path).get(second.key(bytes([39]))))
+            self.assertEqual((None, 'miss'), self.module.OcrCache(path).get(key))
+
+    def test_ocr_cache_disk_io_runs_outside_the_shared_lock(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = self.module.OcrCache(os.path.join(tmp, 'ocr.sqlite'), max_bytes=1000)
+            seen = {}
+
+            def worker(i):
+                cache.put(f'k{i}', 'text')
+                seen[i] = cache._db()  # kept alive so ids cannot be reused
+                cache.get(f'missing{i}')
+
+            test = self
+
+            class Conn:
+                def __init__(self, real):
+                    self.real = real
+
+                def execute(self, *args):
+                    test.assertFalse(cache._lock.locked())
+                    return self.real.execute(*args)
+
+            real_db = cache._db
+            with mock.patch.object(cache, '_db', lambda: Conn(real_db())):
+                for i in range(40):
+                    cache.put(f'x{i}', 'y' * 10)  # reaches the periodic eviction too
+                cache.get('nope')
+            threads = [threading.Thread(target=worker, args=(i,)) for i in range(3)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        self.assertEqual(3, len({id(conn) for conn in seen.values()}))  # one connection per thread
+
+    def _triage(self, img):
+        fake_pil = SimpleNamespace(open=lambda _stream: img, Resampling=SimpleNamespace(LANCZOS='lanczos'))
+        with mock.patch.object(self.module, 'Image', fake_pil):
+            return self.triage_image(b'image')
+
+    def test_triage_skips_icons_and_blank_images(self):
+        self.assertEqual((None, 'skipped_small'), self._triage(FakeImage((16, 16))))
+        blank = FakeImage((1700, 2200), hist=[0] * 255 + [3740000])
+        self.assertEqual((None, 'skipped_uniform'), self._triage(blank))
+
+    def test_triage_drafts_large_jpeg_scans_down_to_target_dpi(self):
+        img, outcome = self._triage(FakeImage((6000, 8000), fmt='JPEG'))
+        self.assertEqual('scaled', outcome)
+        self.assertEqual('L', img.mode)
+        # draft() got the decoder down to 1/2 scale; resize() does the rest
+        self.assertEqual(('L', (2632, 3510)), img.drafted)
+        self.assertEqual((2632, 3510), img.size)
+
+    def test_triage_uses_dpi_metadata_and_keeps_normal_images(self):
+        img, outcome = self._triage(FakeImage((2400, 1200), info={'dpi': (600, 600)}))
+        self.assertEqual(('scaled', (1200, 600), None), (outcome, img.size, img.drafted))
+
+        img, outcome = self._triage(FakeImage((1200, 800), info={'dpi': (300, 300)}))
+        self.assertEqual(('ok', (1200, 800), 'L', None), (outcome, img.size, img.mode, img.resized))
+
+    def test_executor_counts_triage_outcomes(self):
+        outcomes = {b'icon': (None, 'skipped_small'), b'blank': (None, 'skipped_uniform'),
+                    b'scan': (b'scan', 'scaled'), b'page': (b'page', 'ok')}
+        tesseract = mock.Mock(side_effect=lambda img, timeout=0: img.decode())
+        with mock.patch.object(self.module, 'triage_image', outcomes.get), \
+                mock.patch.object(self.module, '_tesseract', tesseract), \
+                self.module.OcrExecutor(workers=2, budget_sec=0, cache=self.module.OcrCache()) as pool:
+            texts = [pool.submit(data).text() for data in outcomes]
+            stats = pool.snapshot()
+        self.assertEqual(['', '', 'scan', 'page'], texts)
+        self.assertEqual(2, tesseract.call_count)
+        self.assertEqual((1, 1, 1), (stats['skipped_small'], stats['skipped_uniform'], stats['scaled']))
+
+    def test_tesseract_batch_maps_pages_back_to_images(self):
+        class Saved:
+            def __init__(self, name):
+                self.name = name
+
+            def save(self, path, format=None):
+                with open(path, 'w') as handle:
+                    handle.write(self.name)
+
+        listed = []
+
+        def run(cmd, **kwargs):
+            with open(cmd[1]) as handle:
+                paths = handle.read().split()
+            listed.extend(open(p).read() for p in paths)
+            self.assertEqual(['stdout', '-l', 'eng'], cmd[2:])
+            return SimpleNamespace(stdout=stdout)
+
+        images = [Saved('a'), Saved('b'), Saved('c')]
+        with mock.patch.object(self.module.subprocess, 'run', run):
+            stdout = b'first page\n\f\f third\n\f'
+            self.assertEqual(['first page', '', 'third'], self.module._tesseract_batch(images))
+            stdout = b'first\fsecond\fthird'  # separators between pages only
+            self.assertEqual(['first', 'second', 'third'], self.module._tesseract_batch(images))
+            stdout = b'only one page\n\f'
+            with self.assertRaises(RuntimeError):
+                self.module._tesseract_batch(images)
+        self.assertEqual(['a', 'b', 'c'] * 3, listed)
+
+    def test_executor_batches_images_and_falls_back_per_image(self):
+        batch = mock.Mock(side_effect=lambda images, timeout=0: [f'text {d.decode()}' for d in images])
+        single = mock.Mock(side_effect=lambda img, timeout=0: f'single {img.decode()}')
+        with mock.patch.object(self.module, '_tesseract_batch', batch), \
+                mock.patch.object(self.module, '_tesseract', single), \
+                self.module.OcrExecutor(workers=2, budget_sec=0, cache=self.module.OcrCache(), batch_size=4) as pool:
+            jobs = [pool.submit(f'{i}'.encode()) for i in range(10)]
+            texts = [job.text() for job in jobs]
+            stats = pool.snapshot()
+        self.assertEqual([f'text {i}' for i in range(10)], texts)
+        self.assertEqual([4, 4, 2], sorted((len(c.args[0]) for c in batch.call_args_list), reverse=True))
+        single.assert_not_called()
+        self.assertEqual(('tesseract-batch', 3, 0), (stats['engine'], stats['batches'], stats['batch_fallbacks']))
+
+        batch.side_effect = RuntimeError('tesseract returned 1 pages for 3 images')
+        with mock.patch.object(self.module, '_tesseract_batch', batch), \
+                mock.patch.object(self.module, '_tesseract', single), \
+                self.module.OcrExecutor(workers=1, budget_sec=0, cache=self.module.OcrCache(), batch_size=3) as pool:
+            texts = [job.text() for job in [pool.submit(f'{i}'.encode()) for i in range(3)]]
+            stats = pool.snapshot()
+        self.assertEqual(['single 0', 'single 1', 'single 2'], texts)
+        self.assertEqual(1, stats['batch_fallbacks'])
@@ -6,9 +6,20 @@ from unittest import TestCase, mock
 import tests.python.stubs  # noqa: F401  ensures optional deps are stubbed before imports
 
 
+def _write_ini(body):
+    with tempfile.NamedTemporaryFile('w', suffix='.ini', delete=False) as tmp:
+        tmp.write(body)
+    return tmp.name
+
+
 class RagRetrieveTests(TestCase):
     def setUp(self):
         self.module = importlib.reload(importlib.import_module('inc.rag_retrieve'))
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.module.QUERY_CACHE['path'] = os.path.join(self.cache_dir.name, 'queries.sqlite3')
+
+    def tearDown(self):
+        self.cache_dir.cleanup()
 
     def test_load_ini_sets_embedding_dim(self):
         with tempfile.NamedTemporaryFile('w', delete=False) as tmp:
@@ -17,15 +28,46 @@ class RagRetrieveTests(TestCase):
             ini_path = tmp.name
 
         try:
-            self.module.load_ini(ini_path)
-            self.assertEqual('KEY', self.module.AZURE['key'])
-            self.assertEqual(3072, self.module.EMBED_DIM)
+            settings = self.module.load_ini(ini_path)
+            self.assertEqual('KEY', settings.azure['key'])
+            self.assertEqual(3072, settings.embed_dim)
         finally:
             os.unlink(ini_path)
+        # Parsing never touches the module defaults, and Settings cannot be edited in place
+        self.assertEqual('', self.module.AZURE['key'])
+        with self.assertRaises(TypeError):
+            settings.azure['key'] = 'other'
+
+    def test_each_config_gets_its_own_settings(self):
+        first = _write_ini('[qdrant]\ncollection = "first"\nrescore = 0\n')
+        second = _write_ini('[azure-embedding]\napi_key = "KEY"\nurl = "https://example"\n')
+
+        class Point:
+            payload = {'document_id': 3, 'chunk_index': 1, 'filename': 'a.txt', 'chunk_text': 'Some text.'}
+            score = 0.9
+
+        client = mock.Mock()
+        client.query_points.return_value = mock.Mock(points=[Point()])
+        try:
+            with mock.patch.object(self.module, 'QdrantClient', return_value=client), \
+                    mock.patch.object(self.module, 'embed_query', return_value=[0.0, 1.0]) as embed:
+                out = [self.module.retrieve({'question': 'q', 'chat_id': 'c1', 'user': 'u1', 'config_path': path})
+                       for path in (first, second, first)]
+            a, b = self.module.ensure_config(first), self.module.ensure_config(second)
+        finally:
+            os.unlink(first)
+            os.unlink(second)
+
+        self.assertEqual(['first', 'nhlbi', 'first'], [o['collection'] for o in out])
+        self.assertEqual([a, b, a], [c.args[1] for c in embed.call_args_list])
+        # Keys a file does not set keep their defaults instead of another file's values
+        self.assertEqual((False, True), (a.search['rescore'], b.search['rescore']))
+        self.assertEqual(('', 'KEY'), (a.azure['key'], b.azure['key']))
+        self.assertEqual(sorted([first, second]), self.module.loaded_configs())
 
     def test_embed_query_uses_azure(self):
-        self.module.AZURE.update({'key': 'abc', 'endpoint': 'https://example', 'deployment': 'model', 'api_version': '2024-06-01'})
-        self.module.OPENAI['key'] = ''
+        settings = self.module.default_settings()._replace(
+            azure={'key': 'abc', 'endpoint': 'https://example', 'deployment': 'model', 'api_version': '2024-06-01'})
 
         class DummyResponse:
             def __init__(self):
@@ -37,13 +79,32 @@ class RagRetrieveTests(TestCase):
             def json(self):
                 return self._data
 
-        with mock.patch('requests.post', return_value=DummyResponse()) as mock_post:
-            vector = self.module.embed_query('question')
+        session = mock.Mock()
+        session.post.return_value = DummyResponse()
+        with mock.patch.object(self.module, 'http_session', return_value=session):
+            vector = self.module.embed_query('question', settings)
+        mock_post = session.post
 
         self.assertEqual([0.1, 0.2], vector)
         called_url = mock_post.call_args[0][0]
         self.assertIn('https://example', called_url)
 
+    def test_embed_query_repeats_come_from_cache(self):
+        settings = self.module.default_settings()._replace(
+            azure={'key': 'abc', 'endpoint': 'https://example', 'deployment': 'model', 'api_version': '2024-06-01'})
+        with mock.patch.object(self.module, '_embed_query_remote', return_value=[0.5, 0.25]) as remote:
+            self.assertEqual([0.5, 0.25], self.module.embed_query('What is  RAG?', settings))
+            self.assertEqual('miss', self.module._REQUEST.query_cache)
+            self.assertEqual([0.5, 0.25], self.module.embed_query(' What is RAG? ', settings))
+            self.assertEqual('memory', self.module._REQUEST.query_cache)
+            # A fresh process only has the shared SQLite tier
+            self.module._QUERY_CACHES.clear()
+            self.assertEqual([0.5, 0.25], self.module.embed_query('What is RAG?', settings))
+            self.assertEqual('disk', self.module._REQUEST.query_cache)
+        self.assertEqual(1, remote.call_count)
+        self.assertEqual({'hits_memory': 0, 'hits_disk': 1, 'misses': 0},
+                         self.module.query_cache(settings).stats())
+
     def test_assemble_snippet_deduplicates(self):
         self.module._token_len = lambda text: len(text)
 
@@ -68,8 +129,93 @@ class RagRetrieveTests(TestCase):
         self.assertEqual(1, len(used))
         self.assertEqual(0, used[0]['chunk_index'])
 
+    def test_cite_bits_prefer_real_pages(self):
+        cite = self.module._cite_bits
+        self.assertEqual(['pp. 3-4'], cite({'chunk_index': 7, 'page_range': '3-4', 'page_unit': 'page'}))
+        self.assertEqual(['slide 2'], cite({'chunk_index': 1, 'page_range': '2', 'page_unit': 'slide'}))
+        self.assertEqual(['chunk 5', 'sheet Q1'], cite({'chunk_index': 5, 'section': 'Q1', 'page_unit': 'sheet'}))
+        self.assertEqual(['chunk 2'], cite({'chunk_index': 2, 'page_range': '3'}))
+
     def test_assemble_snippet_fallback(self):
         self.module._token_len = lambda text: len(text)
         result, used = self.module.assemble_snippet([], 'question', max_tokens=10)
         self.assertIn('No highly relevant passages found.', result)
         self.assertEqual([], used)
+
+    def test_ensure_config_loads_each_file_once(self):
+        ini_path = _write_ini('[qdrant]\ncollection = "first"\n')
+        try:
+            with mock.patch.object(self.module, 'load_ini', wraps=self.module.load_ini) as load:
+                settings = self.module.ensure_config(ini_path)
+                self.assertIs(settings, self.module.ensure_config(ini_path))
+                self.assertEqual(1, load.call_count)
+                os.utime(ini_path, (0, 0))
+                self.module.ensure_config(ini_path)
+                self.assertEqual(2, load.call_count)
+        finally:
+            os.unlink(ini_path)
+        self.assertEqual('first', settings.collection)
+        self.assertEqual('nhlbi', self.module.QDRANT_COLLECTION)
+
+    def test_retrieve_reuses_warm_client(self):
+        ini_path = _write_ini('[qdrant]\ncollection = "warm"\n')
+
+        class Point:
+            payload = {'document_id': 3, 'chunk_index': 1, 'filename': 'a.txt',
+                       'chunk_text': 'Warm clients make testing quick.'}
+            score = 0.9
+
+        client = mock.Mock()
+        client.query_points.return_value = mock.Mock(points=[Point()])
+        request = {'question': 'testing warm', 'chat_id': 'c1', 'user': 'u1', 'config_path': ini_path}
+        try:
+            with mock.patch.object(self.module, 'QdrantClient', return_value=client) as ctor, \
+                    mock.patch.object(self.module, 'embed_query', return_value=[0.0, 1.0]):
+                first = self.module.retrieve(dict(request))
+                second = self.module.retrieve(dict(request))
+        finally:
+            os.unlink(ini_path)
+
+        self.assertEqual(1, ctor.call_count)
+        self.assertTrue(first['ok'])
+        self.assertEqual('warm', second['collection'])
+        self.assertEqual(3, first['citations'][0]['document_id'])
+        self.assertIn('result', first['query_cache'])
+        with self.assertRaises(ValueError):
+            self.module.retrieve({'question': 'q'})
+
+    def test_search_params_follow_quantization_profile(self):
+        ini_path = _write_ini('[qdrant]\nquantization = "binary"\nhnsw_ef = 128\n')
+        try:
+            settings = self.module.load_ini(ini_path)
+        finally:
+            os.unlink(ini_path)
+        fake_models = mock.Mock()
+        fake_models.SearchParams.side_effect = lambda **kw: kw
+        fake_models.QuantizationSearchParams.side_effect = lambda **kw: kw
+        with mock.patch.object(self.module, 'qmodels', fake_models):
+            params = self.module.search_params(settings.search)
+            self.assertEqual(128, params['hnsw_ef'])
+            self.assertEqual({'ignore': False, 'rescore': True, 'oversampling': 3.0}, params['quantization'])
+
+            # The module defaults (quantization none) need no search params
+            self.assertIsNone(self.module.search_params())
+
+    def test_query_dimension_mismatch_fails_clearly(self):
+        ini_path = _write_ini('[azure-embedding]\napi_key = "KEY"\nurl = "https://example"\n'
+                              'deployment_name = "text-embedding-3-large"\ndimensions = 512\n')
+        try:
+            settings = self.module.load_ini(ini_path)
+        finally:
+            os.unlink(ini_path)
+        self.assertEqual(512, settings.embed_dim)
+        self.assertTrue(self.module._embedding_model(settings).endswith('@512'))
+        self.assertEqual({'input': 'q', 'dimensions': 512}, self.module._embedding_body({'input': 'q'}, settings))
+
+        client = mock.Mock()
+        client.get_collection.return_value = mock.Mock(config=mock.Mock(params=mock.Mock(vectors=mock.Mock(size=3072))))
+        with self.assertRaisesRegex(RuntimeError, 'stores 3072'):
+            self.module.check_query_dim(client, [0.0] * 512, settings)
+        self.module.check_query_dim(client, [0.0] * 3072, settings)
+        # A mismatch re-reads the size once (the alias may have moved); matches use the cached value
+        self.assertEqual(2, client.get_collection.call_count)
@@ -0,0 +1,23 @@
+import importlib
+from unittest import TestCase, mock
+
+import tests.python.stubs  # noqa: F401  ensures optional deps are stubbed before imports
+
+
+class RagServiceTests(TestCase):
+    def setUp(self):
+        self.module = importlib.reload(importlib.import_module('inc.rag_service'))
+
+    def test_retrieve_op_passes_request_through(self):
+        with mock.patch.object(self.module.rag_retrieve, 'retrieve', return_value={'ok': True}) as retrieve:
+            reply = self.module.handle_request({'op': 'retrieve', 'question': 'q', 'chat_id': 'c', 'user': 'u'})
+        self.assertEqual({'ok': True}, reply)
+        retrieve.assert_called_once_with({'question': 'q', 'chat_id': 'c', 'user': 'u'})
+
+    def test_missing_fields_match_cli_error(self):
+        self.assertEqual({'error': 'missing question/chat_id/user'},
+                         self.module.handle_request({'op': 'retrieve', 'question': 'q'}))
+
+    def test_unknown_op_raises(self):
+        with self.assertRaises(ValueError):
+            self.module.handle_request({'op': 'nope'})
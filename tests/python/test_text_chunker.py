@@ -0,0 +1,77 @@
+import hashlib
+import io
+from unittest import TestCase
+
+import tests.python.stubs  # noqa: F401
+
+from inc.text_chunker import TokenChunker, iter_text_chunks
+
+
+class CharEncoding:
+    def encode(self, text):
+        return [ord(ch) for ch in text]
+
+    def decode(self, tokens):
+        return ''.join(chr(t) for t in tokens)
+
+
+def reference_chunks(text, max_tokens, overlap):
+    toks = list(text)
+    out, start = [], 0
+    while start < len(toks):
+        end = min(start + max_tokens, len(toks))
+        out.append(''.join(toks[start:end]))
+        if end == len(toks):
+            break
+        start = end - overlap
+    return out
+
+
+class TextChunkerTests(TestCase):
+    def test_small_blocks_match_whole_text_chunking(self):
+        text = ' '.join(f'word{i}' for i in range(500))
+        hasher = hashlib.sha256()
+        stream = io.BytesIO(text.encode('utf-8'))
+
+        chunks = list(iter_text_chunks(stream, CharEncoding(), 37, 5, hasher=hasher, read_size=64))
+
+        self.assertEqual(reference_chunks(text, 37, 5), chunks)
+        self.assertTrue(all(len(c) == 37 for c in chunks[:-1]))
+        self.assertEqual(hashlib.sha256(text.encode('utf-8')).hexdigest(), hasher.hexdigest())
+
+    def test_each_character_is_encoded_once(self):
+        text = 'alpha beta gamma delta ' * 200
+        chunker = TokenChunker(CharEncoding(), 50, 10)
+
+        list(iter_text_chunks(io.BytesIO(text.encode('utf-8')), None, 0, chunker=chunker, read_size=16))
+
+        self.assertEqual(len(text.strip()), chunker.tokens_seen)
+
+    def test_multibyte_characters_split_across_blocks(self):
+        text = 'café naïve 日本語 ' * 20
+        chunks = list(iter_text_chunks(io.BytesIO(text.encode('utf-8')), CharEncoding(), 1000, 0, read_size=3))
+        self.assertEqual([text.strip()], chunks)
+
+    def test_blank_input_yields_nothing(self):
+        self.assertEqual([], list(iter_text_chunks(io.BytesIO(b' \n\n '), CharEncoding(), 10, 2)))
+
+    def test_structure_marks_label_chunks_and_prefer_page_breaks(self):
+        pages = ['--- Page 1 ---\n' + 'a' * 30 + '\n', '--- Page 2 ---\n' + 'b' * 30 + '\n', '--- Page 3 ---\nccc']
+        text = ''.join(pages)
+        data = text.encode('utf-8')
+        marks = [[data.index(f'--- Page {n} ---'.encode()), str(n)] for n in (1, 2, 3)]
+
+        chunks = list(iter_text_chunks(io.BytesIO(data), CharEncoding(), 60, 5, read_size=10,
+                                       structure={'v': 1, 'unit': 'page', 'marks': marks}))
+
+        # Every page fits in 60 tokens but two do not, so each chunk ends at a page marker
+        self.assertEqual([['1'], ['2'], ['3']], [labels for _, labels in chunks])
+        self.assertEqual(pages, [chunk for chunk, _ in chunks])
+
+    def test_chunk_spanning_pages_reports_each_label(self):
+        text = '--- Page 1 ---\nx\n--- Page 2 ---\ny\n--- Page 3 ---\nz'
+        data = text.encode('utf-8')
+        marks = [[data.index(f'--- Page {n} ---'.encode()), str(n)] for n in (1, 2, 3)]
+        chunks = list(iter_text_chunks(io.BytesIO(data), CharEncoding(), 1000, 0,
+                                       structure={'v': 1, 'unit': 'page', 'marks': marks}))
+        self.assertEqual([(text, ['1', '2', '3'])], chunks)
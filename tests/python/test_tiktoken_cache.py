@@ -0,0 +1,51 @@
+import importlib
+import os
+import tempfile
+from types import SimpleNamespace
+from unittest import TestCase, mock
+
+import tests.python.stubs  # noqa: F401  ensures optional deps are stubbed before imports
+
+
+def _fake_encoding(name, pat_str, mergeable_ranks, special_tokens):
+    return SimpleNamespace(name=name, _pat_str=pat_str, _mergeable_ranks=mergeable_ranks,
+                           _special_tokens=special_tokens)
+
+
+class TiktokenCacheTests(TestCase):
+    def setUp(self):
+        self.module = importlib.reload(importlib.import_module('inc.tiktoken_cache'))
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        for name in os.listdir(self.dir):
+            os.unlink(os.path.join(self.dir, name))
+        os.rmdir(self.dir)
+
+    def test_round_trip_preserves_ranks_and_specials(self):
+        ranks = {bytes([i]): i for i in range(256)}
+        ranks.update({b'he': 256, 'llo wörld'.encode('utf-8'): 257, b'\x00\xff': 258})
+        source = _fake_encoding('demo_base', r'\w+|\s+', ranks, {'<|endoftext|>': 300})
+        path = self.module.cache_file('demo_base', self.dir)
+        self.assertEqual(259, self.module.write_encoding(source, path))
+
+        built = {}
+
+        def capture(name, **kwargs):
+            built.update(kwargs, name=name)
+            return 'encoding'
+
+        with mock.patch.object(self.module.tiktoken, 'Encoding', capture, create=True):
+            self.assertEqual('encoding', self.module.load_encoding('demo_base', self.dir))
+        self.assertEqual('demo_base', built['name'])
+        self.assertEqual(ranks, built['mergeable_ranks'])
+        self.assertEqual({'<|endoftext|>': 300}, built['special_tokens'])
+        self.assertEqual(r'\w+|\s+', built['pat_str'])
+
+    def test_missing_or_corrupt_file_falls_back_to_tiktoken(self):
+        with open(self.module.cache_file('cl100k_base', self.dir), 'wb') as f:
+            f.write(b'not an encoding file')
+        with mock.patch.object(self.module.tiktoken, 'get_encoding', return_value='fallback') as get:
+            self.assertEqual('fallback', self.module.load_encoding('cl100k_base', self.dir))
+            self.assertEqual('fallback', self.module.load_encoding('o200k_base', self.dir))
+        self.assertEqual(2, get.call_count)
@@ -0,0 +1,125 @@
+import importlib
+import os
+import tempfile
+import threading
+from unittest import TestCase
+
+import tests.python.stubs  # noqa: F401  ensures optional deps are stubbed before imports
+
+
+class TokenCounterTests(TestCase):
+    def setUp(self):
+        self.module = importlib.reload(importlib.import_module('token_counter'))
+
+    def test_count_batch_with_mixed_encodings(self):
+        reply = self.module.handle_request({
+            'op': 'count',
+            'encoding': 'cl100k_base',
+            'items': [
+                {'text': 'abc'},
+                {'text': 'hello', 'encoding': 'o200k_base'},
+                {'text': None},
+            ],
+        })
+        self.assertTrue(reply['ok'])
+        self.assertEqual([3, 5, 0], reply['counts'])
+        self.assertTrue({'cl100k_base', 'o200k_base'} <= set(self.module.encoding_registry.loaded_encodings()))
+
+    def test_messages_use_registry_overheads(self):
+        messages = [{'role': 'user', 'content': 'hi', 'name': 'x'}]
+        # o200k family: 3 per message + 1 per name; cl100k family: 4 and -1
+        self.assertEqual(3 + 4 + 2 + 1 + 1 + 3, self.module.num_tokens_from_messages(messages, 'gpt-5-mini'))
+        self.assertEqual(4 + 4 + 2 + 1 - 1 + 3, self.module.num_tokens_from_messages(messages, 'gpt-4-32k'))
+
+    def test_unknown_op_raises(self):
+        with self.assertRaises(ValueError):
+            self.module.handle_request({'op': 'nope'})
+
+    def test_socket_round_trip(self):
+        local_service = importlib.import_module('local_service')
+        sock_dir = tempfile.mkdtemp()
+        path = os.path.join(sock_dir, 'tc.sock')
+        server = local_service.make_server(path, self.module.handle_request)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            reply = local_service.request_unix(path, {'op': 'count', 'texts': ['ab', 'abcd']})
+            self.assertEqual({'ok': True, 'counts': [2, 4]}, reply)
+            error = local_service.request_unix(path, {'op': 'bogus'})
+            self.assertFalse(error['ok'])
+        finally:
+            server.shutdown()
+            server.server_close()
+            os.unlink(path)
+            os.rmdir(sock_dir)
+
+    def test_fit_budgets_prefix_and_suffix(self):
+        result = self.module.fit_budgets('héllo wörld', [4, 50], 'cl100k_base')
+        self.assertEqual(11, result['total_tokens'])
+        short, roomy = result['fits']
+        self.assertEqual({'budget': 4, 'prefix_chars': 4, 'prefix_tokens': 4,
+                          'suffix_start': 7, 'suffix_tokens': 4}, short)
+        self.assertEqual(11, roomy['prefix_chars'])
+        self.assertEqual(0, roomy['suffix_start'])
+
+    def test_fit_budgets_extends_cut_into_merged_token(self):
+        class MergingEncoding:
+            # Tiny BPE: 'abcd' encodes as ['ab', 'cd'], yet 'abc' and 'bcd' are single tokens
+            merges = {('a', 'b'): 0, ('c', 'd'): 1, ('ab', 'c'): 2, ('b', 'cd'): 3}
+
+            def encode(self, text, **_kwargs):
+                parts = list(text)
+                while True:
+                    ranked = [(self.merges[pair], i) for i, pair in enumerate(zip(parts, parts[1:]))
+                              if pair in self.merges]
+                    if not ranked:
+                        return parts
+                    _, i = min(ranked)
+                    parts[i:i + 2] = [parts[i] + parts[i + 1]]
+
+            def decode_bytes(self, tokens):
+                return ''.join(tokens).encode('utf-8')
+
+        self.module.get_encoding = lambda _name: MergingEncoding()
+        fit = self.module.fit_budgets('abcd', [1], 'toy')['fits'][0]
+        self.assertEqual({'budget': 1, 'prefix_chars': 3, 'prefix_tokens': 1,
+                          'suffix_start': 1, 'suffix_tokens': 1}, fit)
+
+    def test_fit_reads_path(self):
+        with tempfile.NamedTemporaryFile('wb', delete=False) as tmp:
+            tmp.write('abcdef'.encode('utf-8'))
+            path = tmp.name
+        try:
+            reply = self.module.handle_request({'op': 'fit', 'path': path, 'budgets': [2]})
+        finally:
+            os.unlink(path)
+        self.assertTrue(reply['ok'])
+        self.assertEqual(2, reply['fits'][0]['prefix_chars'])
+        self.assertEqual(4, reply['fits'][0]['suffix_start'])
+
+    def test_count_file_matches_whole_text(self):
+        text = ''.join(f'Line {i} with some words\n' for i in range(2000)) + 'tail without newline'
+        with tempfile.NamedTemporaryFile('wb', delete=False) as tmp:
+            tmp.write(text.encode('utf-8'))
+            path = tmp.name
+        try:
+            result = self.module.count_file(path, 'cl100k_base', segment_bytes=4096, threads=2)
+        finally:
+            os.unlink(path)
+        self.assertEqual(len(text), result['total'])
+        self.assertEqual(len(text.encode('utf-8')), result['bytes'])
+        self.assertGreater(len(result['segments']), 10)
+        self.assertEqual(result['total'], sum(result['segments']))
+
+    def test_segments_cut_after_newlines(self):
+        text = 'alpha beta\n' * 500
+        with tempfile.NamedTemporaryFile('wb', delete=False) as tmp:
+            tmp.write(text.encode('utf-8'))
+            path = tmp.name
+        try:
+            segments = list(self.module.iter_file_segments(path, segment_bytes=100))
+        finally:
+            os.unlink(path)
+        self.assertEqual(text.encode('utf-8'), b''.join(seg for _, seg in segments))
+        for _, seg in segments:
+            self.assertTrue(seg.endswith(b'\n'))
@@ -1,14 +1,36 @@
 # token_counter.py
 
+import os
 import sys
 import json
-import tiktoken
+import mmap
+import tempfile
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(APP_DIR, "inc"))
+from local_service import serve_unix  # noqa: E402
+import encoding_registry  # noqa: E402
+
+DEFAULT_ENCODING = encoding_registry.DEFAULT_CHAT_ENCODING
+
+# Deployment names in requests resolve through the chat INI's [azure-*] sections
+encoding_registry.load_ini(encoding_registry.default_config_path(APP_DIR))
+
+def default_socket_path() -> str:
+    return os.getenv("TOKEN_COUNTER_SOCKET") or os.path.join(tempfile.gettempdir(), "nhlbi_token_counter.sock")
+
+def get_encoding(encoding_name: str):
+    """
+    Returns the tiktoken encoding for an encoding, deployment or model name,
+    loading each one at most once per process.
+    """
+    return encoding_registry.get_encoding(encoding_name)
 
 def num_tokens_from_string(string: str, encoding_name: str) -> int:
     """
     Returns the number of tokens in a text string.
     """
-    encoding = tiktoken.get_encoding(encoding_name)
+    encoding = get_encoding(encoding_name)
     num_tokens = len(encoding.encode(string))
     return num_tokens
 
@@ -16,20 +38,8 @@ def num_tokens_from_messages(messages, model: str) -> int:
     """
     Returns the number of tokens used by a list of messages for chat models.
     """
-    try:
-        encoding = tiktoken.encoding_for_model(model)
-    except KeyError:
-        print(f"Warning: model {model} not found. Using cl100k_base encoding.")
-        encoding = tiktoken.get_encoding("cl100k_base")
-
-    if model.startswith("gpt-3.5-turbo") or model.startswith("gpt-4"):
-        tokens_per_message = 4  # Every message follows <|start|>{role/name}\n{content}<|end|>
-        tokens_per_name = -1  # If there's a name, the role is omitted
-    elif model.startswith("gpt-4o"):
-        tokens_per_message = 3
-        tokens_per_name = 1
-    else:
-        raise NotImplementedError(f"Token counting not implemented for model {model}.")
+    encoding = get_encoding(model)
+    tokens_per_message, tokens_per_name = encoding_registry.message_overheads(model)
 
     num_tokens = 0
     for message in messages:
@@ -41,11 +51,288 @@ def num_tokens_from_messages(messages, model: str) -> int:
     num_tokens += 3  # Every reply is primed with <|start|>assistant<|message|>
     return num_tokens
 
+def _is_continuation(data: bytes, pos: int) -> bool:
+    return 0 < pos < len(data) and (data[pos] & 0xC0) == 0x80
+
+def _char_offset(data: bytes, pos: int, forward: bool) -> int:
+    """Code-point offset of byte `pos`, moved forward or back to a character boundary."""
+    while _is_continuation(data, pos):
+        pos += 1 if forward else -1
+    return len(data[:pos].decode("utf-8"))
+
+def fit_budgets(text: str, budgets, encoding_name: str) -> dict:
+    """
+    Encodes the text once and returns, for every budget, the character length
+    of the longest prefix and the character offset of the longest suffix
+    that fit in that many tokens. Offsets count code points, so they can be
+    fed straight to mb_substr(). The token-aligned cut is then extended
+    character by character into the next token, since BPE can merge a few
+    more characters into the last token without going over the budget.
+    """
+    encoding = get_encoding(encoding_name)
+    tokens = encoding.encode(text)
+    data = text.encode("utf-8")
+    total_chars = len(text)
+    fits = []
+    for budget in budgets:
+        budget = max(0, int(budget))
+        if budget >= len(tokens):
+            fits.append({"budget": budget, "prefix_chars": total_chars, "prefix_tokens": len(tokens),
+                         "suffix_start": 0, "suffix_tokens": len(tokens)})
+            continue
+
+        # Prefix: byte length of the first `take` tokens, pulled back to a character
+        # boundary. Re-encoding a cut can merge differently, so confirm against the
+        # (budget-sized, cheap) prefix and give up one token at a time if needed.
+        take = budget
+        while True:
+            end = len(encoding.decode_bytes(tokens[:take])) if take else 0
+            while _is_continuation(data, end):
+                end -= 1
+            prefix_chars = len(data[:end].decode("utf-8"))
+            prefix_tokens = len(encoding.encode(text[:prefix_chars])) if prefix_chars else 0
+            if prefix_tokens <= budget or take == 0:
+                break
+            take -= 1
+        # Part of the next token may still fit once re-encoded (BPE merges it into
+        # the last one): try each longer cut up to the end of budget + 1 tokens
+        limit = _char_offset(data, len(encoding.decode_bytes(tokens[:budget + 1])), forward=True)
+        for chars in range(prefix_chars + 1, limit + 1):
+            count = len(encoding.encode(text[:chars]))
+            if count <= budget:
+                prefix_chars, prefix_tokens = chars, count
+
+        # Suffix: same idea from the other end, pushing forward to a character boundary.
+        take = budget
+        while True:
+            start = len(data) - (len(encoding.decode_bytes(tokens[-take:])) if take else 0)
+            while _is_continuation(data, start):
+                start += 1
+            suffix_start = len(data[:start].decode("utf-8"))
+            suffix_tokens = len(encoding.encode(text[suffix_start:])) if suffix_start < total_chars else 0
+            if suffix_tokens <= budget or take == 0:
+                break
+            take -= 1
+        limit = _char_offset(data, len(data) - len(encoding.decode_bytes(tokens[-(budget + 1):])), forward=False)
+        for start in range(suffix_start - 1, limit - 1, -1):
+            count = len(encoding.encode(text[start:]))
+            if count <= budget:
+                suffix_start, suffix_tokens = start, count
+
+        fits.append({"budget": budget, "prefix_chars": prefix_chars, "prefix_tokens": prefix_tokens,
+                     "suffix_start": suffix_start, "suffix_tokens": suffix_tokens})
+    return {"total_tokens": len(tokens), "total_chars": total_chars, "fits": fits}
+
+def _read_text_source(source: str) -> str:
+    if source == "-":
+        data = sys.stdin.buffer.read()
+    else:
+        with open(source, "rb") as f:
+            data = f.read()
+    return data.decode("utf-8", errors="replace")
+
+# ---------------- Streaming file counts ----------------
+FILE_SEGMENT_BYTES = 2 * 1024 * 1024
+_SEARCH_WINDOW = 1024 * 1024
+_ASCII_WS = b" \t\r\n\x0b\x0c"
+
+def _safe_after_newline(byte: int) -> bool:
+    # Printable ASCII that no pre-tokenizer pattern (cl100k/o200k) can glue onto the
+    # preceding newline; o200k lets punctuation runs absorb "[\r\n/]*", hence '/'.
+    return 0x21 <= byte <= 0x7E and byte != 0x2F
+
+def _safe_word_space(buf, sp: int, limit: int) -> bool:
+    # "abc def" tokenizes as "abc" + " def", so a cut just before that space is safe
+    if sp <= 0 or sp + 1 >= limit:
+        return False
+    prev, nxt = buf[sp - 1], buf[sp + 1]
+    return prev < 0x80 and nxt < 0x80 and chr(prev).isalnum() and chr(nxt).isalpha()
+
+def _aligned_cut(buf, target: int, limit: int, floor: int = 0, exact_only: bool = False) -> int:
+    """
+    Byte offset in (floor, limit] near `target` where the text can be split
+    without changing how it tokenizes, so per-segment counts add up to the
+    whole-file count. Prefers a newline, then a word-starting space, looking
+    forward first and then back towards `floor`. With exact_only, returns -1
+    instead of falling back to a plain character boundary.
+    """
+    lo = max(floor + 1, target - _SEARCH_WINDOW)
+    hi = min(limit, target + _SEARCH_WINDOW)
+
+    pos = target
+    while True:
+        nl = buf.find(b"\n", pos, hi)
+        if nl < 0 or nl + 1 >= limit:
+            break
+        if _safe_after_newline(buf[nl + 1]):
+            return nl + 1
+        pos = nl + 1
+    pos = target
+    while True:
+        nl = buf.rfind(b"\n", lo - 1, pos)
+        if nl < 0:
+            break
+        if nl + 1 < limit and _safe_after_newline(buf[nl + 1]):
+            return nl + 1
+        pos = nl
+
+    pos = target
+    while True:
+        sp = buf.find(b" ", pos, hi)
+        if sp < 0:
+            break
+        if _safe_word_space(buf, sp, limit):
+            return sp
+        pos = sp + 1
+    pos = target
+    while True:
+        sp = buf.rfind(b" ", lo, pos)
+        if sp < 0:
+            break
+        if _safe_word_space(buf, sp, limit):
+            return sp
+        pos = sp
+
+    if exact_only:
+        return -1
+    # Last resort (one huge run without spaces or newlines): any UTF-8 character boundary
+    pos = min(target, limit)
+    while pos < limit and (buf[pos] & 0xC0) == 0x80:
+        pos += 1
+    return pos
+
+def iter_file_segments(path: str, segment_bytes: int = FILE_SEGMENT_BYTES):
+    """
+    Yields (byte_offset, bytes) segments of roughly `segment_bytes`, cut only at
+    tokenization-safe boundaries. Memory-maps the file when the OS allows it and
+    otherwise streams it through a small carry buffer.
+    """
+    with open(path, "rb") as f:
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, OSError):  # empty file, pipe, ...
+            mm = None
+        if mm is not None:
+            with mm:
+                size = len(mm)
+                start = 0
+                while start < size:
+                    end = size if size - start <= segment_bytes else _aligned_cut(mm, start + segment_bytes, size, start)
+                    yield start, mm[start:end]
+                    start = end
+            return
+
+        offset = 0
+        carry = b""
+        eof = False
+        while not eof:
+            block = f.read(segment_bytes * 2)
+            eof = not block
+            carry += block
+            while len(carry) > segment_bytes * 2 or (eof and carry):
+                if eof and len(carry) <= segment_bytes:
+                    end = len(carry)
+                else:
+                    # Without a safe cut, read on (up to a cap) rather than split inexactly
+                    end = _aligned_cut(carry, segment_bytes, len(carry), exact_only=eof or len(carry) < segment_bytes * 16)
+                    if end < 0:
+                        if not eof:
+                            break
+                        end = len(carry)
+                yield offset, carry[:end]
+                offset += end
+                carry = carry[end:]
+
+def count_file(path: str, encoding_name: str, segment_bytes: int = FILE_SEGMENT_BYTES, threads: int = 0) -> dict:
+    """
+    Exact token count of a (possibly very large) text file: aligned segments are
+    encoded with encode_ordinary_batch across threads, a handful at a time, so
+    memory stays bounded by threads x segment_bytes.
+    """
+    encoding = get_encoding(encoding_name)
+    threads = threads or min(8, os.cpu_count() or 1)
+    counts = []
+    pending = []
+    size = 0
+
+    def _flush():
+        texts = [seg.decode("utf-8", errors="replace") for seg in pending]
+        counts.extend(len(toks) for toks in encoding.encode_ordinary_batch(texts, num_threads=threads))
+        pending.clear()
+
+    for offset, seg in iter_file_segments(path, segment_bytes):
+        size = offset + len(seg)
+        pending.append(seg)
+        if len(pending) >= threads:
+            _flush()
+    if pending:
+        _flush()
+    return {"total": sum(counts), "segments": counts, "bytes": size, "segment_bytes": segment_bytes}
+
+def handle_request(req: dict) -> dict:
+    """
+    Serves one request of the socket protocol. A single round trip can count
+    many texts, each with its own encoding:
+
+      {"op": "count", "encoding": "cl100k_base", "texts": ["...", "..."]}
+      {"op": "count", "items": [{"text": "...", "encoding": "o200k_base"}, ...]}
+      {"op": "messages", "model": "gpt-4", "messages": [...]}
+      {"op": "fit", "encoding": "cl100k_base", "budgets": [800, 400], "text": "..."}
+      {"op": "fit", "encoding": "cl100k_base", "budgets": [800], "path": "/tmp/paste.txt"}
+      {"op": "count_file", "encoding": "cl100k_base", "path": "/var/rag/parsed/doc.txt"}
+      {"op": "ping"}
+    """
+    op = req.get("op", "count")
+    if op == "ping":
+        return {"ok": True, "encodings_loaded": encoding_registry.loaded_encodings()}
+    if op == "count":
+        default_encoding = req.get("encoding") or DEFAULT_ENCODING
+        if "items" in req:
+            pairs = [(item.get("text") or "", item.get("encoding") or default_encoding) for item in req["items"]]
+        else:
+            pairs = [(text or "", default_encoding) for text in req.get("texts", [])]
+        return {"ok": True, "counts": [num_tokens_from_string(text, enc) for text, enc in pairs]}
+    if op == "fit":
+        text = req["text"] if "text" in req else _read_text_source(req["path"])
+        result = fit_budgets(text, req.get("budgets") or [], req.get("encoding") or DEFAULT_ENCODING)
+        result["ok"] = True
+        return result
+    if op == "count_file":
+        result = count_file(req["path"], req.get("encoding") or DEFAULT_ENCODING)
+        result["ok"] = True
+        return result
+    if op == "messages":
+        return {"ok": True, "count": num_tokens_from_messages(req.get("messages") or [], req.get("model") or "gpt-4")}
+    raise ValueError(f"Unknown op: {op}")
+
+def serve(socket_path: str):
+    # Warm the default encoding so the first request doesn't pay for the load
+    get_encoding(DEFAULT_ENCODING)
+    serve_unix(socket_path, handle_request, name="token_counter")
+
 def main():
+    if len(sys.argv) >= 2 and sys.argv[1] == "serve":
+        serve(sys.argv[2] if len(sys.argv) >= 3 else default_socket_path())
+        return
+
+    if len(sys.argv) >= 5 and sys.argv[1] == "fit":
+        # fit <encoding> <path|-> <budget> [<budget> ...]; text comes from a file or stdin, never argv
+        text = _read_text_source(sys.argv[3])
+        print(json.dumps(fit_budgets(text, [int(b) for b in sys.argv[4:]], sys.argv[2])))
+        return
+
+    if len(sys.argv) >= 4 and sys.argv[1] == "file":
+        # file <encoding> <path>: exact streaming count of a parsed document
+        print(json.dumps(count_file(sys.argv[3], sys.argv[2])))
+        return
+
     if len(sys.argv) < 4:
         print("Usage: python token_counter.py <mode> <model/encoding_name> <text_or_messages_json>")
+        print("       python token_counter.py fit <encoding_name> <path|-> <budget> [<budget> ...]")
+        print("       python token_counter.py file <encoding_name> <path>")
+        print("       python token_counter.py serve [socket_path]")
         sys.exit(1)
-    
+
     mode = sys.argv[1]  # Should be 'text' or 'messages'
     model_or_encoding = sys.argv[2]
     input_data = sys.argv[3]
@@ -58,11 +345,10 @@ def main():
         messages = json.loads(messages_json)
         num_tokens = num_tokens_from_messages(messages, model_or_encoding)
     else:
-        print("Invalid mode. Use 'text' or 'messages'.")
+        print("Invalid mode. Use 'text', 'messages', 'fit', 'file' or 'serve'.")
         sys.exit(1)
 
     print(num_tokens)
 
 if __name__ == "__main__":
     main()
-